@@ -0,0 +1,167 @@
+import ctypes
+import multiprocessing
+import traceback
+from collections import deque
+
+import numpy as np
+
+from examples_iterator import ExamplesIterator, as_model_input
+from settings import PREFETCH_DEPTH_DEFAULT
+
+
+def _load_batches(examples_iterator: ExamplesIterator, worker_index: int, cubes_buffer, tasks_queue, ready_queue):
+    """
+    The loop of a worker: build the cubes of the batches received and write them in their slot of the ring buffer.
+
+    :param examples_iterator: the iterator, inherited when forking the worker
+    :param worker_index: the index of the worker
+    :param cubes_buffer: the shared ring buffer of shape (prefetch_depth, batch_size) + shape of cubes
+    :param tasks_queue: the queue of tasks (batch_number, slot, rows); None to stop the worker
+    :param ready_queue: the queue where the (batch_number, error, worker_index, cube cache statistics) of built
+                        batches are put
+    :return:
+    """
+    cube_cache = examples_iterator.get_cube_cache()
+    for task in iter(tasks_queue.get, None):
+        batch_number, slot, rows = task
+        try:
+            examples_iterator.get_cubes(rows, out=cubes_buffer[slot, 0:len(rows)])
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        statistics = None if cube_cache is None else cube_cache.get_statistics()
+        ready_queue.put((batch_number, error, worker_index, statistics))
+
+
+class BatchLoader:
+    """
+    A generator of the batches of an `ExamplesIterator` built ahead of training by worker processes.
+
+    Workers are forked with the iterator and build the cubes of batches in parallel. Cubes are written in a ring
+    buffer of `prefetch_depth` slots in shared memory : the trainer reads them through a view of the buffer, without
+    any pickling or copy. Only the rows of the manifest of the examples of batches are sent to workers. The buffer
+    holds cubes with the type of the representation: compact cubes are cast to the float type of the model when
+    yielded.
+
+    Batches are yielded in the order of the iterator, with its labels. The iterator is shuffled (using its
+    `on_epoch_end`) when the first batch of the next epoch is requested, hence after the callbacks of the epoch.
+
+    As cubes are read in place, a batch is valid until the next batch is requested: this is the case with
+    `fit_generator(..., workers=0)`.
+
+    Each worker has its own copy of the `CubeCache` of the iterator, if any (its disk tier can be shared): the
+    statistics of the caches of workers are sent with the batches built (see `get_cube_cache_statistics`).
+
+    """
+
+    def __init__(self, examples_iterator: ExamplesIterator, nb_workers: int,
+                 prefetch_depth: int = PREFETCH_DEPTH_DEFAULT):
+        """
+        :param examples_iterator: the iterator of examples to load
+        :param nb_workers: the number of worker processes building batches
+        :param prefetch_depth: the number of batches that can be built ahead of training (slots of the ring buffer)
+        """
+        self._examples_iterator = examples_iterator
+        self._prefetch_depth = prefetch_depth
+
+        batch_size = examples_iterator.get_batch_size()
+        buffer_shape = (prefetch_depth, batch_size) + examples_iterator.get_cube_shape()
+        cube_dtype = examples_iterator.get_cube_dtype()
+        raw_buffer = multiprocessing.RawArray(ctypes.c_uint8, int(np.prod(buffer_shape)) * cube_dtype.itemsize)
+        self._cubes_buffer = np.frombuffer(raw_buffer, dtype=cube_dtype).reshape(buffer_shape)
+
+        context = multiprocessing.get_context("fork")
+        self._tasks_queue = context.SimpleQueue()
+        self._ready_queue = context.SimpleQueue()
+        self._workers = [context.Process(target=_load_batches, daemon=True,
+                                         args=(examples_iterator, worker_index, self._cubes_buffer,
+                                               self._tasks_queue, self._ready_queue))
+                         for worker_index in range(nb_workers)]
+        for worker in self._workers:
+            worker.start()
+
+        self._cube_cache_statistics = [None] * nb_workers
+        self._free_slots = deque(range(prefetch_depth))
+        self._nb_epochs_started = 0
+        self._batches = self._generate_batches()
+
+    def __len__(self):
+        """
+        :return: the number of batches per epoch
+        """
+        return len(self._examples_iterator)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._batches)
+
+    def _generate_batches(self):
+        """
+        Yield the batches (cubes, ys) epoch after epoch.
+
+        :return:
+        """
+        while True:
+            if self._nb_epochs_started > 0:
+                self._examples_iterator.on_epoch_end()
+            self._nb_epochs_started += 1
+
+            # The batches of the epoch are fixed once it starts
+            batches_rows = [self._examples_iterator.get_batch_rows(index) for index in range(len(self))]
+            pending_slots = dict()
+            built_batches = set()
+            nb_submitted = 0
+
+            for batch_number, rows in enumerate(batches_rows):
+                # Filling the free slots with the next batches
+                while len(self._free_slots) > 0 and nb_submitted < len(batches_rows):
+                    slot = self._free_slots.popleft()
+                    pending_slots[nb_submitted] = slot
+                    self._tasks_queue.put((nb_submitted, slot, batches_rows[nb_submitted]))
+                    nb_submitted += 1
+
+                # Waiting for the batch, that can come after others
+                while batch_number not in built_batches:
+                    built_batch_number, error, worker_index, statistics = self._ready_queue.get()
+                    self._cube_cache_statistics[worker_index] = statistics
+                    if error is not None:
+                        self.close()
+                        raise RuntimeError(f"A worker failed to build a batch:\n{error}")
+                    built_batches.add(built_batch_number)
+
+                built_batches.remove(batch_number)
+                slot = pending_slots.pop(batch_number)
+
+                yield as_model_input(self._cubes_buffer[slot, 0:len(rows)]), self._examples_iterator.get_ys(rows)
+
+                # The batch has been used: its slot can be reused
+                self._free_slots.append(slot)
+
+    def get_cube_cache_statistics(self):
+        """
+        :return: the list of the last statistics of the cube cache of each worker received (see
+                 `CubeCache.get_statistics`), None for workers without any batch built or without cache
+        """
+        return list(self._cube_cache_statistics)
+
+    def close(self):
+        """
+        Stop the workers.
+
+        :return:
+        """
+        for _ in self._workers:
+            self._tasks_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,226 @@
+import os
+import pickle
+import time
+
+import keras
+import numpy as np
+
+from settings import CHECKPOINT_MODEL_FILE_NAME, CHECKPOINT_STATE_FILE_NAME
+
+
+class LogEpochBatchCallback(keras.callbacks.LambdaCallback):
+    """
+    Callback to log batch and epoch metrics.
+
+    LambdaCallback are basically wrappers of function that get called after each batch or epoch.
+
+    From Keras documentation : https://keras.io/callbacks/
+        > "on_epoch_end: logs include acc and loss, and optionally include val_loss (if validation is enabled in fit)
+        > and val_acc (if validation and accuracy monitoring are enabled).
+        > on_batch_begin: logs include size, the number of samples in the current batch.
+        > on_batch_end: logs include loss, and optionally acc (if accuracy monitoring is enabled)."
+    """
+
+    def _on_batch_begin(self, batch, logs=None):
+        self.logger.debug(f"batch {batch} ; size {logs['size']}")
+
+    def _on_batch_end(self, batch, logs=None):
+        self.logger.debug("loss {:10.4f}".format(logs["loss"]))
+
+    def _on_epoch_begin(self, epoch, logs=None):
+        self.logger.debug(f"starting epoch {epoch}")
+
+    def _on_epoch_end(self, epoch, logs=None):
+        self.logger.debug(f"ending epoch {epoch}" + " ; accuracy  {:.2%} ; loss {:10.4f}".format(logs["acc"],
+                                                                                                 logs["loss"]))
+
+    def __init__(self, logger):
+        self.logger = logger
+        super().__init__(on_epoch_begin=self._on_epoch_begin,
+                         on_epoch_end=self._on_epoch_end,
+                         on_batch_begin=self._on_batch_begin,
+                         on_batch_end=self._on_batch_end)
+
+
+class FullValidationCallback(keras.callbacks.Callback):
+    """
+    Validate the model on all the validation examples every `period` epochs, when epochs are validated
+    on a subset of them.
+
+    Metrics are added to the logs of epochs with the prefix "full_val_", as NaN for epochs that aren't fully
+    validated so that all the metrics of the history have a value per epoch.
+
+    """
+
+    def __init__(self, examples_iterator, period: int):
+        """
+        :param examples_iterator: the iterator of all the validation examples
+        :param period: the number of epochs between two validations
+        """
+        super().__init__()
+        self._examples_iterator = examples_iterator
+        self._period = period
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is None:
+            return
+
+        if (epoch + 1) % self._period == 0:
+            values = self.model.evaluate_generator(self._examples_iterator)
+        else:
+            values = [np.nan] * len(self.model.metrics_names)
+
+        for name, value in zip(self.model.metrics_names, values):
+            logs[f"full_val_{name}"] = value
+
+
+class EarlyStoppingCallback(keras.callbacks.Callback):
+    """
+    Stop training when a metric of epochs hasn't improved for `patience` epochs, and keep the weights
+    of the best epoch: they are set back in the model at the end of training.
+
+    Losses are minimized, other metrics are maximized.
+
+    Its state can be saved with the checkpoints of training (see `CheckpointCallback`).
+
+    """
+
+    def __init__(self, monitor: str, patience: int, min_delta: float = 0.):
+        """
+        :param monitor: the metric of epochs to monitor (as "val_loss", "val_f1")
+        :param patience: the number of epochs without improvement after which training is stopped
+        :param min_delta: the smallest change of the metric counted as an improvement
+        """
+        super().__init__()
+        self._monitor = monitor
+        self._patience = patience
+        self._sign = -1 if "loss" in monitor else 1
+        self._min_delta = min_delta
+
+        self.best = None
+        self.best_epoch = None
+        self.best_weights = None
+        self.wait = 0
+        self.stopped = False
+
+    def get_state(self):
+        """
+        :return: the state of the callback, to resume it later (see `set_state`)
+        """
+        return dict(best=self.best, best_epoch=self.best_epoch, best_weights=self.best_weights, wait=self.wait,
+                    stopped=self.stopped)
+
+    def set_state(self, state: dict):
+        """
+        :param state: a state of the callback (see `get_state`)
+        :return:
+        """
+        vars(self).update(state)
+
+    def get_kept_epoch(self):
+        """
+        :return: the index of the epoch whose weights are kept, None if no epoch has been done
+        """
+        return self.best_epoch
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or dict()).get(self._monitor)
+        if value is None:
+            raise ValueError(f"{self._monitor} can't be monitored: the metrics of epochs are {list(logs.keys())}")
+
+        if self.best is None or self._sign * (value - self.best) > self._min_delta:
+            self.best = value
+            self.best_epoch = epoch
+            self.best_weights = self.model.get_weights()
+            self.wait = 0
+        else:
+            self.wait += 1
+            if self.wait >= self._patience:
+                self.model.stop_training = True
+                self.stopped = True
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+
+def save_checkpoint(job_folder: str, model: keras.Model, epoch: int, history: dict, iterator_state: dict,
+                    early_stopping_state: dict = None):
+    """
+    Save a checkpoint of training in a job folder.
+
+    Files are written aside and then replaced at once: a job killed while saving keeps its previous checkpoint.
+
+    :param job_folder: the folder of the job
+    :param model: the model being trained: it is saved with the state of its optimizer
+    :param epoch: the index of the last epoch done
+    :param history: the metrics of all the epochs done {metric: [values]}
+    :param iterator_state: the state of the iterator of training examples (see `ExamplesIterator.get_state`)
+    :param early_stopping_state: the state of early stopping (see `EarlyStoppingCallback.get_state`)
+    :return:
+    """
+    model_file = os.path.join(job_folder, CHECKPOINT_MODEL_FILE_NAME)
+    state_file = os.path.join(job_folder, CHECKPOINT_STATE_FILE_NAME)
+
+    model.save(model_file + ".tmp")
+    with open(state_file + ".tmp", "wb") as f:
+        pickle.dump(dict(epoch=epoch, history=history, iterator_state=iterator_state,
+                         early_stopping_state=early_stopping_state), f)
+
+    os.replace(model_file + ".tmp", model_file)
+    os.replace(state_file + ".tmp", state_file)
+
+
+class CheckpointCallback(keras.callbacks.Callback):
+    """
+    Save a checkpoint of training at the end of each epoch (see `save_checkpoint`), to resume it later.
+
+    The history of all the epochs is kept, including the ones of the training resumed.
+
+    If a deadline is given, training is stopped at the end of the epoch after which the longest epoch
+    wouldn't end before it, unless it has been stopped by another callback.
+
+    """
+
+    def __init__(self, job_folder: str, examples_iterator, history: dict = None, deadline: float = None,
+                 early_stopping: EarlyStoppingCallback = None):
+        """
+        :param job_folder: the folder of the job
+        :param examples_iterator: the iterator of training examples
+        :param history: the history of the epochs done before resuming training (optional)
+        :param deadline: the time (as given by `time.time`) before which training has to be stopped (optional)
+        :param early_stopping: the callback of early stopping, whose state is saved too (optional)
+        """
+        super().__init__()
+        self._job_folder = job_folder
+        self._examples_iterator = examples_iterator
+        self._history = dict() if history is None else history
+        self._deadline = deadline
+        self._early_stopping = early_stopping
+        self._longest_epoch_duration = 0.
+        self._epoch_start = None
+        self.stopped_before_deadline = False
+
+    def get_history(self):
+        """
+        :return: the metrics of all the epochs done {metric: [values]}
+        """
+        return self._history
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        for metric, value in (logs or dict()).items():
+            self._history.setdefault(metric, []).append(value)
+
+        early_stopping_state = None if self._early_stopping is None else self._early_stopping.get_state()
+        save_checkpoint(self._job_folder, self.model, epoch, self._history, self._examples_iterator.get_state(),
+                        early_stopping_state)
+
+        now = time.time()
+        self._longest_epoch_duration = max(self._longest_epoch_duration, now - self._epoch_start)
+        if self._deadline is not None and not self.model.stop_training and \
+                now + self._longest_epoch_duration > self._deadline:
+            self.model.stop_training = True
+            self.stopped_before_deadline = True
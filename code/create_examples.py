@@ -1,18 +1,56 @@
+import argparse
 import numpy as np
 import os
 import logging
+import shutil
 from concurrent import futures
-from pipeline_fixtures import get_current_timestamp, load_nparray
+from functools import lru_cache
+from molecules_store import list_systems, load_molecule, PROTEIN, LIGAND, MoleculesStore, write_molecules_store, \
+    save_pairs, make_manifest, make_pairs_manifest, save_manifest, get_molecules_store
+from negative_sampling import sample_negatives
+from pipeline_fixtures import get_current_timestamp
 
 from settings import EXTRACTED_GIVEN_DATA_TRAIN_FOLDER, EXTRACTED_GIVEN_DATA_VALIDATION_FOLDER, \
     EXTRACTED_PROTEIN_SUFFIX, \
     EXTRACTED_LIGAND_SUFFIX, COMMENT_DELIMITER, FEATURES_NAMES, TRAINING_EXAMPLES_FOLDER, \
     VALIDATION_EXAMPLES_FOLDER, NB_WORKERS, MAX_NB_NEG_PER_POS, TESTING_EXAMPLES_FOLDER, EXTRACTED_PREDICT_DATA_FOLDER, \
-    PREDICT_EXAMPLES_FOLDER, EXTRACTED_GIVEN_DATA_TEST_FOLDER, LOGS_FOLDER
+    PREDICT_EXAMPLES_FOLDER, EXTRACTED_GIVEN_DATA_TEST_FOLDER, LOGS_FOLDER, PAIRS_DTYPE, \
+    NB_SYSTEMS_PER_TASK, EXAMPLES_WRITE_BUFFER_SIZE, NEGATIVES_SAMPLING_SEED, MANIFEST_DTYPE
+
+
+def format_rows(molecule: np.ndarray):
+    """
+    Format the rows of a molecule as `np.savetxt` would do with its default format, but all at once.
+
+    :param molecule: the representation of a molecule
+    :return: the rows as a string
+    """
+    row_format = " ".join(["%.18e"] * molecule.shape[1]) + "\n"
+    return (row_format * molecule.shape[0]) % tuple(molecule.ravel().tolist())
+
+
+def format_comment(protein: np.ndarray, ligand: np.ndarray, protein_system: str, ligand_system: str):
+    """
+    Format the comment describing an example at the beginning of its file.
+
+    :param protein: the representation of the protein
+    :param ligand: the representation of the ligand
+    :param protein_system: the ID of the system of the protein
+    :param ligand_system: the ID of the system of the ligand
+    :return: the comment as a string
+    """
+    type_example = (" Positive" if protein_system == ligand_system else " Negative") + " example "
+
+    comments = [f"{type_example} of (Protein, Ligand) : ({protein_system},{ligand_system})",
+                f" - Number of atoms in Protein: {protein.shape[0]}",
+                f" - Number of atoms in Ligand : {ligand.shape[0]}",
+                ','.join(FEATURES_NAMES)]
+
+    return COMMENT_DELIMITER + f"\n{COMMENT_DELIMITER} ".join(comments) + "\n"
 
 
 def save_example(examples_folder: str, protein: np.ndarray, ligand: np.ndarray,
-                 protein_system: str, ligand_system: str):
+                 protein_system: str, ligand_system: str, protein_rows: str = None, ligand_rows: str = None):
     """
     Save an example of a system using representations of a protein and of a ligand.
 
@@ -24,12 +62,17 @@ def save_example(examples_folder: str, protein: np.ndarray, ligand: np.ndarray,
 
     Hence `xxxx` == `yyyy` if and only if the system is a positive example.
 
+    The content of the file is the one of `np.savetxt` on the concatenation of the molecules
+    after a comment. It is formatted in memory and written at once.
+
     :param examples_folder: the folder where the examples are saved
     :param protein: the representation of the protein
     :param ligand: the representation of the ligand
     :param protein_system: the ID of the system of the protein
     :param ligand_system: the ID of the system of the ligand
-    :return:
+    :param protein_rows: the rows of the protein already formatted with `format_rows` (optional)
+    :param ligand_rows: the rows of the ligand already formatted with `format_rows` (optional)
+    :return: the size in bytes of the file of the example, None if it hasn't been saved
     """
     file_name = protein_system + "_" + ligand_system + ".csv"
     file_path = os.path.join(examples_folder, file_name)
@@ -47,41 +90,50 @@ def save_example(examples_folder: str, protein: np.ndarray, ligand: np.ndarray,
         return
 
     # Merging the protein and the ligand together
-    # We concatenate the molecule vertically
-    example = np.concatenate((protein, ligand), axis=0)
+    # We concatenate the rows of the molecules vertically
+    protein_rows = format_rows(protein) if protein_rows is None else protein_rows
+    ligand_rows = format_rows(ligand) if ligand_rows is None else ligand_rows
 
     # We add a comment at the beginning of the file
-    type_example = (" Positive" if protein_system == ligand_system else " Negative") + " example "
+    comment = format_comment(protein, ligand, protein_system, ligand_system)
 
-    comments = [f"{type_example} of (Protein, Ligand) : ({protein_system},{ligand_system})",
-                f" - Number of atoms in Protein: {protein.shape[0]}",
-                f" - Number of atoms in Ligand : {ligand.shape[0]}",
-                ','.join(FEATURES_NAMES)]
+    content = comment + protein_rows + ligand_rows
+    with open(file_path, "w", buffering=EXAMPLES_WRITE_BUFFER_SIZE) as f:
+        f.write(content)
 
-    comment = COMMENT_DELIMITER + f"\n{COMMENT_DELIMITER} ".join(comments) + "\n"
+    return len(content)
 
-    with open(file_path, "w") as f:
-        f.write(comment)
-        np.savetxt(fname=f, X=example)
 
+@lru_cache(maxsize=None)
+def load_cached_ligand(extracted_data_folder: str, system: str):
+    """
+    Load and format a ligand once per process : workers reuse ligands for all the systems they handle.
 
-def save_system_examples(system, list_systems, nb_neg, extracted_data_folder, examples_folder):
+    :param extracted_data_folder: where the original data is
+    :param system: an id xxxx
+    :return: the ligand of the system and its rows formatted with `format_rows`
     """
-    For one system in the `extracted_data_folder`, save its positive example and `nb_neg` random negative example.
+    ligand = load_molecule(extracted_data_folder, system, LIGAND)
+    return ligand, format_rows(ligand)
+
+
+def save_system_examples(system, negative_systems, extracted_data_folder, examples_folder):
+    """
+    For one system in the `extracted_data_folder`, save its positive example and its negative examples
+    with the ligands of `negative_systems`.
     Example get saved in `examples_folder`.
 
 
     :param system: an id xxxx
-    :param list_systems: the complete list of id in data folder
-    :param nb_neg: the number of negative examples to create
+    :param negative_systems: the ids of the systems of the ligands of negative examples (see `sample_negatives`)
     :param extracted_data_folder: where the original data is
     :param examples_folder: where to save the new data
-    :return:
+    :return: the records (protein, ligand, nb_protein_atoms, nb_ligand_atoms, nb_bytes) of the saved examples
     """
 
     try:
-        system_protein = load_nparray(os.path.join(extracted_data_folder, system + EXTRACTED_PROTEIN_SUFFIX))
-        system_ligand = load_nparray(os.path.join(extracted_data_folder, system + EXTRACTED_LIGAND_SUFFIX))
+        system_protein = load_molecule(extracted_data_folder, system, PROTEIN)
+        system_ligand, system_ligand_rows = load_cached_ligand(extracted_data_folder, system)
     except Exception:
         warning_message = f"Loading protein/ligand failed. Protein folder " + \
                           f"{os.path.join(extracted_data_folder, system + EXTRACTED_PROTEIN_SUFFIX)}, " + \
@@ -90,28 +142,80 @@ def save_system_examples(system, list_systems, nb_neg, extracted_data_folder, ex
         print(warning_message)
         raise RuntimeError()
 
-    # Saving positive example
-    save_example(examples_folder, system_protein, system_ligand, system, system)
+    # The protein is formatted once for all its examples
+    system_protein_rows = format_rows(system_protein)
 
-    # Creating false example using nb_neg_ex negatives examples
-    other_systems = sorted(list(list_systems.difference({system})))
-    some_others_systems_indices = np.random.permutation(len(other_systems))[0:nb_neg]
+    # Saving positive example
+    nb_bytes = save_example(examples_folder, system_protein, system_ligand, system, system,
+                            system_protein_rows, system_ligand_rows)
+    records = [(int(system), int(system), len(system_protein), len(system_ligand), nb_bytes)]
 
-    for other_system in map(lambda index: other_systems[index], some_others_systems_indices):
-        other_ligand = load_nparray(os.path.join(extracted_data_folder, other_system + EXTRACTED_LIGAND_SUFFIX))
+    # Creating false example using the sampled negatives systems
+    for other_system in negative_systems:
+        other_ligand, other_ligand_rows = load_cached_ligand(extracted_data_folder, other_system)
 
         if other_system == system:
             raise RuntimeError(f"other_system = {other_system} shoud be != system = {system}")
 
         # Saving negative example
         try:
-            save_example(examples_folder, system_protein, other_ligand, system, other_system)
+            nb_bytes = save_example(examples_folder, system_protein, other_ligand, system, other_system,
+                                    system_protein_rows, other_ligand_rows)
+            records.append((int(system), int(other_system), len(system_protein), len(other_ligand), nb_bytes))
         except Exception:
             # logger.debug(f'Save failed to {examples_folder}')
             raise RuntimeError()
 
+    # Examples that haven't been saved are not in the manifest
+    return [record for record in records if record[-1] is not None]
 
-def create_examples(from_folder, to_folder, nb_neg: int = -1):
+
+def save_systems_examples(systems_chunk, negatives_chunk, extracted_data_folder, examples_folder):
+    """
+    Save the examples of a chunk of systems (see `save_system_examples`).
+
+    :param systems_chunk: a list of ids xxxx
+    :param negatives_chunk: for each system of the chunk, the ids of the systems of its negatives ligands
+    :param extracted_data_folder: where the original data is
+    :param examples_folder: where to save the new data
+    :return: the manifest of the saved examples (see `make_manifest`)
+    """
+    records = []
+    for system, negative_systems in zip(systems_chunk, negatives_chunk):
+        records.extend(save_system_examples(system, negative_systems, extracted_data_folder, examples_folder))
+
+    return make_manifest(*np.array(records, dtype=np.int64).reshape(-1, 5).T)
+
+
+def create_pairs(systems: set, nb_neg: int, seed: int = NEGATIVES_SAMPLING_SEED):
+    """
+    Create the pairs of (protein, ligand, label) of virtual examples.
+
+    For each system, the positive pair and `nb_neg` pairs with other ligands are created,
+    using the same negatives as the ones of materialized examples (see `sample_negatives`).
+
+    :param systems: the set of ids of systems
+    :param nb_neg: the number of negative examples to create per positive example
+    :param seed: the global seed of the sampling of negatives
+    :return: np.ndarray of `PAIRS_DTYPE` of shape (nb_systems * (1 + nb_neg),)
+    """
+    sorted_systems = sorted(systems)
+    ids = np.array(list(map(int, sorted_systems)), dtype=np.int32)
+    negatives = sample_negatives(sorted_systems, nb_neg, seed)
+
+    # For each system: the positive pair first, then its negatives pairs
+    pairs = np.empty((len(ids), 1 + nb_neg), dtype=PAIRS_DTYPE)
+    pairs["protein"] = ids[:, None]
+    pairs["ligand"][:, 0] = ids
+    pairs["ligand"][:, 1:] = ids[negatives]
+    pairs["label"] = 0
+    pairs["label"][:, 0] = 1
+
+    return pairs.ravel()
+
+
+def create_examples(from_folder, to_folder, nb_neg: int = -1, virtual: bool = False,
+                    seed: int = NEGATIVES_SAMPLING_SEED, shard_index: int = 0, nb_shards: int = 1):
     """
     Create examples using data present in `data_folder` and saves them in files in the `example_folder` folder.
 
@@ -121,7 +225,7 @@ def create_examples(from_folder, to_folder, nb_neg: int = -1):
 
     We can then each protein and some others ligands to create negative examples (ie examples of systems that don't
     bind with each others). Those examples are created randomly taking some others ligand that are not binding.
-    This is made reproducible using a seed.
+    This is made reproducible using a seed: negatives only depend on the seed and the ids of systems.
 
     If we note `nb_neg` the number of negative examples created per positive examples, we have exactly :
 
@@ -129,9 +233,20 @@ def create_examples(from_folder, to_folder, nb_neg: int = -1):
 
     Hence this procedure creates `n_systems` * (1 + `nb_neg`) examples, that is at max `nb_systems^2` examples.
 
+    If `virtual` is True, no example file is written: the pairs (protein, ligand, label) are saved in
+    `to_folder` and systems are assembled from the store of molecules of `from_folder` when needed.
+
+    In both cases, a manifest of the examples is saved in `to_folder` (see `save_manifest`): it is read by
+    iterators instead of listing the folder.
+
     :param from_folder:
     :param to_folder:
     :param nb_neg: the number of negative example to create per positive example. Default -1 means maximum.
+    :param virtual: to only save the pairs of examples instead of materializing them in files
+    :param seed: the global seed of the sampling of negatives
+    :param shard_index: the index of the shard of systems to create the examples of
+    :param nb_shards: the number of shards: the systems are split in `nb_shards` shards whose examples can be created
+                      independently (on different nodes for instance) in the same `to_folder`
     :return:
     """
     logger = logging.getLogger('__main__.create_example')
@@ -139,12 +254,16 @@ def create_examples(from_folder, to_folder, nb_neg: int = -1):
     logger.addHandler(fh)
 
     # Getting all the systems
-    extract_id = lambda x: x.split("_")[0]
-
-    list_systems = set(list(map(extract_id, os.listdir(from_folder))))
+    systems = list_systems(from_folder)
     logger.debug(f'Get systems ids from {from_folder}')
 
-    nb_systems = len(list_systems)
+    nb_systems = len(systems)
+
+    if not (0 <= shard_index < nb_shards):
+        raise RuntimeError(f"Invalid shard {shard_index} for {nb_shards} shards")
+
+    if virtual and nb_shards > 1:
+        raise RuntimeError("Virtual examples are created at once: they can't be sharded")
 
     if nb_neg > nb_systems:
         raise RuntimeError(f"Cannot create more than {nb_systems-1} negatives examples per positive examples (actual "
@@ -155,40 +274,102 @@ def create_examples(from_folder, to_folder, nb_neg: int = -1):
         nb_neg = nb_systems - 1
 
     # Deleting the folders of examples and recreating it
-    if os.path.exists(to_folder):
+    # Shards share the folder of examples: it is then up to the caller to clean it
+    if os.path.exists(to_folder) and nb_shards == 1:
         logger.debug(f'Delete {to_folder} examples files.')
         for file in os.listdir(to_folder):
-            os.remove(os.path.join(to_folder, file))
-    else:
-        os.makedirs(to_folder)
+            path = os.path.join(to_folder, file)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    elif not os.path.exists(to_folder):
+        os.makedirs(to_folder, exist_ok=True)
         logger.debug(f'Create new {to_folder} examples folder.')
 
     # For each system, we create the associated positive example and we generate some negative examples
     logger.debug('Create 1 positive binding and %d random negative protein-ligand bindings.', nb_neg)
+
+    if virtual:
+        if not (MoleculesStore.exists(from_folder)):
+            logger.debug(f'Writing the store of molecules of {from_folder}.')
+            write_molecules_store(from_folder)
+
+        pairs = create_pairs(systems, nb_neg, seed)
+        save_pairs(to_folder, pairs, molecules_folder=from_folder)
+        save_manifest(to_folder, make_pairs_manifest(pairs, get_molecules_store(from_folder)))
+        logger.debug(f'Create {to_folder} virtual examples done : {len(pairs)} pairs.')
+        return
+
+    # The negatives of the systems of the shard are sampled at once before being dispatched to workers
+    sorted_systems = sorted(systems)
+    shard_systems = sorted_systems[shard_index::nb_shards]
+    negatives = np.array(sorted_systems)[sample_negatives(sorted_systems, nb_neg, seed, proteins=shard_systems)]
+    logger.debug(f'Shard {shard_index + 1}/{nb_shards}: {len(shard_systems)} systems.')
+
+    # Systems are handled by chunks to reduce the overhead of tasks
+    chunks_starts = range(0, len(shard_systems), NB_SYSTEMS_PER_TASK)
+
     with futures.ProcessPoolExecutor(max_workers=NB_WORKERS) as executor:
-        for system in sorted(list_systems):
-            executor.submit(save_system_examples, system, list_systems, nb_neg, from_folder, to_folder)
+        tasks = [executor.submit(save_systems_examples, shard_systems[i:i + NB_SYSTEMS_PER_TASK],
+                                 negatives[i:i + NB_SYSTEMS_PER_TASK].tolist(), from_folder, to_folder)
+                 for i in chunks_starts]
 
-    logger.debug(f'Create {to_folder} examples done.')
+        # The manifest of the shard is made of the ones of the chunks, in the order of systems
+        manifests = [task.result() for task in tasks]
 
+    manifest = np.concatenate(manifests) if len(manifests) > 0 else np.empty(0, dtype=MANIFEST_DTYPE)
+    save_manifest(to_folder, manifest, shard_index, nb_shards)
 
-if __name__ == "__main__":
-    # To get reproducible generations of examples
-    np.random.seed(1337)
+    logger.debug(f'Create {to_folder} examples done : {len(manifest)} examples.')
+
+
+def main(arguments: list = None):
+    """
+    Create the examples of each data set.
+
+    :param arguments: the arguments of the command line (default: the ones of `sys.argv`)
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Create the examples of each data set.')
+
+    parser.add_argument('--virtual', action='store_true',
+                        help='only save pairs of (protein, ligand, label) instead of writing examples files')
+    parser.add_argument('--seed', type=int, default=NEGATIVES_SAMPLING_SEED,
+                        help='the global seed of the sampling of negatives examples')
+    parser.add_argument('--shard_index', type=int, default=0,
+                        help='the index of the shard of systems to create the examples of')
+    parser.add_argument('--nb_shards', type=int, default=1,
+                        help='the number of shards the systems are split in (to create examples on several nodes)')
+
+    args = parser.parse_args(arguments)
+    sharding = dict(seed=args.seed, shard_index=args.shard_index, nb_shards=args.nb_shards)
 
     print(f"Creating training examples with {MAX_NB_NEG_PER_POS} negatives examples per positive examples")
     create_examples(from_folder=EXTRACTED_GIVEN_DATA_TRAIN_FOLDER,
                     to_folder=TRAINING_EXAMPLES_FOLDER,
-                    nb_neg=MAX_NB_NEG_PER_POS)
+                    nb_neg=MAX_NB_NEG_PER_POS,
+                    virtual=args.virtual,
+                    **sharding)
 
     print("Creating all possible validation examples")
     create_examples(from_folder=EXTRACTED_GIVEN_DATA_VALIDATION_FOLDER,
-                    to_folder=VALIDATION_EXAMPLES_FOLDER)
+                    to_folder=VALIDATION_EXAMPLES_FOLDER,
+                    virtual=args.virtual,
+                    **sharding)
 
     print("Creating all possible testing examples")
     create_examples(from_folder=EXTRACTED_GIVEN_DATA_TEST_FOLDER,
-                    to_folder=TESTING_EXAMPLES_FOLDER)
+                    to_folder=TESTING_EXAMPLES_FOLDER,
+                    virtual=args.virtual,
+                    **sharding)
 
     print("Creating all possible examples for final predictions")
     create_examples(from_folder=EXTRACTED_PREDICT_DATA_FOLDER,
-                    to_folder=PREDICT_EXAMPLES_FOLDER)
+                    to_folder=PREDICT_EXAMPLES_FOLDER,
+                    virtual=args.virtual,
+                    **sharding)
+
+
+if __name__ == "__main__":
+    main()
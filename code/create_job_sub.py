@@ -3,9 +3,9 @@ import textwrap
 
 from discretization import RelativeCubeRepresentation, AbsoluteCubeRepresentation
 from models_inspector import ModelsInspector
-from models import models_available, models_available_names
+from models import models_available_names
 from settings import JOB_SUBMISSIONS_FOLDER, NB_NEG_EX_PER_POS, NB_EPOCHS_DEFAULT, BATCH_SIZE_DEFAULT, N_GPU_DEFAULT, \
-    RESULTS_FOLDER, JOBS_ENV, WEIGHT_POS_CLASS, LR_DEFAULT, LR_DECAY_DEFAULT
+    RESULTS_FOLDER, JOBS_ENV, WEIGHT_POS_CLASS, LR_DEFAULT, LR_DECAY_DEFAULT, TRAIN_JOB_TIME_BUDGET
 
 
 def save_job_file(stub, name_job, ask_confirm=True):
@@ -47,6 +47,9 @@ def get_train_stub(model_index, name_job, nb_epochs, batch_size, nb_neg, max_exa
     """
     Return the stub for training a using the different parameters given. Parameters used for training.
 
+    Jobs save their results in the folder of their name: a job stopped at the end of its time budget
+    resumes training when it is submitted again.
+
     :param model_index: The index of model to be created.
     :param name_job: NSCC qsub job name to be created.
     :param nb_epochs: Number of epochs going to train.
@@ -73,7 +76,7 @@ def get_train_stub(model_index, name_job, nb_epochs, batch_size, nb_neg, max_exa
                 #PBS -l select=1:ngpus={n_gpu}
                 #PBS -l walltime=23:00:00
                 #PBS -N {name_job}
-                mkdir -p {RESULTS_FOLDER}/$PBS_JOBID/
+                mkdir -p {RESULTS_FOLDER}/{name_job}/
                 cd $PBS_O_WORKDIR/code/
                 source activate {JOBS_ENV}
                 python $PBS_O_WORKDIR/code/{script_name}  --model_index {model_index} \\
@@ -85,7 +88,9 @@ def get_train_stub(model_index, name_job, nb_epochs, batch_size, nb_neg, max_exa
                                                          --weight_pos_class {weight_pos_class} \\
                                                          --representation {representation} \\
                                                          --nb_neg {nb_neg}\\{option_max if max_examples is not None else ''}
-                                                         --job_folder {RESULTS_FOLDER}/$PBS_JOBID/
+                                                         --time_budget {TRAIN_JOB_TIME_BUDGET} \
+                                                         --resume \
+                                                         --job_folder {RESULTS_FOLDER}/{name_job}/
                 """
     # We remove the first return in the string
     stub = stub[1:]
@@ -109,8 +114,8 @@ def create_train_job():
     model_index = -1
     while model_index not in range(nb_models_available):
         print(f"{nb_models_available} Models available:")
-        for i, model in enumerate(models_available):
-            print(f"  # {i}: {model.name}")
+        for i, model_name in enumerate(models_available_names):
+            print(f"  # {i}: {model_name}")
 
         model_index = int(input("Your choice : # "))
 
@@ -257,8 +262,8 @@ def create_multiple_train_jobs(batch_size: int=BATCH_SIZE_DEFAULT, max_examples=
     model_index = -1
     while model_index not in range(nb_models_available):
         print(f"{nb_models_available} Models available:")
-        for i, model in enumerate(models_available):
-            print(f"  # {i}: {model.name}")
+        for i, model_name in enumerate(models_available_names):
+            print(f"  # {i}: {model_name}")
 
         model_index = int(input("Your choice : # "))
 
@@ -0,0 +1,134 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from discretization import CubeRepresentation
+from settings import CUBE_CACHE_RAM_BUDGET_DEFAULT, CUBE_CACHE_FORMAT_VERSION
+
+
+class CubeCache:
+    """
+    A cache of the cubes of examples, with two tiers:
+     - a memory tier, holding the most recently used cubes within a budget of bytes
+     - an optional disk tier in `spill_folder`, where cubes evicted from the memory tier are saved
+
+    A cube is identified by the example it represents, all the parameters of the representation used to make it
+    and the version of the way cubes are made (see `CubeCache.make_key`): the cache can be shared by several
+    representations, and cubes saved in the disk tier by older versions are never used.
+
+    Each process has its own memory tier, while the disk tier can be shared between processes (for instance
+    the workers of a `BatchLoader`) and between jobs.
+
+    """
+
+    def __init__(self, ram_budget: int = CUBE_CACHE_RAM_BUDGET_DEFAULT, spill_folder: str = None):
+        """
+        :param ram_budget: the maximum number of bytes of cubes held in memory
+        :param spill_folder: the folder of the disk tier (if None, evicted cubes are dropped)
+        """
+        self._ram_budget = ram_budget
+        self._spill_folder = spill_folder
+
+        self._cubes = OrderedDict()
+        self._nb_bytes = 0
+
+        self._nb_ram_hits = 0
+        self._nb_disk_hits = 0
+        self._nb_misses = 0
+
+        if spill_folder is not None:
+            os.makedirs(spill_folder, exist_ok=True)
+
+    @staticmethod
+    def make_key(examples_folder: str, example: str, representation: CubeRepresentation):
+        """
+        :param examples_folder: the folder of the example
+        :param example: the name of the example
+        :param representation: the representation used to make the cube
+        :return: the key identifying the cube of the example
+        """
+        # All the parameters of the representation: its type, size and type of cubes, resolution, density...
+        parameters = ",".join(f"{key}={value}" for key, value in sorted(representation.get_parameters().items()))
+        return f"v{CUBE_CACHE_FORMAT_VERSION}:{os.path.abspath(examples_folder)}:{example}:{parameters}"
+
+    def _spill_file(self, key: str):
+        return os.path.join(self._spill_folder, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def get(self, key: str):
+        """
+        :param key: the key of a cube
+        :return: the cube if it is in the cache, None otherwise
+        """
+        if key in self._cubes:
+            self._cubes.move_to_end(key)
+            self._nb_ram_hits += 1
+            return self._cubes[key]
+
+        if self._spill_folder is not None and os.path.exists(self._spill_file(key)):
+            cube = np.load(self._spill_file(key))
+            self._nb_disk_hits += 1
+            self._put_in_ram(key, cube)
+            return cube
+
+        self._nb_misses += 1
+        return None
+
+    def put(self, key: str, cube: np.ndarray):
+        """
+        :param key: the key of a cube
+        :param cube: the cube
+        :return:
+        """
+        self._put_in_ram(key, cube)
+
+    def _put_in_ram(self, key: str, cube: np.ndarray):
+        if key in self._cubes or cube.nbytes > self._ram_budget:
+            return
+
+        self._cubes[key] = cube
+        self._nb_bytes += cube.nbytes
+
+        # Evicting the least recently used cubes
+        while self._nb_bytes > self._ram_budget:
+            evicted_key, evicted_cube = self._cubes.popitem(last=False)
+            self._nb_bytes -= evicted_cube.nbytes
+            self._spill(evicted_key, evicted_cube)
+
+    def _spill(self, key: str, cube: np.ndarray):
+        if self._spill_folder is None:
+            return
+
+        spill_file = self._spill_file(key)
+        if not os.path.exists(spill_file):
+            # Writing then renaming so that other processes never read a partial cube
+            temporary_file = f"{spill_file}.{os.getpid()}.tmp"
+            with open(temporary_file, "wb") as f:
+                np.save(f, cube)
+            os.replace(temporary_file, spill_file)
+
+    def get_or_make(self, key: str, make_cube):
+        """
+        :param key: the key of a cube
+        :param make_cube: a function without arguments making the cube if it is not in the cache
+        :return: the cube
+        """
+        cube = self.get(key)
+        if cube is None:
+            cube = make_cube()
+            self.put(key, cube)
+
+        return cube
+
+    def get_statistics(self):
+        """
+        :return: the statistics of the cache in this process, as a dictionary
+        """
+        nb_requests = self._nb_ram_hits + self._nb_disk_hits + self._nb_misses
+        return dict(ram_hits=self._nb_ram_hits,
+                    disk_hits=self._nb_disk_hits,
+                    misses=self._nb_misses,
+                    hit_rate=(self._nb_ram_hits + self._nb_disk_hits) / nb_requests if nb_requests > 0 else 0.,
+                    nb_cubes_in_ram=len(self._cubes),
+                    nb_bytes_in_ram=self._nb_bytes)
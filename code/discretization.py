@@ -1,9 +1,12 @@
+import hashlib
 import numpy as np
-import matplotlib.pyplot as plt
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from scipy.spatial import cKDTree
 
 from settings import LENGTH_CUBE_SIDE, NB_FEATURES, \
-    INDICES_FEATURES, DEFAULT_CUBE_RES
+    INDICES_FEATURES, DEFAULT_CUBE_RES, NB_CHANNELS, NB_CACHED_PROTEIN_GRIDS_DEFAULT, CUBE_DTYPE_DEFAULT, \
+    POCKET_CUBE_RES_DEFAULT, DENSITY_TRUNCATION, CONTACT_CUTOFF, NB_CONTACT_BINS
 
 
 class CubeRepresentation(ABC):
@@ -29,21 +32,78 @@ class CubeRepresentation(ABC):
     This behaviour can parameterized with the booleans `use_rotation_invariance`, `translate_ligand` and `verbose`
     respectively on the constructor.
 
+    Voxels store small counts of atoms per feature: cubes are made with the type `cube_dtype`, for instance uint8
+    (counts are then saturated at 255) or float16, to reduce the memory used by batches and caches. Cubes are cast
+    to the float type of models only when they are fed to them (see `examples_iterator.as_model_input`).
+
+    By default, each atom is counted in its nearest voxel. With `density_sigma`, each atom adds instead a Gaussian
+    density to the voxels around it (see `_scatter_densities`): the position of atoms within voxels is kept, so that
+    coarser grids can be used.
+
     """
 
     name = "abstract"
 
-    def __init__(self, length_cube_side: int, use_rotation_invariance: bool, translate_ligand: bool, verbose: bool):
+    # The position of the center of each voxel in the coordinates of voxels, from its index
+    _voxels_centers_offset = 0.
+
+    def __init__(self, length_cube_side: int, use_rotation_invariance: bool, translate_ligand: bool, verbose: bool,
+                 cube_dtype=CUBE_DTYPE_DEFAULT, density_sigma: float = None):
         """
         :param length_cube_side: the length of the cube (number of voxel on one dimension)
         :param use_rotation_invariance: to perform the PCA rotation and get a fixed position w.r.t the protein
         :param translate_ligand: to translated the ligand at the center of the protein
         :param verbose: to output information about the cube created
+        :param cube_dtype: the type of the values of cubes (see `CUBE_DTYPES`)
+        :param density_sigma: the standard deviation in voxels of the density of atoms (None to count atoms in
+                              their nearest voxel)
         """
         self._length_cube_side = length_cube_side
         self._use_rotation_invariance = use_rotation_invariance
         self._translate_ligand = translate_ligand
         self._verbose = verbose
+        self._cube_dtype = np.dtype(cube_dtype)
+        self._density_sigma = density_sigma
+
+        if density_sigma is not None:
+            if np.issubdtype(self._cube_dtype, np.integer):
+                raise ValueError(f"Densities of atoms can not be stored in cubes of {self._cube_dtype.name}")
+
+            # The stencil of the voxels where an atom adds its density: the offsets from its nearest voxel on each
+            # axis, and in the flat indices of cubes padded with the radius of the stencil on each side
+            self._density_radius = int(np.ceil(DENSITY_TRUNCATION * density_sigma))
+            self._density_stencil = np.arange(-self._density_radius, self._density_radius + 1)
+            padded_side = length_cube_side + 2 * self._density_radius
+            self._density_flat_stencil = (self._density_stencil[:, None, None] * padded_side ** 2
+                                          + self._density_stencil[None, :, None] * padded_side
+                                          + self._density_stencil[None, None, :]).ravel()
+
+    def get_parameters(self):
+        """
+        :return: the parameters defining the cubes made by the representation, as a dictionary
+        """
+        parameters = dict(name=self.name,
+                          length_cube_side=self._length_cube_side,
+                          use_rotation_invariance=self._use_rotation_invariance,
+                          translate_ligand=self._translate_ligand,
+                          cube_dtype=self._cube_dtype.name)
+
+        if self._density_sigma is not None:
+            parameters["density_sigma"] = self._density_sigma
+
+        return parameters
+
+    def get_cube_shape(self):
+        """
+        :return: the shape of the cubes made by the representation (res, res, res, nb_features)
+        """
+        return (self._length_cube_side,) * 3 + (NB_CHANNELS,)
+
+    def get_cube_dtype(self):
+        """
+        :return: the type of the values of cubes
+        """
+        return self._cube_dtype
 
     def _representation_invariance(self, original_coords, is_from_protein_indices):
         """
@@ -59,23 +119,33 @@ class CubeRepresentation(ABC):
 
         :return: the canonical representation of the protein-ligand system
         """
-        protein_coords = original_coords[is_from_protein_indices]
-        columns_means = np.mean(protein_coords, axis=0)
-        centered_protein_coords = protein_coords - columns_means
+        is_from_protein = np.zeros(len(original_coords), dtype=bool)
+        is_from_protein[is_from_protein_indices] = True
 
-        # Getting the rotation matrix by diagonalizing the
-        # covariance matrix of the centered protein coordinates
-        cov_matrix = np.cov(centered_protein_coords.T)
-        assert cov_matrix.shape == (3, 3)
-        eigen_vals, rotation_mat = np.linalg.eig(cov_matrix)
+        if self._verbose:
+            # Printing the eigen values and the rotation of the protein
+            self._protein_rotation(original_coords[is_from_protein])
 
-        # Applying this rotation matrix on all points
-        # Note : we should not transpose the rotation matrix (tested)
-        new_coords = original_coords.dot(rotation_mat)
+        # Done as for stacked systems, so that both give the same canonical representations
+        new_coords = self._representations_invariance(original_coords, is_from_protein,
+                                                      np.zeros(len(original_coords), dtype=np.int64), 1)
 
         # Should have the same shape
         assert new_coords.shape == original_coords.shape
 
+        return new_coords
+
+    def _protein_rotation(self, protein_coords):
+        """
+        Return the rotation of the canonical representation of a protein (see `_representation_invariance`).
+
+        :param protein_coords: the coordinates of the atoms of the protein
+        :return: the rotation matrix as a np.ndarray of size (3, 3)
+        """
+        eigen_vals, rotation_mats = self._proteins_rotations(protein_coords,
+                                                             np.zeros(len(protein_coords), dtype=np.int64), 1)
+        eigen_vals, rotation_mat = eigen_vals[0], rotation_mats[0]
+
         if self._verbose:
             print("Eigen Values (~ scale factor of molecules):"),
             print("x factor : ", eigen_vals[0])
@@ -84,25 +154,293 @@ class CubeRepresentation(ABC):
             print("Rotation matrix")
             print(rotation_mat)
 
-        return new_coords
+        return rotation_mat
 
     @staticmethod
-    def _translate_ligand_on_protein(original_coords, is_from_protein_indices):
+    def _translate_ligand_on_protein(original_coords, is_from_protein):
         """
         Translate a ligand to the center of the protein.
 
         :param original_coords: the coordinates of the system
-        :param is_from_protein_indices: the set of indices of the protein
-        :return:
+        :param is_from_protein: the boolean mask of the atoms of the protein
+        :return: the new coordinates of the system
         """
-        center_protein = np.mean(original_coords[is_from_protein_indices], axis=0)
-        center_ligand = np.mean(original_coords[~is_from_protein_indices], axis=0)
+        center_protein = np.mean(original_coords[is_from_protein], axis=0)
+        center_ligand = np.mean(original_coords[~is_from_protein], axis=0)
 
         vector = center_ligand - center_protein
 
-        original_coords[~is_from_protein_indices] = original_coords[~is_from_protein_indices] - vector
+        translated_coords = original_coords.copy()
+        translated_coords[~is_from_protein] = original_coords[~is_from_protein] - vector
+
+        return translated_coords
+
+    @staticmethod
+    def _segments_means(values, segments, nb_segments: int):
+        """
+        :param values: np.ndarray of size (nb_values, nb_columns)
+        :param segments: the index of the segment of each value
+        :param nb_segments: the number of segments
+        :return: np.ndarray of size (nb_segments, nb_columns) of the means of the columns per segment
+        """
+        counts = np.bincount(segments, minlength=nb_segments)
+        sums = np.stack([np.bincount(segments, weights=values[:, column], minlength=nb_segments)
+                         for column in range(values.shape[1])], axis=1)
+
+        return sums / counts[:, None]
+
+    def _translate_ligands_on_proteins(self, coords, is_from_protein, segments, nb_systems: int):
+        """
+        Translate the ligands of stacked systems to the centers of their proteins (see `_translate_ligand_on_protein`).
+
+        :param coords: the stacked coordinates of the systems
+        :param is_from_protein: the boolean mask of the atoms of proteins
+        :param segments: the index of the system of each atom
+        :param nb_systems: the number of systems
+        :return: the new coordinates of the systems
+        """
+        centers_proteins = self._segments_means(coords[is_from_protein], segments[is_from_protein], nb_systems)
+        centers_ligands = self._segments_means(coords[~is_from_protein], segments[~is_from_protein], nb_systems)
+
+        vectors = (centers_ligands - centers_proteins).astype(coords.dtype)
+
+        translated_coords = coords.copy()
+        translated_coords[~is_from_protein] -= vectors[segments[~is_from_protein]]
+
+        return translated_coords
+
+    def _proteins_rotations(self, proteins_coords, proteins_segments, nb_proteins: int):
+        """
+        Return the rotations of the canonical representations of stacked proteins (see `_representation_invariance`).
+
+        The covariance matrices of the centered coordinates of the proteins are reduced over their contiguous atoms
+        with `np.add.reduceat` into a (nb_proteins, 3, 3) array, diagonalized at once with `np.linalg.eig`.
+
+        `np.linalg.eig` gives the order and the signs of the axes of the canonical frame models have been trained
+        with: `np.linalg.eigh` would sort them by eigenvalue and flip some of them.
+
+        :param proteins_coords: the stacked coordinates of the atoms of the proteins
+        :param proteins_segments: the sorted index of the protein of each atom
+        :param nb_proteins: the number of proteins
+        :return: the eigen values of shape (nb_proteins, 3) and the rotation matrices of shape (nb_proteins, 3, 3)
+        """
+        starts = np.searchsorted(proteins_segments, np.arange(nb_proteins))
+        counts = np.diff(np.append(starts, len(proteins_segments)))
+
+        # Centering, as close eigenvalues make the rotation sensitive to rounding errors
+        proteins_coords = proteins_coords.astype(np.float64)
+        centers = np.add.reduceat(proteins_coords, starts, axis=0) / counts[:, None]
+        centered_coords = proteins_coords - centers[proteins_segments]
+
+        # Unbiased covariances, as given by np.cov, reduced for the upper triangle only
+        cov_matrices = np.empty((nb_proteins, 3, 3))
+        for i, j in zip(*np.triu_indices(3)):
+            cov_matrices[:, i, j] = cov_matrices[:, j, i] = \
+                np.add.reduceat(centered_coords[:, i] * centered_coords[:, j], starts) / (counts - 1)
+
+        eigen_vals, rotation_mats = np.linalg.eig(cov_matrices)
+
+        # Covariance matrices are symmetric: imaginary parts, if any, are rounding errors
+        return eigen_vals.real, rotation_mats.real
+
+    def _representations_invariance(self, coords, is_from_protein, segments, nb_systems: int):
+        """
+        Return the representations invariant of stacked systems (see `_representation_invariance`).
+
+        The rotations of all the proteins are found at once (see `_proteins_rotations`) and applied
+        on the atoms of their systems with a single `np.einsum`, on the rotation of the system of each atom.
+
+        :param coords: the stacked coordinates of the systems
+        :param is_from_protein: the boolean mask of the atoms of proteins
+        :param segments: the sorted index of the system of each atom
+        :param nb_systems: the number of systems
+        :return: the canonical coordinates of the systems
+        """
+        eigen_vals, rotation_mats = self._proteins_rotations(coords[is_from_protein], segments[is_from_protein],
+                                                             nb_systems)
+
+        # Transposed rotations and coordinates of the same type make the products contiguous (about 3 times faster)
+        transposed_rotation_mats = np.ascontiguousarray(rotation_mats.transpose(0, 2, 1))
+        return np.einsum("ij,ikj->ik", coords.astype(np.float64), transposed_rotation_mats[segments])
+
+    @staticmethod
+    def _scatter_features(scaled_coords, atom_features, length_cube_side: int, dtype):
+        """
+        Sum the features of atoms in the voxels they are in.
+
+        This is done with one `np.bincount` per feature on the flat indices of the voxels, so that
+        features of atoms in the same voxel are summed.
+
+        :param scaled_coords: np.ndarray of int of size (nb_atoms, 3): the voxel of each atom
+        :param atom_features: np.ndarray of size (nb_atoms, nb_features)
+        :param length_cube_side: the number of voxels on one dimension
+        :param dtype: the type of the cube
+        :return: a cube 4D np.ndarray of size (res, res, res, nb_features)
+        """
+        nb_voxels = length_cube_side ** 3
+        nb_feat = atom_features.shape[1]
+
+        flat_indices = np.ravel_multi_index(scaled_coords.T, (length_cube_side,) * 3)
+
+        cube = np.empty((nb_voxels, nb_feat), dtype=dtype)
+        for feature in range(nb_feat):
+            cube[:, feature] = CubeRepresentation._saturate(
+                np.bincount(flat_indices, weights=atom_features[:, feature], minlength=nb_voxels), dtype)
+
+        return cube.reshape((length_cube_side,) * 3 + (nb_feat,))
+
+    @staticmethod
+    def _scatter_features_batch(scaled_coords, atom_features, segments, cubes):
+        """
+        Sum the features of atoms of stacked systems in the voxels of their cubes (see `_scatter_features`).
+
+        The flat indices of voxels are offset by the index of the cube of each atom, so that all the cubes
+        are filled at once.
+
+        :param scaled_coords: np.ndarray of int of size (nb_atoms, 3): the voxel of each atom
+        :param atom_features: np.ndarray of size (nb_atoms, nb_features)
+        :param segments: the index of the cube of each atom
+        :param cubes: the np.ndarray of size (nb_systems, res, res, res, nb_features) to fill
+        :return: the cubes
+        """
+        length_cube_side = cubes.shape[1]
+        nb_voxels = length_cube_side ** 3
+        nb_cubes_voxels = cubes.shape[0] * nb_voxels
+
+        flat_indices = segments * nb_voxels + np.ravel_multi_index(scaled_coords.T, (length_cube_side,) * 3)
+
+        flat_cubes = cubes.reshape((nb_cubes_voxels, cubes.shape[-1]))
+        for feature in range(cubes.shape[-1]):
+            flat_cubes[:, feature] = CubeRepresentation._saturate(
+                np.bincount(flat_indices, weights=atom_features[:, feature], minlength=nb_cubes_voxels), cubes.dtype)
+
+        return cubes
+
+    def _scatter_densities(self, positions, atom_features, segments, cubes):
+        """
+        Add the densities of the atoms of stacked systems to the voxels of their cubes.
+
+        The density of an atom is a Gaussian of standard deviation `density_sigma` voxels, truncated to the stencil
+        of voxels around its nearest voxel and normalized so that each atom adds its features once over the stencil.
+        The Gaussian is separable: its values are computed on each axis of the stencil for all the atoms at once,
+        and multiplied. Densities are summed in cubes padded with the radius of the stencil, so that the flat indices
+        of the stencil are precomputed and no voxel has to be checked.
+
+        :param positions: np.ndarray of size (nb_atoms, 3): the position of each atom in the coordinates of voxels
+        :param atom_features: np.ndarray of size (nb_atoms, nb_features)
+        :param segments: the index of the cube of each atom
+        :param cubes: the np.ndarray of size (nb_systems, res, res, res, nb_features) to fill
+        :return: the cubes
+        """
+        length_cube_side = cubes.shape[1]
+        radius = self._density_radius
+        padded_side = length_cube_side + 2 * radius
+        nb_padded_voxels = padded_side ** 3
+
+        # Just keeping atom that are in their box, as when they are counted in their nearest voxel
+        nearest_voxels = self._nearest_voxels(positions)
+        in_box = ((nearest_voxels >= 0) & (nearest_voxels < length_cube_side)).all(axis=1)
+        positions, nearest_voxels = positions[in_box], nearest_voxels[in_box]
+        atom_features, segments = atom_features[in_box], segments[in_box]
+
+        # The values of the Gaussian on each axis of the stencil: np.ndarray of size (nb_atoms, 3, size)
+        axis_distances = (nearest_voxels + self._voxels_centers_offset - positions)[:, :, None] + self._density_stencil
+        axis_weights = np.exp(-axis_distances ** 2 / (2 * self._density_sigma ** 2))
+        axis_weights /= axis_weights.sum(axis=2, keepdims=True)
+
+        weights = ((axis_weights[:, 0, :, None] * axis_weights[:, 1, None, :])[:, :, :, None]
+                   * axis_weights[:, 2, None, None, :]).reshape((len(positions), -1))
+        flat_indices = (segments * nb_padded_voxels
+                        + np.ravel_multi_index((nearest_voxels + radius).T, (padded_side,) * 3))
+        flat_indices = (flat_indices[:, None] + self._density_flat_stencil).ravel()
+
+        padded_cubes = np.empty((cubes.shape[0] * nb_padded_voxels, cubes.shape[-1]), dtype=np.float64)
+        for feature in range(cubes.shape[-1]):
+            padded_cubes[:, feature] = np.bincount(flat_indices, weights=(weights * atom_features[:, feature, None])
+                                                   .ravel(), minlength=len(padded_cubes))
+
+        padded_cubes = padded_cubes.reshape((cubes.shape[0],) + (padded_side,) * 3 + (cubes.shape[-1],))
+        inner = slice(radius, radius + length_cube_side)
+        cubes[...] = padded_cubes[:, inner, inner, inner]
+
+        return cubes
+
+    def _nearest_voxels(self, positions):
+        """
+        :param positions: np.ndarray of size (nb_atoms, 3): the position of each atom in the coordinates of voxels
+        :return: np.ndarray of int of size (nb_atoms, 3): the voxel of each atom
+        """
+        return positions.round().astype(int)
+
+    def _fill_cubes(self, positions, atom_features, segments, cubes):
+        """
+        Fill the cubes of stacked systems with the features of their atoms: in their nearest voxel or as densities.
+
+        Atoms out of their cube are discarded.
+
+        :param positions: np.ndarray of size (nb_atoms, 3): the position of each atom in the coordinates of voxels
+        :param atom_features: np.ndarray of size (nb_atoms, nb_features)
+        :param segments: the index of the cube of each atom
+        :param cubes: the np.ndarray of size (nb_systems, res, res, res, nb_features) to fill
+        :return: the cubes
+        """
+        if self._density_sigma is not None:
+            return self._scatter_densities(positions, atom_features, segments, cubes)
+
+        scaled_coords = self._nearest_voxels(positions)
+
+        # Just keeping atom that are in their box
+        in_box = ((scaled_coords >= 0) & (scaled_coords < self._length_cube_side)).all(axis=1)
+
+        return self._scatter_features_batch(scaled_coords[in_box], atom_features[in_box], segments[in_box], cubes)
+
+    def _fill_cube(self, positions, atom_features):
+        """
+        Fill the cube of a system with the features of its atoms (see `_fill_cubes`).
+
+        :param positions: np.ndarray of size (nb_atoms, 3): the position of each atom in the coordinates of voxels
+        :param atom_features: np.ndarray of size (nb_atoms, nb_features)
+        :return: a cube 4D np.ndarray of size (res, res, res, nb_features)
+        """
+        if self._density_sigma is not None:
+            cubes = np.empty((1,) + self.get_cube_shape(), dtype=self._cube_dtype)
+            return self._scatter_densities(positions, atom_features, np.zeros(len(positions), dtype=int), cubes)[0]
+
+        scaled_coords = self._nearest_voxels(positions)
+
+        # Just keeping atom that are in the box
+        in_box = ((scaled_coords >= 0) & (scaled_coords < self._length_cube_side)).all(axis=1)
+
+        return self._scatter_features(scaled_coords[in_box], atom_features[in_box], self._length_cube_side,
+                                      self._cube_dtype)
+
+    @staticmethod
+    def _saturate(values, dtype):
+        """
+        :param values: np.ndarray of sums of features
+        :param dtype: the type of the cube
+        :return: the values, limited to the largest value of the type for integer types instead of wrapping around
+        """
+        if np.issubdtype(dtype, np.integer):
+            return np.minimum(values, np.iinfo(dtype).max)
+
+        return values
+
+    @staticmethod
+    def _add_cubes(cubes, other_cubes):
+        """
+        Add cubes in place, saturating integer counts (see `_saturate`).
+
+        :param cubes: the cubes to add to
+        :param other_cubes: the cubes to add
+        :return: the cubes
+        """
+        if np.issubdtype(cubes.dtype, np.integer):
+            cubes[...] = CubeRepresentation._saturate(cubes.astype(np.int64) + other_cubes, cubes.dtype)
+        else:
+            cubes += other_cubes
 
-        return original_coords
+        return cubes
 
     # TODO : change this method to actually gives a good representation of the data
     # using the new set of features
@@ -113,15 +451,20 @@ class CubeRepresentation(ABC):
 
         :param cube: np.ndarray of size (res,res,res,2)
         """
+        # Only imported to plot: making cubes doesn't need it
+        import matplotlib.pyplot as plt
+
+        length_cube_side = cube.shape[0]
+
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
         xs = []
         ys = []
         zs = []
         cs = []
-        for x in range(LENGTH_CUBE_SIDE):
-            for y in range(LENGTH_CUBE_SIDE):
-                for z in range(LENGTH_CUBE_SIDE):
+        for x in range(length_cube_side):
+            for y in range(length_cube_side):
+                for z in range(length_cube_side):
                     # "-3" because the 3 coordinates are present in INDICES_FEATURES
                     # TODO : this part is to change here
                     is_from_protein_pos = INDICES_FEATURES["is_from_protein"] - 3
@@ -136,9 +479,9 @@ class CubeRepresentation(ABC):
 
         ax.scatter(xs, ys, zs, c=cs, marker="o")
 
-        ax.set_xlim((0, LENGTH_CUBE_SIDE))
-        ax.set_ylim((0, LENGTH_CUBE_SIDE))
-        ax.set_zlim((0, LENGTH_CUBE_SIDE))
+        ax.set_xlim((0, length_cube_side))
+        ax.set_ylim((0, length_cube_side))
+        ax.set_zlim((0, length_cube_side))
 
         ax.set_xlabel('X Label')
         ax.set_ylabel('Y Label')
@@ -150,6 +493,57 @@ class CubeRepresentation(ABC):
     def make_cube(self, system: np.ndarray):
         pass
 
+    # The hook finding the positions of the atoms of stacked systems in their cubes, as `make_cube` does for one
+    # system, with the signature (coords, is_from_protein, segments, starts) -> positions of size (nb_atoms, 3).
+    # Representations without it make their cubes system per system in `make_cubes`, or override `make_cubes`.
+    _scale_coords_batch = None
+
+    def make_cubes(self, systems: list, out: np.ndarray = None):
+        """
+        Make the cubes of several systems at once.
+
+        The atoms of all the systems are stacked with the index of their system (their segment), so that each step
+        of `make_cube` is done once for the whole batch and all the cubes are filled with a single scatter
+        (see `_scale_coords_batch`).
+
+        :param systems: the list of protein-ligand systems (see `make_cube`)
+        :param out: a np.ndarray of size (nb_systems, res, res, res, nb_features) of the type of cubes
+        to write the cubes in
+        :return: the cubes as a np.ndarray of size (nb_systems, res, res, res, nb_features)
+        """
+        if out is None:
+            out = np.empty((len(systems),) + self.get_cube_shape(), dtype=self._cube_dtype)
+
+        assert out.shape == (len(systems),) + self.get_cube_shape()
+        assert out.dtype == self._cube_dtype
+        assert out.flags.c_contiguous
+        if len(systems) == 0:
+            return out
+
+        if self._scale_coords_batch is None:
+            for i, system in enumerate(systems):
+                out[i] = self.make_cube(system)
+            return out
+
+        lengths = np.array([len(system) for system in systems])
+        segments = np.repeat(np.arange(len(systems)), lengths)
+        starts = np.cumsum(lengths) - lengths
+
+        stacked_systems = np.concatenate(systems, axis=0)
+        coords = stacked_systems[:, 0:3]
+        atom_features = stacked_systems[:, 3:]
+        is_from_protein = stacked_systems[:, INDICES_FEATURES["is_from_protein"]] == 1.
+
+        if self._translate_ligand:
+            coords = self._translate_ligands_on_proteins(coords, is_from_protein, segments, len(systems))
+
+        if self._use_rotation_invariance:
+            coords = self._representations_invariance(coords, is_from_protein, segments, len(systems))
+
+        positions = self._scale_coords_batch(coords, is_from_protein, segments, starts)
+
+        return self._fill_cubes(positions, atom_features, segments, out)
+
 
 class AbsoluteCubeRepresentation(CubeRepresentation):
     """
@@ -170,7 +564,8 @@ class AbsoluteCubeRepresentation(CubeRepresentation):
     name = "absolute"
 
     def __init__(self, length_cube_side, cube_resolution: float=DEFAULT_CUBE_RES,
-                 use_rotation_invariance=True, translate_ligand=False, verbose=False):
+                 use_rotation_invariance=True, translate_ligand=False, verbose=False, cube_dtype=CUBE_DTYPE_DEFAULT,
+                 density_sigma: float=None):
         """
 
         :param length_cube_side: length of the side of the cube to create
@@ -178,10 +573,18 @@ class AbsoluteCubeRepresentation(CubeRepresentation):
         :param translate_ligand:
         :param verbose: utputs info about transformation
         :param cube_resolution: the resolution used for the cube (1 Å)
+        :param cube_dtype: the type of the values of cubes
+        :param density_sigma: the standard deviation in voxels of the density of atoms
         """
-        super().__init__(length_cube_side, use_rotation_invariance, translate_ligand, verbose)
+        super().__init__(length_cube_side, use_rotation_invariance, translate_ligand, verbose, cube_dtype,
+                         density_sigma)
         self._cube_resolution = float(cube_resolution)
 
+    def get_parameters(self):
+        parameters = super().get_parameters()
+        parameters["cube_resolution"] = self._cube_resolution
+        return parameters
+
     def make_cube(self, system: np.ndarray):
         """
         Creating a cube from a numpy array consisting 3 axis coordinates of the cube. Cube is a numpy array representing
@@ -198,8 +601,8 @@ class AbsoluteCubeRepresentation(CubeRepresentation):
 
         if self._translate_ligand:
             is_from_protein_column = INDICES_FEATURES["is_from_protein"]
-            is_from_protein_indices = np.where(system[:, is_from_protein_column] == 1.)
-            original_coords = self._translate_ligand_on_protein(original_coords, is_from_protein_indices)
+            is_from_protein = system[:, is_from_protein_column] == 1.
+            original_coords = self._translate_ligand_on_protein(original_coords, is_from_protein)
 
         if self._use_rotation_invariance:
             is_from_protein_column = INDICES_FEATURES["is_from_protein"]
@@ -213,8 +616,7 @@ class AbsoluteCubeRepresentation(CubeRepresentation):
 
         assert nb_feat + coords.shape[1] == NB_FEATURES
 
-        length_cube_side_int = int(LENGTH_CUBE_SIDE)
-        length_cube_side_float = float(LENGTH_CUBE_SIDE)
+        length_cube_side_float = float(self._length_cube_side)
 
         center = np.mean(coords, axis=0)
 
@@ -222,16 +624,26 @@ class AbsoluteCubeRepresentation(CubeRepresentation):
 
         translation_distance = length_cube_side_float / 2 * self._cube_resolution
 
-        scaled_coords = (centered_coords + translation_distance) / self._cube_resolution
-        scaled_coords = scaled_coords.round().astype(int)
+        positions = (centered_coords + translation_distance) / self._cube_resolution
 
-        # Just keeping atom that are in the box
-        in_box = ((scaled_coords >= 0) & (scaled_coords < LENGTH_CUBE_SIDE)).all(axis=1)
-        cube = np.zeros((length_cube_side_int, length_cube_side_int, length_cube_side_int, nb_feat), dtype=np.float32)
-        for (x, y, z), f in zip(scaled_coords[in_box], atom_features[in_box]):
-            cube[x, y, z] += f
+        return self._fill_cube(positions, atom_features)
 
-        return cube
+    def _cubes_centers(self, coords, is_from_protein, segments, nb_systems: int):
+        """
+        :param coords: the stacked coordinates of the systems
+        :param is_from_protein: the boolean mask of the atoms of proteins
+        :param segments: the index of the system of each atom
+        :param nb_systems: the number of systems
+        :return: the coordinates of the centers of the cubes of the systems
+        """
+        return self._segments_means(coords, segments, nb_systems)
+
+    def _scale_coords_batch(self, coords, is_from_protein, segments, starts):
+        centers = self._cubes_centers(coords, is_from_protein, segments, len(starts)).astype(coords.dtype)
+
+        translation_distance = float(self._length_cube_side) / 2 * self._cube_resolution
+
+        return (coords - centers[segments] + translation_distance) / self._cube_resolution
 
 
 class RelativeCubeRepresentation(CubeRepresentation):
@@ -249,8 +661,11 @@ class RelativeCubeRepresentation(CubeRepresentation):
 
     name = "relative"
 
+    # Atoms are placed in voxels by flooring their positions
+    _voxels_centers_offset = 0.5
+
     def __init__(self, length_cube_side, use_rotation_invariance=True, translate_ligand=False, verbose=False,
-                 keep_proportions=True):
+                 keep_proportions=True, cube_dtype=CUBE_DTYPE_DEFAULT, density_sigma: float=None):
         """
 
         :param length_cube_side:
@@ -258,27 +673,17 @@ class RelativeCubeRepresentation(CubeRepresentation):
         :param translate_ligand:
         :param verbose:
         :param keep_proportions:
+        :param cube_dtype:
+        :param density_sigma:
         """
-        super().__init__(length_cube_side, use_rotation_invariance, translate_ligand, verbose)
+        super().__init__(length_cube_side, use_rotation_invariance, translate_ligand, verbose, cube_dtype,
+                         density_sigma)
         self._keep_proportions = keep_proportions
 
-    @staticmethod
-    def _values_range(spatial_coordinates):
-        """
-        Return the extreme (maximum, minimum) values for atoms coordinates.
-
-        :param spatial_coordinates: np.ndarray of size (nb_atoms, 3)
-        :return: extreme values for each coordinates x, y, z
-        """
-        x_min = np.min(spatial_coordinates[:, 0])
-        y_min = np.min(spatial_coordinates[:, 1])
-        z_min = np.min(spatial_coordinates[:, 2])
-
-        x_max = np.max(spatial_coordinates[:, 0])
-        y_max = np.max(spatial_coordinates[:, 1])
-        z_max = np.max(spatial_coordinates[:, 2])
-
-        return x_min, x_max, y_min, y_max, z_min, z_max
+    def get_parameters(self):
+        parameters = super().get_parameters()
+        parameters["keep_proportions"] = self._keep_proportions
+        return parameters
 
     def make_cube(self, system: np.ndarray):
         """
@@ -295,8 +700,8 @@ class RelativeCubeRepresentation(CubeRepresentation):
 
         if self._translate_ligand:
             is_from_protein_column = INDICES_FEATURES["is_from_protein"]
-            is_from_protein_indices = np.where(system[:, is_from_protein_column] == 1.)
-            original_coords = self._translate_ligand_on_protein(original_coords, is_from_protein_indices)
+            is_from_protein = system[:, is_from_protein_column] == 1.
+            original_coords = self._translate_ligand_on_protein(original_coords, is_from_protein)
 
         if self._use_rotation_invariance:
             is_from_protein_column = INDICES_FEATURES["is_from_protein"]
@@ -310,33 +715,657 @@ class RelativeCubeRepresentation(CubeRepresentation):
 
         assert nb_feat + coords.shape[1] == NB_FEATURES
 
-        # Getting extreme values
-        x_min, x_max, y_min, y_max, z_min, z_max = self._values_range(coords)
-
-        # Finding the maximum range between extreme points on each coordinates
-        x_range = x_max - x_min
-        y_range = y_max - y_min
-        z_range = z_max - z_min
+        # Getting extreme values and the ranges between them on each coordinates
+        mins = coords.min(axis=0)
+        ranges = coords.max(axis=0) - mins
 
         # If we want to keep the proportion, we can scale adequately
         if self._keep_proportions:
-            max_range = max([x_range, y_range, z_range])
-            x_range = max_range
-            y_range = max_range
-            z_range = max_range
+            ranges[:] = ranges.max()
 
         # Scaling coordinates to be in the cube [0,res]^3 then flooring
+        eps = 10e-4  # To be sure to round down on exact position
+        # The ranges are increased as scalars would be, before being used with the type of coordinates
+        denominators = (ranges.astype(np.float64) + eps).astype(coords.dtype)
+        positions = (coords - mins) / denominators * self._length_cube_side
+
+        # Filling the cube with the features
+        return self._fill_cube(positions, atom_features)
+
+    def _nearest_voxels(self, positions):
+        return np.floor(positions).astype(int)
+
+    def _scale_coords_batch(self, coords, is_from_protein, segments, starts):
+        # Extreme values of each system
+        mins = np.minimum.reduceat(coords, starts, axis=0)
+        ranges = np.maximum.reduceat(coords, starts, axis=0) - mins
+
+        if self._keep_proportions:
+            ranges[:] = ranges.max(axis=1)[:, None]
 
-        scaled_coords = (coords * 0).astype(int)
         eps = 10e-4  # To be sure to round down on exact position
-        scaled_coords[:, 0] = np.floor((coords[:, 0] - x_min) / (x_range + eps) * LENGTH_CUBE_SIDE).astype(int)
-        scaled_coords[:, 1] = np.floor((coords[:, 1] - y_min) / (y_range + eps) * LENGTH_CUBE_SIDE).astype(int)
-        scaled_coords[:, 2] = np.floor((coords[:, 2] - z_min) / (z_range + eps) * LENGTH_CUBE_SIDE).astype(int)
+        denominators = (ranges.astype(np.float64) + eps).astype(coords.dtype)
+        return (coords - mins[segments]) / denominators[segments] * self._length_cube_side
 
-        cube = np.zeros((LENGTH_CUBE_SIDE, LENGTH_CUBE_SIDE, LENGTH_CUBE_SIDE, nb_feat))
 
-        # Filling the cube with the features
-        for (x, y, z), f in zip(scaled_coords, atom_features):
-            cube[x, y, z] += f
+class ProteinAnchoredCubeRepresentation(AbsoluteCubeRepresentation):
+    """
+    Class that construct a protein-anchored cube representation (see `CubeRepresentation` for an general overview of
+    cube representations).
+
+    This representation is an absolute representation whose frame only depends on the protein: the cube is centered
+    on the center of the protein and, if the representation is rotation invariant, rotated with the PCA of the protein.
+
+    Hence the voxels of the atoms of a protein are the same whatever the ligand is. When screening ligands against
+    a protein, the grid of the atoms of the protein is made once and cached with its frame (see `get_protein_grid`):
+    the cube of a pair is then this grid plus the voxels of the ligand (see `make_pair_cube`).
+
+    """
+    name = "protein_anchored"
+
+    def __init__(self, length_cube_side, cube_resolution: float=DEFAULT_CUBE_RES,
+                 use_rotation_invariance=True, translate_ligand=False, verbose=False,
+                 nb_cached_proteins: int=NB_CACHED_PROTEIN_GRIDS_DEFAULT, cube_dtype=CUBE_DTYPE_DEFAULT,
+                 density_sigma: float=None):
+        """
+
+        :param length_cube_side: length of the side of the cube to create
+        :param cube_resolution: the resolution used for the cube (1 Å)
+        :param use_rotation_invariance: perform the canonical rotation of the PCA of the protein
+        :param translate_ligand: to translated the ligand at the center of the protein
+        :param verbose: outputs info about transformation
+        :param nb_cached_proteins: the number of grids of proteins kept in memory
+        :param cube_dtype: the type of the values of cubes
+        :param density_sigma: the standard deviation in voxels of the density of atoms
+        """
+        super().__init__(length_cube_side, cube_resolution, use_rotation_invariance, translate_ligand, verbose,
+                         cube_dtype, density_sigma)
+        self._nb_cached_proteins = nb_cached_proteins
+        self._protein_grids = OrderedDict()
+
+    def _voxelize(self, coords, atom_features, center):
+        """
+        :param coords: the coordinates of atoms in the frame of the protein
+        :param atom_features: the features of the atoms
+        :param center: the center of the cube
+        :return: the cube of the atoms
+        """
+        translation_distance = float(self._length_cube_side) / 2 * self._cube_resolution
+
+        return self._fill_cube((coords - center + translation_distance) / self._cube_resolution, atom_features)
+
+    def _make_protein_grid(self, protein: np.ndarray):
+        """
+        :param protein: the protein with columns (x, y, z, is_hydrophobic, is_polar, is_from_protein, is_from_ligand)
+        :return: the frame of the protein (its center, its rotation matrix or None, the center of the cube)
+        and the read-only cube of its atoms
+        """
+        protein_coords = protein[:, 0:3]
+        center_protein = np.mean(protein_coords, axis=0)
+
+        if self._use_rotation_invariance:
+            rotation_mat = self._protein_rotation(protein_coords)
+            protein_coords = protein_coords.dot(rotation_mat)
+        else:
+            rotation_mat = None
+
+        center = np.mean(protein_coords, axis=0)
+        grid = self._voxelize(protein_coords, protein[:, 3:], center)
+        grid.flags.writeable = False
+
+        return center_protein, rotation_mat, center, grid
+
+    def _ligands_coords(self, protein_grid, ligand_coords, ligand_centers):
+        """
+        :param protein_grid: the frame and the grid of a protein (see `_make_protein_grid`)
+        :param ligand_coords: the coordinates of the atoms of ligands
+        :param ligand_centers: the center of the ligand of each atom (used only to translate ligands)
+        :return: the coordinates of the atoms of the ligands in the frame of the protein
+        """
+        center_protein, rotation_mat, _, _ = protein_grid
+
+        if self._translate_ligand:
+            ligand_coords = ligand_coords - (ligand_centers - center_protein)
+
+        if rotation_mat is not None:
+            ligand_coords = ligand_coords.dot(rotation_mat)
+
+        return ligand_coords
+
+    def get_protein_grid(self, protein_key, protein: np.ndarray):
+        """
+        Return the frame and the grid of a protein, made once and kept for the last proteins used.
+
+        :param protein_key: a hashable identifying the protein, for instance (examples folder, protein id)
+        :param protein: the protein (used only if its grid is not cached)
+        :return: the frame and the grid of the protein (see `_make_protein_grid`)
+        """
+        if protein_key in self._protein_grids:
+            self._protein_grids.move_to_end(protein_key)
+            return self._protein_grids[protein_key]
 
-        return cube
+        protein_grid = self._make_protein_grid(protein)
+
+        self._protein_grids[protein_key] = protein_grid
+        if len(self._protein_grids) > self._nb_cached_proteins:
+            self._protein_grids.popitem(last=False)
+
+        return protein_grid
+
+    def make_cube(self, system: np.ndarray):
+        """
+        Creating a cube from a numpy array consisting 3 axis coordinates of the cube. Cube is a numpy array representing
+        information in the 3D space. Each Protein and ligand are filled into the cube coordinates position, each
+        position contains atom features information.
+
+        :param system: the protein-ligand system with columns : (x, y, z, is_hydrophobic, is_polar, is_from_protein,
+        is_from_ligand)
+        :return: a cube 4D np.ndarray of size (res, res, res, nb_features)
+        """
+        is_from_protein = system[:, INDICES_FEATURES["is_from_protein"]] == 1.
+
+        return self._make_pair_cube(self._make_protein_grid(system[is_from_protein]), system[~is_from_protein])
+
+    def _make_pair_cube(self, protein_grid, ligand: np.ndarray):
+        ligand_coords = ligand[:, 0:3]
+        ligand_center = np.mean(ligand_coords, axis=0) if self._translate_ligand else None
+        ligand_coords = self._ligands_coords(protein_grid, ligand_coords, ligand_center)
+
+        _, _, center, grid = protein_grid
+        return self._add_cubes(self._voxelize(ligand_coords, ligand[:, 3:], center), grid)
+
+    def make_pair_cube(self, protein_key, protein: np.ndarray, ligand: np.ndarray):
+        """
+        Make the cube of a pair from the cached grid of the protein: it is the cube `make_cube` would make for the
+        system of the protein and the ligand.
+
+        :param protein_key: a hashable identifying the protein (see `get_protein_grid`)
+        :param protein: the protein (used only if its grid is not cached)
+        :param ligand: the ligand
+        :return: a cube 4D np.ndarray of size (res, res, res, nb_features)
+        """
+        return self._make_pair_cube(self.get_protein_grid(protein_key, protein), ligand)
+
+    def make_pair_cubes(self, protein_key, protein: np.ndarray, ligands: list, out: np.ndarray = None):
+        """
+        Make the cubes of the pairs of a protein with several ligands at once (see `make_pair_cube`
+        and `make_cubes`).
+
+        :param protein_key: a hashable identifying the protein (see `get_protein_grid`)
+        :param protein: the protein (used only if its grid is not cached)
+        :param ligands: the list of ligands
+        :param out: a np.ndarray of size (nb_ligands, res, res, res, nb_features) of the type of cubes
+        to write the cubes in
+        :return: the cubes as a np.ndarray of size (nb_ligands, res, res, res, nb_features)
+        """
+        protein_grid = self.get_protein_grid(protein_key, protein)
+        _, _, center, grid = protein_grid
+
+        if out is None:
+            out = np.empty((len(ligands),) + grid.shape, dtype=self._cube_dtype)
+
+        assert out.shape == (len(ligands),) + grid.shape
+        assert out.dtype == self._cube_dtype
+        assert out.flags.c_contiguous
+        if len(ligands) == 0:
+            return out
+
+        lengths = np.array([len(ligand) for ligand in ligands])
+        segments = np.repeat(np.arange(len(ligands)), lengths)
+
+        stacked_ligands = np.concatenate(ligands, axis=0)
+        ligand_coords = stacked_ligands[:, 0:3]
+        ligand_centers = None
+        if self._translate_ligand:
+            ligand_centers = self._segments_means(ligand_coords, segments, len(ligands)).astype(ligand_coords.dtype)
+            ligand_centers = ligand_centers[segments]
+        ligand_coords = self._ligands_coords(protein_grid, ligand_coords, ligand_centers)
+
+        translation_distance = float(self._length_cube_side) / 2 * self._cube_resolution
+        positions = (ligand_coords - center + translation_distance) / self._cube_resolution
+
+        self._fill_cubes(positions, stacked_ligands[:, 3:], segments, out)
+        self._add_cubes(out, grid)
+
+        return out
+
+    def _cubes_centers(self, coords, is_from_protein, segments, nb_systems: int):
+        return self._segments_means(coords[is_from_protein], segments[is_from_protein], nb_systems)
+
+
+class PocketCubeRepresentation(AbsoluteCubeRepresentation):
+    """
+    Class that construct a pocket cube representation (see `CubeRepresentation` for an general overview of cube
+    representations).
+
+    This representation is an absolute representation centered on the center of the ligand: only the atoms of the
+    protein around the ligand (its binding pocket) can be in the cube. These atoms are selected before any rotation
+    or voxelization, so that the cost of a cube depends on the size of the pocket instead of the size of the protein.
+
+    If the representation is rotation invariant, the cube is rotated with the PCA of the atoms of the pocket.
+
+    The atoms of the pocket are found with a KD-tree of the atoms of the protein, built once and kept for the last
+    proteins used (see `get_protein_tree`). Examples loaded from a folder are made protein per protein, identified
+    by the folder and their id (see `make_pair_cubes`); only the systems given to `make_cube` or `make_cubes`
+    have their protein identified by a hash of its atoms.
+
+    """
+    name = "pocket"
+
+    def __init__(self, length_cube_side, cube_resolution: float=POCKET_CUBE_RES_DEFAULT,
+                 use_rotation_invariance=True, verbose=False,
+                 nb_cached_proteins: int=NB_CACHED_PROTEIN_GRIDS_DEFAULT, cube_dtype=CUBE_DTYPE_DEFAULT,
+                 density_sigma: float=None):
+        """
+
+        :param length_cube_side: length of the side of the cube to create
+        :param cube_resolution: the resolution used for the cube (1 Å)
+        :param use_rotation_invariance: perform the canonical rotation of the PCA of the pocket
+        :param verbose: outputs info about transformation
+        :param nb_cached_proteins: the number of KD-trees of proteins kept in memory
+        :param cube_dtype: the type of the values of cubes
+        :param density_sigma: the standard deviation in voxels of the density of atoms
+        """
+        super().__init__(length_cube_side, cube_resolution, use_rotation_invariance, False, verbose, cube_dtype,
+                         density_sigma)
+        self._nb_cached_proteins = nb_cached_proteins
+        self._protein_trees = OrderedDict()
+
+    def _pocket_radius(self):
+        """
+        :return: the distance to the center of the cube beyond which atoms can not be in the cube, and the norm
+        of this distance: the largest absolute coordinate (np.inf) or the euclidean norm (2) if the cube is rotated
+        """
+        # Half of the side of the cube, with a voxel of margin for the rounding of coordinates
+        half_side = (self._length_cube_side / 2 + 1) * self._cube_resolution
+
+        if self._use_rotation_invariance:
+            return np.sqrt(3) * half_side, 2
+
+        return half_side, np.inf
+
+    def _select_pocket(self, protein: np.ndarray, center):
+        """
+        :param protein: the atoms of the protein
+        :param center: the center of the cube
+        :return: the atoms of the protein that can be in the cube
+        """
+        radius, norm = self._pocket_radius()
+        offsets = np.abs(protein[:, 0:3].astype(np.float64) - center)
+        distances = offsets.max(axis=1) if norm == np.inf else np.sqrt((offsets ** 2).sum(axis=1))
+
+        return protein[distances <= radius]
+
+    def get_protein_tree(self, protein_key, protein: np.ndarray):
+        """
+        Return the KD-tree of the atoms of a protein, built once and kept for the last proteins used.
+
+        :param protein_key: a hashable identifying the protein, for instance (examples folder, protein id)
+        :param protein: the protein (used only if its tree is not cached)
+        :return: the `cKDTree` of the coordinates of the atoms of the protein
+        """
+        if protein_key in self._protein_trees:
+            self._protein_trees.move_to_end(protein_key)
+            return self._protein_trees[protein_key]
+
+        protein_tree = cKDTree(protein[:, 0:3])
+
+        self._protein_trees[protein_key] = protein_tree
+        if len(self._protein_trees) > self._nb_cached_proteins:
+            self._protein_trees.popitem(last=False)
+
+        return protein_tree
+
+    def _query_pocket(self, protein_tree, protein: np.ndarray, center):
+        """
+        :param protein_tree: the KD-tree of the protein (see `get_protein_tree`)
+        :param protein: the atoms of the protein
+        :param center: the center of the cube
+        :return: the atoms of the protein that can be in the cube, as `_select_pocket` returns them
+        """
+        radius, norm = self._pocket_radius()
+        # Sorted to keep the order of atoms of the protein, so that the rotation is the one of `make_cube`
+        indices = np.sort(np.array(protein_tree.query_ball_point(center, radius, p=norm), dtype=np.int64))
+
+        # Selecting again the few atoms found, as distances to the radius may be rounded differently
+        return self._select_pocket(protein[indices], center)
+
+    def _pocket_positions(self, pocket: np.ndarray, ligand: np.ndarray, center):
+        """
+        :param pocket: the atoms of the protein around the ligand
+        :param ligand: the atoms of the ligand
+        :param center: the center of the cube
+        :return: the positions of the atoms in the coordinates of voxels, as np.ndarray of size (nb_atoms, 3),
+        and their features
+        """
+        atoms = np.concatenate((pocket, ligand), axis=0)
+        coords = atoms[:, 0:3] - center
+
+        # The PCA is not defined for less than 3 atoms
+        if self._use_rotation_invariance and len(pocket) >= 3:
+            coords = coords.dot(self._protein_rotation(pocket[:, 0:3]))
+
+        translation_distance = float(self._length_cube_side) / 2 * self._cube_resolution
+
+        return (coords + translation_distance) / self._cube_resolution, atoms[:, 3:]
+
+    @staticmethod
+    def _protein_key(protein: np.ndarray):
+        """
+        :param protein: the atoms of a protein
+        :return: a key identifying the protein by its atoms, to cache its KD-tree when only the system is given
+        """
+        return len(protein), hashlib.sha1(np.ascontiguousarray(protein).tobytes()).digest()
+
+    def _split_pocket(self, system: np.ndarray):
+        """
+        :param system: the protein-ligand system
+        :return: the atoms of the pocket, the atoms of the ligand and the center of the cube
+        """
+        is_from_protein = system[:, INDICES_FEATURES["is_from_protein"]] == 1.
+        protein = system[is_from_protein]
+        ligand = system[~is_from_protein]
+        center = np.mean(ligand[:, 0:3], axis=0)
+
+        protein_tree = self.get_protein_tree(self._protein_key(protein), protein)
+
+        return self._query_pocket(protein_tree, protein, center), ligand, center
+
+    def make_cube(self, system: np.ndarray):
+        """
+        Creating a cube from a numpy array consisting 3 axis coordinates of the cube. Cube is a numpy array representing
+        information in the 3D space. Each Protein and ligand are filled into the cube coordinates position, each
+        position contains atom features information.
+
+        :param system: the protein-ligand system with columns : (x, y, z, is_hydrophobic, is_polar, is_from_protein,
+        is_from_ligand)
+        :return: a cube 4D np.ndarray of size (res, res, res, nb_features)
+        """
+        return self._fill_cube(*self._pocket_positions(*self._split_pocket(system)))
+
+    def _make_pockets_cubes(self, pockets: list, out: np.ndarray = None):
+        """
+        :param pockets: the list of the atoms of the pocket, the atoms of the ligand and the center of each cube
+        :param out: a np.ndarray of size (nb_pockets, res, res, res, nb_features) of the type of cubes
+        to write the cubes in
+        :return: the cubes as a np.ndarray of size (nb_pockets, res, res, res, nb_features)
+        """
+        if out is None:
+            out = np.empty((len(pockets),) + self.get_cube_shape(), dtype=self._cube_dtype)
+
+        assert out.shape == (len(pockets),) + self.get_cube_shape()
+        assert out.dtype == self._cube_dtype
+        assert out.flags.c_contiguous
+        if len(pockets) == 0:
+            return out
+
+        # The atoms of pockets are few: they are transformed pocket per pocket, and all the cubes filled at once
+        atoms = [self._pocket_positions(*pocket) for pocket in pockets]
+        segments = np.repeat(np.arange(len(atoms)), [len(positions) for positions, _ in atoms])
+
+        return self._fill_cubes(np.concatenate([positions for positions, _ in atoms]),
+                                np.concatenate([atom_features for _, atom_features in atoms]),
+                                segments, out)
+
+    def make_cubes(self, systems: list, out: np.ndarray = None):
+        return self._make_pockets_cubes([self._split_pocket(system) for system in systems], out)
+
+    def make_pair_cube(self, protein_key, protein: np.ndarray, ligand: np.ndarray):
+        """
+        Make the cube of a pair, finding the pocket with the cached KD-tree of the protein: it is the cube `make_cube`
+        would make for the system of the protein and the ligand.
+
+        :param protein_key: a hashable identifying the protein (see `get_protein_tree`)
+        :param protein: the protein
+        :param ligand: the ligand
+        :return: a cube 4D np.ndarray of size (res, res, res, nb_features)
+        """
+        return self.make_pair_cubes(protein_key, protein, [ligand])[0]
+
+    def make_pair_cubes(self, protein_key, protein: np.ndarray, ligands: list, out: np.ndarray = None):
+        """
+        Make the cubes of the pairs of a protein with several ligands at once (see `make_pair_cube`
+        and `make_cubes`).
+
+        :param protein_key: a hashable identifying the protein (see `get_protein_tree`)
+        :param protein: the protein
+        :param ligands: the list of ligands
+        :param out: a np.ndarray of size (nb_ligands, res, res, res, nb_features) of the type of cubes
+        to write the cubes in
+        :return: the cubes as a np.ndarray of size (nb_ligands, res, res, res, nb_features)
+        """
+        protein_tree = self.get_protein_tree(protein_key, protein)
+
+        pockets = []
+        for ligand in ligands:
+            center = np.mean(ligand[:, 0:3], axis=0)
+            pockets.append((self._query_pocket(protein_tree, protein, center), ligand, center))
+
+        return self._make_pockets_cubes(pockets, out)
+
+
+class ContactFingerprintRepresentation(CubeRepresentation):
+    """
+    Class that construct a contact fingerprint of a protein-ligand system instead of a cube (see `CubeRepresentation`
+    for an general overview of representations).
+
+    The fingerprint is a fixed-length vector of the histograms of the distances between the atoms of the protein and
+    the atoms of the ligand within `cutoff` angstroms, one histogram per pair of types of atoms (hydrophobic or polar
+    for the protein, hydrophobic or polar for the ligand). It is invariant by rotation and much cheaper to make and to
+    score than a cube (see `models.ContactNet`).
+
+    The pairs of atoms in contact are found with KD-trees. When the protein of a pair is known
+    (see `make_pair_cube`), the KD-tree of the protein is built once and kept for the last proteins used.
+
+    Fingerprints are given to models as cubes are: `get_cube_shape` is the shape of fingerprints.
+
+    """
+    name = "contact_fingerprint"
+
+    # The features of the types of atoms: (is_hydrophobic, is_polar)
+    _atom_types = slice(INDICES_FEATURES["is_hydrophobic"] - 3, INDICES_FEATURES["is_polar"] + 1 - 3)
+
+    def __init__(self, cutoff: float=CONTACT_CUTOFF, nb_bins: int=NB_CONTACT_BINS, verbose=False,
+                 nb_cached_proteins: int=NB_CACHED_PROTEIN_GRIDS_DEFAULT, cube_dtype=CUBE_DTYPE_DEFAULT):
+        """
+
+        :param cutoff: the largest distance in angstrom between atoms in contact
+        :param nb_bins: the number of bins of the histograms of distances
+        :param verbose: outputs info about transformation
+        :param nb_cached_proteins: the number of KD-trees of proteins kept in memory
+        :param cube_dtype: the type of the values of fingerprints
+        """
+        super().__init__(None, use_rotation_invariance=False, translate_ligand=False, verbose=verbose,
+                         cube_dtype=cube_dtype)
+        self._cutoff = float(cutoff)
+        self._nb_bins = nb_bins
+        self._nb_cached_proteins = nb_cached_proteins
+        self._protein_trees = OrderedDict()
+
+        nb_types = self._atom_types.stop - self._atom_types.start
+        self._nb_types_pairs = nb_types ** 2
+
+    def get_parameters(self):
+        return dict(name=self.name,
+                    cutoff=self._cutoff,
+                    nb_bins=self._nb_bins,
+                    cube_dtype=self._cube_dtype.name)
+
+    def get_cube_shape(self):
+        """
+        :return: the shape of the fingerprints (nb_types_pairs * nb_bins,)
+        """
+        return (self._nb_types_pairs * self._nb_bins,)
+
+    def get_protein_tree(self, protein_key, protein: np.ndarray):
+        """
+        Return the KD-tree of the atoms of a protein, built once and kept for the last proteins used.
+
+        :param protein_key: a hashable identifying the protein, for instance (examples folder, protein id)
+        :param protein: the protein (used only if its tree is not cached)
+        :return: the `cKDTree` of the coordinates of the atoms of the protein
+        """
+        if protein_key in self._protein_trees:
+            self._protein_trees.move_to_end(protein_key)
+            return self._protein_trees[protein_key]
+
+        protein_tree = cKDTree(protein[:, 0:3])
+
+        self._protein_trees[protein_key] = protein_tree
+        if len(self._protein_trees) > self._nb_cached_proteins:
+            self._protein_trees.popitem(last=False)
+
+        return protein_tree
+
+    def _contacts(self, protein_tree, protein: np.ndarray, ligand: np.ndarray):
+        """
+        :param protein_tree: the KD-tree of the protein
+        :param protein: the atoms of the protein
+        :param ligand: the atoms of the ligand
+        :return: the indices in the fingerprint of the contacts of the pair, and their weights, as np.ndarrays
+        of size (nb_contacts * nb_types_pairs,)
+        """
+        contacts = cKDTree(ligand[:, 0:3]).sparse_distance_matrix(protein_tree, self._cutoff, output_type="ndarray")
+
+        bins = np.minimum((contacts["v"] / self._cutoff * self._nb_bins).astype(int), self._nb_bins - 1)
+
+        # The contact of two atoms counts for the product of their types, for each pair of types
+        ligand_types = ligand[contacts["i"], 3:][:, self._atom_types]
+        protein_types = protein[contacts["j"], 3:][:, self._atom_types]
+        weights = (protein_types[:, :, None] * ligand_types[:, None, :]).reshape((len(contacts), self._nb_types_pairs))
+        indices = np.arange(self._nb_types_pairs) * self._nb_bins + bins[:, None]
+
+        return indices.ravel(), weights.ravel()
+
+    def _fill_fingerprints(self, contacts: list, out: np.ndarray = None):
+        """
+        :param contacts: the list of the contacts of each pair (see `_contacts`)
+        :param out: a np.ndarray of size (nb_pairs, nb_features) of the type of fingerprints to write them in
+        :return: the fingerprints as a np.ndarray of size (nb_pairs, nb_features)
+        """
+        if out is None:
+            out = np.empty((len(contacts),) + self.get_cube_shape(), dtype=self._cube_dtype)
+
+        assert out.shape == (len(contacts),) + self.get_cube_shape()
+        assert out.dtype == self._cube_dtype
+        assert out.flags.c_contiguous
+        if len(contacts) == 0:
+            return out
+
+        # The histograms of all the pairs are filled at once
+        nb_features = out.shape[1]
+        indices = np.concatenate([pair_indices + pair * nb_features
+                                  for pair, (pair_indices, _) in enumerate(contacts)])
+        weights = np.concatenate([pair_weights for _, pair_weights in contacts])
+        out.reshape(-1)[:] = self._saturate(np.bincount(indices, weights=weights, minlength=out.size), out.dtype)
+
+        return out
+
+    @staticmethod
+    def _split_system(system: np.ndarray):
+        is_from_protein = system[:, INDICES_FEATURES["is_from_protein"]] == 1.
+        return system[is_from_protein], system[~is_from_protein]
+
+    def make_cube(self, system: np.ndarray):
+        """
+        Make the fingerprint of a protein-ligand system.
+
+        :param system: the protein-ligand system with columns : (x, y, z, is_hydrophobic, is_polar, is_from_protein,
+        is_from_ligand)
+        :return: the fingerprint as a np.ndarray of size (nb_features,)
+        """
+        return self.make_cubes([system])[0]
+
+    def make_cubes(self, systems: list, out: np.ndarray = None):
+        contacts = []
+        for protein, ligand in map(self._split_system, systems):
+            # Only the atoms of the protein in the bounding box of the ligand, extended with the cutoff, are indexed
+            near_ligand = ((protein[:, 0:3] >= ligand[:, 0:3].min(axis=0) - self._cutoff)
+                           & (protein[:, 0:3] <= ligand[:, 0:3].max(axis=0) + self._cutoff)).all(axis=1)
+            pocket = protein[near_ligand]
+            contacts.append(self._contacts(cKDTree(pocket[:, 0:3]), pocket, ligand))
+
+        return self._fill_fingerprints(contacts, out)
+
+    def make_pair_cube(self, protein_key, protein: np.ndarray, ligand: np.ndarray):
+        """
+        Make the fingerprint of a pair with the cached KD-tree of the protein: it is the fingerprint `make_cube`
+        would make for the system of the protein and the ligand.
+
+        :param protein_key: a hashable identifying the protein (see `get_protein_tree`)
+        :param protein: the protein
+        :param ligand: the ligand
+        :return: the fingerprint as a np.ndarray of size (nb_features,)
+        """
+        return self.make_pair_cubes(protein_key, protein, [ligand])[0]
+
+    def make_pair_cubes(self, protein_key, protein: np.ndarray, ligands: list, out: np.ndarray = None):
+        """
+        Make the fingerprints of the pairs of a protein with several ligands at once (see `make_pair_cube`).
+
+        :param protein_key: a hashable identifying the protein (see `get_protein_tree`)
+        :param protein: the protein
+        :param ligands: the list of ligands
+        :param out: a np.ndarray of size (nb_ligands, nb_features) of the type of fingerprints to write them in
+        :return: the fingerprints as a np.ndarray of size (nb_ligands, nb_features)
+        """
+        protein_tree = self.get_protein_tree(protein_key, protein)
+
+        return self._fill_fingerprints([self._contacts(protein_tree, protein, ligand) for ligand in ligands], out)
+
+
+# The representations by names
+REPRESENTATIONS = {representation.name: representation
+                   for representation in [RelativeCubeRepresentation, AbsoluteCubeRepresentation,
+                                          ProteinAnchoredCubeRepresentation, PocketCubeRepresentation,
+                                          ContactFingerprintRepresentation]}
+
+
+def get_representation(name: str, length_cube_side: int = LENGTH_CUBE_SIDE, cube_dtype=CUBE_DTYPE_DEFAULT,
+                       cube_resolution: float = None, density_sigma: float = None):
+    """
+    :param name: the name of a representation (see `REPRESENTATIONS`)
+    :param length_cube_side: the length of the cube (number of voxel on one dimension)
+    :param cube_dtype: the type of the values of cubes (see `CUBE_DTYPES`)
+    :param cube_resolution: the resolution of the cube in angstrom, for absolute representations
+                            (default: `DEFAULT_CUBE_RES`, `POCKET_CUBE_RES_DEFAULT` for pockets)
+    :param density_sigma: the standard deviation in voxels of the density of atoms (None to count atoms in
+                          their nearest voxel)
+    :return: the representation with its default parameters
+    """
+    if name not in REPRESENTATIONS:
+        raise ValueError(f"Unknown representation {name}: choose one of {list(REPRESENTATIONS.keys())}")
+
+    representation_class = REPRESENTATIONS[name]
+    if issubclass(representation_class, ContactFingerprintRepresentation):
+        if cube_resolution is not None or density_sigma is not None:
+            raise ValueError(f"The {name} representation has no voxels")
+        return representation_class(cube_dtype=cube_dtype)
+
+    if cube_resolution is None:
+        return representation_class(length_cube_side=length_cube_side, cube_dtype=cube_dtype,
+                                    density_sigma=density_sigma)
+
+    if not issubclass(representation_class, AbsoluteCubeRepresentation):
+        raise ValueError(f"The {name} representation has no resolution: its cubes are scaled to the systems")
+
+    return representation_class(length_cube_side=length_cube_side, cube_dtype=cube_dtype,
+                                cube_resolution=cube_resolution, density_sigma=density_sigma)
+
+
+def get_job_representation(parameters: dict):
+    """
+    Return the representation used by a training job, from its parameters (see `get_parameters_dict`).
+
+    Jobs saved before the choice of representations and of their parameters used the default ones.
+
+    :param parameters: the parameters of the job, as strings
+    :return: the representation
+    """
+    return get_representation(parameters.get("representation") or RelativeCubeRepresentation.name,
+                              length_cube_side=int(parameters.get("length_cube_side") or LENGTH_CUBE_SIDE),
+                              cube_dtype=parameters.get("cube_dtype") or CUBE_DTYPE_DEFAULT,
+                              cube_resolution=float(parameters["cube_resolution"])
+                              if parameters.get("cube_resolution") else None,
+                              density_sigma=float(parameters["density_sigma"])
+                              if parameters.get("density_sigma") else None)
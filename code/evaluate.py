@@ -6,12 +6,13 @@ import numpy as np
 import os
 import keras.backend as K
 from keras.models import load_model
+from sklearn import metrics
 from collections import defaultdict
 
-from discretization import RelativeCubeRepresentation, AbsoluteCubeRepresentation
+from discretization import get_job_representation
 from examples_iterator import ExamplesIterator
 from pipeline_fixtures import get_parameters_dict
-from settings import VALIDATION_EXAMPLES_FOLDER, METRICS_FOR_EVALUATION, RESULTS_FOLDER, LENGTH_CUBE_SIDE, \
+from settings import VALIDATION_EXAMPLES_FOLDER, METRICS_FOR_EVALUATION, RESULTS_FOLDER, \
     PARAMETERS_FILE_NAME_SUFFIX, EVALUATION_LOGS_FOLDER, EVALUATION_CSV_FILE
 from train_cnn import f1
 
@@ -20,7 +21,7 @@ def mean_pred(y_pred, y_true):
     return K.mean(y_pred)
 
 
-def evaluate(serialized_model_path, max_examples=None):
+def evaluate(serialized_model_path, max_examples=None, voxels_folder=None):
     """
     Evaluate a given model using custom metrics.
 
@@ -30,6 +31,7 @@ def evaluate(serialized_model_path, max_examples=None):
 
     :param serialized_model_path: where the serialized_model is
     :param max_examples: the maximum number of examples to use
+    :param voxels_folder: a folder of cubes precomputed for validation examples (see `voxelize`)
     :return:
     """
 
@@ -60,16 +62,17 @@ def evaluate(serialized_model_path, max_examples=None):
 
     parameters = get_parameters_dict(job_folder=job_folder)
 
-    cube_representation = AbsoluteCubeRepresentation(length_cube_side=LENGTH_CUBE_SIDE) \
-        if parameters["representation"] == AbsoluteCubeRepresentation.name \
-        else RelativeCubeRepresentation(length_cube_side=LENGTH_CUBE_SIDE)
+    cube_representation = get_job_representation(parameters)
 
     logger.debug(f"Representation: {cube_representation.name}")
+    # Models trained with early stopping keep the weights of their best epoch
+    logger.debug(f"Epoch kept: {parameters.get('kept_epoch') or 'unknown'}")
 
     validation_examples_iterator = ExamplesIterator(representation=cube_representation,
                                                     examples_folder=VALIDATION_EXAMPLES_FOLDER,
                                                     max_examples=max_examples,
-                                                    shuffle_after_completion=False)
+                                                    shuffle_after_completion=False,
+                                                    voxels_folder=voxels_folder)
 
     logger.debug(f"Evaluating on {validation_examples_iterator.get_nb_examples()} examples")
 
@@ -79,7 +82,8 @@ def evaluate(serialized_model_path, max_examples=None):
     y_rounded = np.array([1 if y > 0.5 else 0 for y in y_preds])
 
     logger.debug("Computing metrics")
-    metrics_results = dict(map(lambda metric: (metric.__name__, metric(ys, y_rounded)), METRICS_FOR_EVALUATION))
+    metrics_results = dict(map(lambda metric: (metric, getattr(metrics, metric)(ys, y_rounded)),
+                               METRICS_FOR_EVALUATION))
 
     # Gathering all the info together
     log = defaultdict(str, metrics_results)
@@ -98,9 +102,9 @@ def evaluate(serialized_model_path, max_examples=None):
 
     logger.debug(f"Writting results in {EVALUATION_CSV_FILE}")
 
-    metrics_name = list(map(lambda m: m.__name__, METRICS_FOR_EVALUATION))
+    metrics_name = list(METRICS_FOR_EVALUATION)
     parameters_name = ["model", "nb_epochs", "nb_neg", "max_examples", "batch_size", "optimizer",
-                       "representation", "weight_pos_class"]
+                       "representation", "weight_pos_class", "kept_epoch"]
     csv_headers = ["id", *metrics_name, "positives_prediction", "negatives_prediction", *parameters_name]
 
     if not(os.path.exists(EVALUATION_CSV_FILE)):
@@ -120,7 +124,13 @@ def evaluate(serialized_model_path, max_examples=None):
     logger.debug(f"Done writting results in {EVALUATION_CSV_FILE}")
 
 
-if __name__ == "__main__":
+def main(arguments: list = None):
+    """
+    Evaluate a serialized model with the parameters given on the command line.
+
+    :param arguments: the arguments of the command line (default: the ones of `sys.argv`)
+    :return:
+    """
     # Parsing sysargv arguments
     parser = argparse.ArgumentParser(description='Evaluate a model using a serialized version of it.')
 
@@ -132,13 +142,22 @@ if __name__ == "__main__":
                         type=int, default=None,
                         help='the number of total examples to use in total')
 
+    parser.add_argument('--voxels_folder', metavar='voxels_folder',
+                        type=str, default=None,
+                        help='a folder of cubes precomputed for the validation examples (see voxelize.py)')
+
     parser.add_argument('--evaluation', metavar='evaluation',
                         type=bool, default=True,
                         help='if true: action on test data from training set')
 
-    args = parser.parse_args()
+    args = parser.parse_args(arguments)
 
     print("Argument parsed : ", args)
 
     evaluate(serialized_model_path=args.model_path,
-             max_examples=args.max_examples)
+             max_examples=args.max_examples,
+             voxels_folder=args.voxels_folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,130 @@
-import os
-from collections import defaultdict
+import copy
+from itertools import groupby
 
 import keras
 import numpy as np
 
+from cube_cache import CubeCache
 from discretization import CubeRepresentation
-from pipeline_fixtures import is_positive, is_negative, load_nparray
-from settings import SHAPE_CUBE
+from molecules_store import load_example, load_pair, load_manifest, load_examples_store, manifest_names
+from settings import VALIDATION_SUBSET_SEED
+from voxelize import Voxels
+
+
+def as_model_input(cubes: np.ndarray):
+    """
+    Cast cubes to the float type of models, once, when they are fed to a model.
+
+    Cubes are made, cached and exchanged between processes with the (compact) type of their representation.
+
+    :param cubes: np.ndarray of cubes
+    :return: the cubes with the float type of Keras (no copy if they already have it)
+    """
+    return cubes.astype(keras.backend.floatx(), copy=False)
+
+
+def stratified_subset(labels: np.ndarray, subset_size: int, seed: int = VALIDATION_SUBSET_SEED):
+    """
+    Select a fixed random subset of examples with the proportion of each label of all the examples.
+
+    The subset only depends on the labels and on `seed`: it doesn't use the random generator of NumPy.
+
+    :param labels: the labels of the examples
+    :param subset_size: the number of examples of the subset
+    :param seed: the seed of the selection
+    :return: the sorted indices of the examples of the subset (each label keeps at least one example)
+    """
+    random_state = np.random.RandomState(seed)
+    subset = []
+    for label in np.unique(labels):
+        indices = np.flatnonzero(labels == label)
+        nb_indices = min(len(indices), max(1, int(round(subset_size * len(indices) / len(labels)))))
+        subset.append(random_state.choice(indices, nb_indices, replace=False))
+
+    return np.sort(np.concatenate(subset))
+
+
+class NegativesSampler:
+    """
+    Select the negatives examples served by an `ExamplesIterator` among all its negatives examples.
+
+    This default sampler keeps the first `nb_neg` negatives examples of each protein.
+
+    """
+
+    # If True, the iterator selects its negatives examples again at the end of each epoch
+    resample_on_epoch_end = False
+
+    def select(self, negatives_pool: dict, nb_neg: int):
+        """
+        :param negatives_pool: the sorted negatives examples of each protein {protein_id: examples}, examples being
+                               rows of the manifest of the folder for an `ExamplesIterator`
+        :param nb_neg: the number of negatives examples to select per protein
+        :return: the list of the selected negatives examples
+        """
+        return [file for files in negatives_pool.values() for file in files[0:nb_neg]]
+
+
+class HardNegativesSampler(NegativesSampler):
+    """
+    Select the negatives examples that are scored the highest by the model: the ones it confuses the most
+    with positive examples.
+
+    Scores are updated with `update_scores` (see `HardNegativeMiningCallback`). Negatives examples
+    that haven't been scored come after the scored ones in their original order: before any scoring,
+    the first `nb_neg` negatives examples of each protein are selected.
+
+    """
+
+    def __init__(self):
+        self._scores = dict()
+
+    def update_scores(self, files: list, scores: np.ndarray):
+        """
+        :param files: the scored negatives examples (as given in the pool of negatives)
+        :param scores: their scores given by the model
+        :return:
+        """
+        self._scores.update(zip(files, map(float, scores)))
+
+    def select(self, negatives_pool: dict, nb_neg: int):
+        selected_files = []
+        for files in negatives_pool.values():
+            selected_files.extend(sorted(files, key=lambda file: -self._scores.get(file, -np.inf))[0:nb_neg])
+
+        return selected_files
+
+
+class RotatingNegativesSampler(NegativesSampler):
+    """
+    Select a fresh subset of `nb_neg` negatives examples per protein at the end of each epoch.
+
+    The negatives examples of each protein are served in a random order, epoch after epoch: they are all
+    seen once every len(negatives) / `nb_neg` epochs, while epochs keep the same length.
+
+    """
+
+    resample_on_epoch_end = True
+
+    def __init__(self):
+        # The negatives examples of each protein still to serve, in a random order
+        self._remaining_files = dict()
+
+    def select(self, negatives_pool: dict, nb_neg: int):
+        selected_files = []
+        for protein_id, files in negatives_pool.items():
+            remaining_files = self._remaining_files.get(protein_id, [])
+
+            # Starting a new random round over the negatives, without repeating the ones still to serve
+            if len(remaining_files) < nb_neg:
+                new_round = [files[index] for index in np.random.permutation(len(files))]
+                still_to_serve = set(remaining_files)
+                remaining_files = remaining_files + [file for file in new_round if file not in still_to_serve]
+
+            selected_files.extend(remaining_files[0:nb_neg])
+            self._remaining_files[protein_id] = remaining_files[nb_neg:]
+
+        return selected_files
 
 
 class ExamplesIterator(keras.utils.Sequence):
@@ -19,9 +137,20 @@ class ExamplesIterator(keras.utils.Sequence):
 
     We can control the amount of negative examples we can train the network on to
     make sure our network gets trained accordingly to a good distribution : need to be tweak though.
+    The negatives examples used are selected among all the available ones by a `NegativesSampler`.
 
     We can choose to shuffle after each epoch or not too.
 
+    Examples are read from the manifest of the folder (see `load_manifest`) and kept as rows of it, batches
+    included: examples are loaded from the ids of their protein and ligand, and their names are only made
+    for reporting (see `get_files`).
+
+    If the examples folder contains virtual examples (see `create_examples`), systems are
+    assembled in memory from the store of molecules when loading batches.
+
+    Cubes can be kept in a `CubeCache` so that they are made only once over the epochs,
+    or read from cubes precomputed for the whole folder (see `voxelize`).
+
     """
 
     def __init__(self,
@@ -30,7 +159,11 @@ class ExamplesIterator(keras.utils.Sequence):
                  batch_size: int = 32,
                  nb_neg: int = None,
                  shuffle_after_completion: bool = True,
-                 max_examples: int = None):
+                 max_examples: int = None,
+                 negatives_sampler: NegativesSampler = None,
+                 cube_cache: CubeCache = None,
+                 voxels_folder: str = None,
+                 subset_size: int = None):
         """
 
         :param examples_folder: the folder containing the examples
@@ -38,18 +171,39 @@ class ExamplesIterator(keras.utils.Sequence):
         :param nb_neg: the number of positive example (this controls the number of examples
         :param shuffle_after_completion: to shuffle the data or not after each epoch
         :param max_examples: if specified, just use the number of examples given
+        :param negatives_sampler: to select the negatives examples used (default: the first `nb_neg` ones per protein)
+        :param cube_cache: a cache of cubes to use (optional)
+        :param voxels_folder: a folder of cubes precomputed with `representation` for the examples (optional)
+        :param subset_size: if specified, use a fixed stratified subset of this number of examples
+                            (see `stratified_subset`), as to validate quickly at each epoch
         """
 
         self._representation = representation
         self._batch_size = batch_size
         self._examples_folder = examples_folder
         self._shuffle_after_completion = shuffle_after_completion
+        self._max_examples = max_examples
+        self._subset_size = subset_size
+        self._negatives_sampler = NegativesSampler() if negatives_sampler is None else negatives_sampler
+        self._cube_cache = cube_cache
+
+        # Examples are the rows of the manifest of the folder: names are only made for reporting
+        self._manifest = load_manifest(examples_folder)
+        self._molecules_store = load_examples_store(examples_folder)
 
-        all_files = sorted(os.listdir(examples_folder))
-        pos_files = list(filter(is_positive, all_files))
-        neg_files = list(filter(is_negative, all_files))
+        # Cubes precomputed for all the examples (see `voxelize`)
+        self._voxels = None
+        if voxels_folder is not None:
+            self._voxels = Voxels(voxels_folder)
+            if self._voxels.get_parameters() != representation.get_parameters():
+                raise ValueError(f"The voxels of {voxels_folder} have been made with another representation: "
+                                 f"{self._voxels.get_parameters()}")
 
-        nb_neg_files_per_pos_file = int(len(neg_files) / len(pos_files))
+        is_positive_row = self._manifest["label"] == 1
+        pos_rows = np.flatnonzero(is_positive_row)
+        neg_rows = np.flatnonzero(~is_positive_row)
+
+        nb_neg_files_per_pos_file = int(len(neg_rows) / len(pos_rows))
 
         if nb_neg is None:
             nb_neg = nb_neg_files_per_pos_file
@@ -59,28 +213,90 @@ class ExamplesIterator(keras.utils.Sequence):
                   f" than the current ones available : (={nb_neg_files_per_pos_file})")
             nb_neg = nb_neg_files_per_pos_file
 
-        # Doing some selection over files to ensure that we take the first nb_neg
-        # negatives examples for a protein
-        grouped_files = defaultdict(list)
-        for neg_file in neg_files:
-            protein_id = int(neg_file.split("_")[0])
-            if len(grouped_files[protein_id]) < nb_neg:
-                grouped_files[protein_id].append(neg_file)
+        self._nb_neg = nb_neg
+        self._pos_rows = pos_rows
+
+        # Grouping negatives examples per protein: the sampler takes nb_neg of them for each protein
+        # The manifest is sorted by protein: the negatives examples of a protein are consecutive rows
+        proteins, first_indices = np.unique(self._manifest["protein"][neg_rows], return_index=True)
+        self._negatives_pool = dict(zip(proteins.tolist(), np.split(neg_rows, first_indices[1:])))
 
-        filtered_neg_files = sorted([file for group in grouped_files.values() for file in group])
+        self.resample_negatives()
 
-        self._examples_files = pos_files + filtered_neg_files
-        self._labels = np.array([1] * len(pos_files) + [0] * len(filtered_neg_files))
+    def resample_negatives(self):
+        """
+        Select the negatives examples to use with the sampler and reset the examples accordingly.
+
+        :return:
+        """
+        filtered_neg_rows = np.sort(np.array(self._negatives_sampler.select(self._negatives_pool, self._nb_neg),
+                                             dtype=np.int64))
+
+        self._examples_rows = np.concatenate((self._pos_rows, filtered_neg_rows))
+        self._labels = self._manifest["label"][self._examples_rows].astype(np.int64)
 
-        assert len(self._labels) == len(self._examples_files)
-        self._indexes = np.arange(len(self._examples_files))
+        if self._subset_size is not None and self._subset_size < len(self._examples_rows):
+            subset = stratified_subset(self._labels, self._subset_size)
+            self._examples_rows = self._examples_rows[subset]
+            self._labels = self._labels[subset]
+
+        assert len(self._labels) == len(self._examples_rows)
+        self._indexes = np.arange(len(self._examples_rows))
 
         # We shuffle the data at least once
         self._shuffle()
 
         # Taking you some examples if asked
-        if isinstance(max_examples, int) and max_examples < len(self._examples_files):
-            self._indexes = self._indexes[0:max_examples]
+        if isinstance(self._max_examples, int) and self._max_examples < len(self._examples_rows):
+            self._indexes = self._indexes[0:self._max_examples]
+
+    def get_state(self):
+        """
+        Return the state of the iteration, to resume it later (see `set_state`).
+
+        :return: the examples used and their order, the state of the sampler of negatives examples and
+                 the state of the random generator of NumPy (used to shuffle and to sample examples)
+        """
+        return dict(examples_rows=self._examples_rows.copy(),
+                    labels=self._labels.copy(),
+                    indexes=self._indexes.copy(),
+                    negatives_sampler_state=copy.deepcopy(vars(self._negatives_sampler)),
+                    random_state=np.random.get_state())
+
+    def set_state(self, state: dict):
+        """
+        Resume an iteration from its state (see `get_state`).
+
+        The sampler of negatives examples is updated in place: objects sharing it (as `HardNegativeMiningCallback`)
+        see the state resumed.
+
+        :param state: the state of an iterator on the same examples
+        :return:
+        """
+        self._examples_rows = state["examples_rows"]
+        self._labels = state["labels"]
+        self._indexes = state["indexes"]
+        vars(self._negatives_sampler).update(state["negatives_sampler_state"])
+        np.random.set_state(state["random_state"])
+
+    def get_negatives_pool(self):
+        """
+        :return: the negatives examples available, per protein {protein_id: np.ndarray of rows of the manifest}
+        """
+        return self._negatives_pool
+
+    def get_manifest(self):
+        """
+        :return: the manifest of the examples of the folder (see `load_manifest`)
+        """
+        return self._manifest
+
+    def get_files(self, rows):
+        """
+        :param rows: rows of the manifest
+        :return: the names of their examples
+        """
+        return manifest_names(self._manifest[rows])
 
     def get_nb_examples(self):
         """
@@ -104,7 +320,7 @@ class ExamplesIterator(keras.utils.Sequence):
         """
         :return:
         """
-        return [self._examples_files[index] for index in self._indexes]
+        return self.get_files(self._examples_rows[self._indexes])
 
     def _shuffle(self):
         """
@@ -128,6 +344,21 @@ class ExamplesIterator(keras.utils.Sequence):
         :param index: a number between 0 and self.__len__() (used to iterate in the data
         :return:
         """
+        # Find list of IDs
+        rows = self.get_batch_rows(index)
+
+        # Generate data
+        cubes, ys = self.__data_generation(rows)
+
+        return cubes, ys
+
+    def get_batch_rows(self, index):
+        """
+        Return the rows of the manifest of the examples of one batch, in the current order.
+
+        :param index: a number between 0 and self.__len__()
+        :return: np.ndarray of the rows of the examples of the batch
+        """
         # Getting batch : the last batch can be smaller,
         # thus some book keeping around the last index
         while index < 0:
@@ -138,13 +369,14 @@ class ExamplesIterator(keras.utils.Sequence):
 
         indexes = self._indexes[first_index:last_index]
 
-        # Find list of IDs
-        files_to_use = [self._examples_files[k] for k in indexes]
-
-        # Generate data
-        cubes, ys = self.__data_generation(files_to_use)
+        return self._examples_rows[indexes]
 
-        return cubes, ys
+    def get_batch_files(self, index):
+        """
+        :param index: a number between 0 and self.__len__()
+        :return: the list of the names of the examples of one batch, in the current order (see `get_batch_rows`)
+        """
+        return self.get_files(self.get_batch_rows(index))
 
     def on_epoch_end(self):
         """
@@ -152,36 +384,206 @@ class ExamplesIterator(keras.utils.Sequence):
 
         :return:
         """
-        if self._shuffle_after_completion:
+        if self._negatives_sampler.resample_on_epoch_end:
+            self.resample_negatives()
+        elif self._shuffle_after_completion:
             np.random.shuffle(self._indexes)
 
-    def __data_generation(self, files_to_use):
+    def generate_batches(self):
         """
-        Return the first nb_examples cubes with their ys.
+        Yield the batches epoch after epoch in the calling thread, for `fit_generator(..., workers=0)`.
 
-        :param files_to_use: the file to extract
-        :return: list of cubes and list of their ys
+        Keras' enqueuers call `on_epoch_end` and build the first batches of the next epoch while the epoch ends,
+        before callbacks: the negatives examples resampled by callbacks (see `HardNegativeMiningCallback`) would
+        only be used for some of the batches of the next epoch. Here, `on_epoch_end` is called when the first batch
+        of the next epoch is requested, hence after the callbacks of the epoch (as in `BatchLoader`).
+
+        :return:
+        """
+        nb_epochs_started = 0
+        while True:
+            if nb_epochs_started > 0:
+                self.on_epoch_end()
+            nb_epochs_started += 1
+
+            for index in range(len(self)):
+                yield self[index]
+
+    def _load_examples(self, examples: np.ndarray):
+        """
+        Load the systems of some examples, from their files or from the store of molecules.
+
+        :param examples: rows of the manifest
+        :return: the list of np.ndarray of shape (nb_atoms, NB_FEATURES)
+        """
+        return [load_example(self._examples_folder, protein, ligand, self._molecules_store)
+                for protein, ligand in zip(examples["protein"].tolist(), examples["ligand"].tolist())]
+
+    def _make_cubes(self, examples: np.ndarray, out: np.ndarray = None):
+        """
+        Make the cubes of some examples at once.
+
+        If the representation can make the cubes of the ligands of a protein at once (`make_pair_cubes`), examples
+        are grouped by protein, identified by the examples folder and its id: the grid or the KD-tree of each protein
+        is made once and kept across batches. Otherwise, the systems of the examples are given to `make_cubes`.
+
+        :param examples: rows of the manifest
+        :param out: a np.ndarray of the type of the representation to write the cubes in (optional)
+        :return: np.ndarray of cubes of the type of the representation with the first axis used for examples
         """
+        if not hasattr(self._representation, "make_pair_cubes"):
+            return self._representation.make_cubes(self._load_examples(examples), out=out)
+
+        if out is None:
+            out = np.empty((len(examples),) + self.get_cube_shape(), dtype=self.get_cube_dtype())
+
+        # Batches are shuffled: the examples of a protein are made consecutive, and their cubes put back in place
+        order = np.argsort(examples["protein"], kind="mergesort")
+        pairs_ids = list(zip(examples["protein"][order].tolist(), examples["ligand"][order].tolist()))
+        cubes = np.empty_like(out)
+
+        first_cube = 0
+        for protein, protein_pairs_ids in groupby(pairs_ids, key=lambda pair_ids: pair_ids[0]):
+            pairs = [load_pair(self._examples_folder, protein, ligand, self._molecules_store)
+                     for _, ligand in protein_pairs_ids]
+            self._representation.make_pair_cubes((self._examples_folder, protein), pairs[0][0],
+                                                 [ligand for _, ligand in pairs],
+                                                 out=cubes[first_cube:first_cube + len(pairs)])
+            first_cube += len(pairs)
+
+        out[order] = cubes
+        return out
+
+    def get_cubes(self, rows, out: np.ndarray = None):
+        """
+        Return the cubes of some examples, made at once (see `_make_cubes`).
+
+        :param rows: the rows of the manifest of the examples
+        :param out: a np.ndarray of the type of the representation to write the cubes in (optional)
+        :return: np.ndarray of cubes of the type of the representation with the first axis used for examples
+        """
+        examples = self._manifest[rows]
+
+        if self._voxels is not None:
+            cubes = self._voxels.get_cubes(examples["protein"], examples["ligand"])
+            if out is None:
+                return cubes
+            out[...] = cubes
+            return out
+
+        if self._cube_cache is None:
+            return self._make_cubes(examples, out=out)
+
+        # Only the cubes missing in the cache are made
+        keys = [CubeCache.make_key(self._examples_folder, ex_file, self._representation)
+                for ex_file in manifest_names(examples)]
+        cubes = [self._cube_cache.get(key) for key in keys]
+        missing = [index for index, cube in enumerate(cubes) if cube is None]
+
+        made_cubes = self._make_cubes(examples[missing])
+        for index, cube in zip(missing, made_cubes):
+            cubes[index] = cube.copy()
+            self._cube_cache.put(keys[index], cubes[index])
+
+        if out is None:
+            return np.array(cubes, dtype=self._representation.get_cube_dtype())
+        out[...] = cubes
+        return out
+
+    def get_cube_shape(self):
+        """
+        :return: the shape of the cubes of the examples
+        """
+        return self._representation.get_cube_shape()
+
+    def get_cube_dtype(self):
+        """
+        :return: the type of the values of the cubes of the examples
+        """
+        return self._representation.get_cube_dtype()
+
+    def get_cube_cache(self):
+        """
+        :return: the cache of cubes used, None if there is none
+        """
+        return self._cube_cache
 
-        cubes = []
-        ys = []
-        for index, ex_file in enumerate(files_to_use):
-            file_name = os.path.join(self._examples_folder, ex_file)
-            example = load_nparray(file_name)
+    def get_ys(self, rows):
+        """
+        :param rows: the rows of the manifest of the examples
+        :return: np.ndarray of their labels
+        """
+        return self._manifest["label"][rows].astype(np.int64)
 
-            cube = self._representation.make_cube(example)
-            y = 1 * is_positive(ex_file)
+    def __data_generation(self, rows):
+        """
+        Return the first nb_examples cubes with their ys.
 
-            cubes.append(cube)
-            ys.append(y)
+        :param rows: the rows of the manifest of the examples
+        :return: list of cubes and list of their ys
+        """
 
         # Conversion to np.ndarrays with the first axes used for examples
-        cubes = np.array(cubes)
-        ys = np.array(ys)
+        cubes = self.get_cubes(rows)
+        ys = self.get_ys(rows)
 
         # Checking consistency here
-        assert (ys.shape[0] == len(files_to_use))
-        assert (cubes.shape[0] == len(files_to_use))
+        assert (ys.shape[0] == len(rows))
+        assert (cubes.shape[0] == len(rows))
         # Dimensions
-        assert (cubes.shape[1:] == SHAPE_CUBE)
-        return cubes, ys
+        assert (cubes.shape[1:] == self.get_cube_shape())
+        return as_model_input(cubes), ys
+
+
+class HardNegativeMiningCallback(keras.callbacks.Callback):
+    """
+    Mine hard negatives examples while training.
+
+    Every `period` epochs, candidates negatives examples are scored by batches with the model being trained.
+    The negatives examples of the next epochs are then the ones with the highest scores (see `HardNegativesSampler`).
+
+    The number of negatives examples per positive example stays the one of the iterator: epochs keep the same length.
+
+    """
+
+    def __init__(self, examples_iterator: ExamplesIterator, sampler: HardNegativesSampler,
+                 nb_candidates: int = None, period: int = 1):
+        """
+        :param examples_iterator: the iterator used for training, using `sampler`
+        :param sampler: the sampler to update with scores
+        :param nb_candidates: the number of random candidates to score per protein (default: all the negatives)
+        :param period: the number of epochs between two minings
+        """
+        super().__init__()
+        self._examples_iterator = examples_iterator
+        self._sampler = sampler
+        self._nb_candidates = nb_candidates
+        self._period = period
+
+    def get_candidates(self):
+        """
+        :return: the rows of the manifest of the negatives examples to score
+        """
+        candidates = []
+        for rows in self._examples_iterator.get_negatives_pool().values():
+            if self._nb_candidates is None or self._nb_candidates >= len(rows):
+                candidates.append(rows)
+            else:
+                candidates.append(rows[np.random.permutation(len(rows))[0:self._nb_candidates]])
+
+        return np.concatenate(candidates) if len(candidates) > 0 else np.empty(0, dtype=np.int64)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self._period != 0:
+            return
+
+        candidates = self.get_candidates()
+        batch_size = self._examples_iterator.get_batch_size()
+
+        scores = []
+        for first_index in range(0, len(candidates), batch_size):
+            cubes = self._examples_iterator.get_cubes(candidates[first_index:first_index + batch_size])
+            scores.append(self.model.predict_on_batch(as_model_input(cubes)).ravel())
+
+        self._sampler.update_scores(candidates, np.concatenate(scores) if len(scores) > 0 else [])
+        self._examples_iterator.resample_negatives()
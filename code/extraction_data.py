@@ -1,10 +1,13 @@
+import argparse
 import os
 import numpy as np
 import logging
 from concurrent import futures
 from random import Random
 
-from settings import HYDROPHOBIC_TYPES, FLOAT_TYPE, FORMATTER, NB_FEATURES, PERCENT_TRAIN, PERCENT_TEST, NB_WORKERS, \
+from molecules_store import write_molecules_store
+from pipeline_fixtures import save_nparray
+from settings import HYDROPHOBIC_TYPES, FLOAT_TYPE, NB_FEATURES, BINARY_FILE_EXTENSION, PERCENT_TRAIN, PERCENT_TEST, NB_WORKERS, \
     EXTRACTED_GIVEN_DATA_TRAIN_FOLDER, EXTRACTED_GIVEN_DATA_VALIDATION_FOLDER, ORIGINAL_GIVEN_DATA_FOLDER, \
     EXTRACTED_GIVEN_DATA_FOLDER, \
     ORIGINAL_PREDICT_DATA_FOLDER, EXTRACTED_PREDICT_DATA_FOLDER, EXTRACTED_GIVEN_DATA_TEST_FOLDER
@@ -13,95 +16,179 @@ logger = logging.getLogger('__main__.extract_data')
 logger.addHandler(logging.NullHandler())
 
 
-def read_pdb(file_name) -> (list, list, list, list):
+def _decode_decimals(fields: np.ndarray) -> np.ndarray:
+    """
+    Decode ASCII decimal numbers stored in a matrix of bytes into floating values.
+
+    Each row of `fields` holds one number (for instance b"  17.186" or b"-28.155"), padded with any
+    non digit characters (spaces, null bytes or carriage returns).
+
+    The integer mantissa and the number of decimals are accumulated column by column for all the rows at once
+    and the value is obtained with a single division: this is exactly the rounding done when parsing the string
+    with `float`.
+
+    :param fields: np.ndarray of uint8 of shape (nb_values, width)
+    :return: np.ndarray of FLOAT_TYPE of shape (nb_values,)
+    """
+    nb_values, width = fields.shape
+    mantissa = np.zeros(nb_values, dtype=np.int64)
+    nb_decimals = np.zeros(nb_values, dtype=np.int64)
+    after_dot = np.zeros(nb_values, dtype=bool)
+    is_negative = np.zeros(nb_values, dtype=bool)
+
+    for column in range(width):
+        characters = fields[:, column]
+        digits = characters - np.uint8(ord("0"))
+        is_digit = digits <= 9
+
+        mantissa[is_digit] = mantissa[is_digit] * 10 + digits[is_digit]
+        nb_decimals += is_digit & after_dot
+        after_dot |= characters == ord(".")
+        is_negative |= characters == ord("-")
+
+    values = mantissa / 10. ** nb_decimals
+    values[is_negative] *= -1
+
+    return values.astype(FLOAT_TYPE)
+
+
+def _gather_fields(buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Gather the bytes buffer[starts[i]:ends[i]] of each field in a matrix, left aligned and padded with null bytes.
+
+    :param buffer: the content of a file as np.ndarray of uint8
+    :param starts: the first position of each field
+    :param ends: the position after the end of each field
+    :return: np.ndarray of uint8 of shape (nb_fields, max_width_of_fields)
+    """
+    width = max(int((ends - starts).max()), 1) if len(starts) > 0 else 1
+    positions = starts[:, None] + np.arange(width)
+
+    # Positions outside of fields point to the null byte appended at the end of the buffer
+    padded_buffer = np.append(buffer, np.uint8(0))
+    positions[positions >= ends[:, None]] = len(buffer)
+    return padded_buffer[positions]
+
+
+def _atom_types_codes(fields: np.ndarray) -> np.ndarray:
+    """
+    Convert a matrix of bytes containing atom types into an array of fixed-width byte strings.
+
+    Leading and trailing whitespaces are removed so that b" C" gives b"C".
+
+    :param fields: np.ndarray of uint8 of shape (nb_atoms, width)
+    :return: np.ndarray of dtype "S<width>" of shape (nb_atoms,)
+    """
+    is_blank = (fields <= ord(" "))
+    nb_leading_blanks = np.where(is_blank.all(axis=1), fields.shape[1], is_blank.argmin(axis=1))
+
+    # Shifting each row on the left to remove leading whitespaces
+    positions = nb_leading_blanks[:, None] + np.arange(fields.shape[1])
+    shifted = fields[np.arange(fields.shape[0])[:, None], np.minimum(positions, fields.shape[1] - 1)]
+    shifted[(positions >= fields.shape[1]) | (shifted <= ord(" "))] = 0
+
+    return np.ascontiguousarray(shifted).view(f"S{fields.shape[1]}").ravel()
+
+
+def read_pdb(file_name) -> (np.ndarray, np.ndarray):
     """
     Read a original pdb file and extract the interested data.
-    The lists contains ordered information about each atom.
+
+    The file is read at once as bytes and the fixed columns are decoded for all the atoms together.
+
     :param file_name: the file to extract data
-    :return: lists of coordinates and atom type for each atom
+    :return: coordinates of each atom as a np.ndarray of shape (nb_atoms, 3) and the atom types codes
     """
-    x_list = list()
-    y_list = list()
-    z_list = list()
-    atom_type_list = list()
+    with open(file_name, 'rb') as file:
+        buffer = np.frombuffer(file.read(), dtype=np.uint8)
+
+    # Extracting the information here
 
-    with open(file_name, 'r') as file:
-        for num_line, strline in enumerate(file.readlines()):
-            # removes all whitespace at the start and end, including spaces, tabs, newlines and carriage returns
-            stripped_line = strline.strip()
+    # First line of 0001_lig_cg.pdb as an example:
+    #
+    # Features     |                                        x       y       z               atom_type
+    # Line in file |ATOM      2  CA  HIS A   0      17.186 -28.155 -12.495  1.00 26.12           C
+    #               ^                             ^       ^       ^       ^                     ^
+    # Position     |0                            30      38      46      54                    76
 
-            # Extracting the information here
+    # Lines boundaries : empty lines are skipped
+    line_ends = np.flatnonzero(buffer == ord("\n"))
+    if len(line_ends) == 0 or line_ends[-1] != len(buffer) - 1:
+        line_ends = np.append(line_ends, len(buffer))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    not_empty = line_ends - line_starts > 0
+    line_starts = line_starts[not_empty]
+    line_ends = line_ends[not_empty]
 
-            # First line of 0001_lig_cg.pdb as an example:
-            #
-            # Features     |                                        x       y       z               atom_type
-            # Line in file |ATOM      2  CA  HIS A   0      17.186 -28.155 -12.495  1.00 26.12           C
-            #               ^                             ^       ^       ^       ^                     ^
-            # Position     |0                            30      38      46      54                    76
+    # The three coordinates are decoded together as 3 * nb_atoms fields of 8 characters
+    fields_starts = np.minimum(line_starts[:, None] + np.array([30, 38, 46]), line_ends[:, None])
+    fields_ends = np.minimum(fields_starts + 8, line_ends[:, None])
+    fields = _gather_fields(buffer, fields_starts.ravel(), fields_ends.ravel())
+    coords = _decode_decimals(fields).reshape(-1, 3)
 
-            x_list.append(FLOAT_TYPE(stripped_line[30:38].strip()))
-            y_list.append(FLOAT_TYPE(stripped_line[38:46].strip()))
-            z_list.append(FLOAT_TYPE(stripped_line[46:54].strip()))
-            atom_type_list.append(stripped_line[76:].strip())
+    atom_types = _atom_types_codes(_gather_fields(buffer, np.minimum(line_starts + 76, line_ends), line_ends))
 
-    assert len(x_list) == len(y_list)
-    assert len(x_list) == len(z_list)
-    assert len(x_list) == len(atom_type_list)
-    return x_list, y_list, z_list, atom_type_list
+    assert coords.shape[0] == atom_types.shape[0]
+    return coords, atom_types
 
 
-def read_pdb_predict(file_name) -> (list, list, list, list):
+def read_pdb_predict(file_name) -> (np.ndarray, np.ndarray):
     """
     Read a original pdb file given for prediction and return the data.
-    The lists contains ordered information about each atom.
+
+    Lines are of the form "x\ty\tz\tatom_type": the file is read at once as bytes and split on whitespaces
+    for all the atoms together.
+
     :param file_name: the file to extract data
-    :return: lists of coordinates and atom type for each atom
+    :return: coordinates of each atom as a np.ndarray of shape (nb_atoms, 3) and the atom types codes
     """
-    with open(file_name, 'r') as file:
-        strline_L = file.readlines()
+    with open(file_name, 'rb') as file:
+        buffer = np.frombuffer(file.read(), dtype=np.uint8)
+
+    # Fields are the runs of non whitespace characters
+    is_blank = np.concatenate(([True], buffer <= ord(" "), [True]))
+    boundaries = np.flatnonzero(is_blank[1:] != is_blank[:-1])
+    fields_starts = boundaries[0::2]
+    fields_ends = boundaries[1::2]
 
-    x_list = list()
-    y_list = list()
-    z_list = list()
-    atom_type_list = list()
-    for strline in strline_L:
-        stripped_line = strline.strip()
+    assert len(fields_starts) % 4 == 0, f"{file_name} should contain 4 fields per line"
+    fields_starts = fields_starts.reshape(-1, 4)
+    fields_ends = fields_ends.reshape(-1, 4)
 
-        splitted_line = stripped_line.split('\t')
+    # The three coordinates are decoded together as 3 * nb_atoms fields
+    fields = _gather_fields(buffer, fields_starts[:, 0:3].ravel(), fields_ends[:, 0:3].ravel())
+    coords = _decode_decimals(fields).reshape(-1, 3)
 
-        x_list.append(FLOAT_TYPE(splitted_line[0]))
-        y_list.append(FLOAT_TYPE(splitted_line[1]))
-        z_list.append(FLOAT_TYPE(splitted_line[2]))
-        atom_type_list.append(str(splitted_line[3]))
+    atom_types = _atom_types_codes(_gather_fields(buffer, fields_starts[:, 3], fields_ends[:, 3]))
 
-    return x_list, y_list, z_list, atom_type_list
+    return coords, atom_types
 
 
-def build_molecule_features(x_list: list, y_list: list, z_list: list, atom_type_list: list,
-                            molecule_is_protein: bool) -> np.array:
+def build_molecule_features(coords: np.ndarray, atom_types: np.ndarray, molecule_is_protein: bool) -> np.array:
     """
     Convert the data extract from file into a np.ndarray.
     The information of one atom is represented as a line in the array.
     See settings.py for values used to represented categorical features (molecule type and atom type)
-    :param x_list: list of x coordinates
-    :param y_list: list of y coordinates
-    :param z_list: list of z coordinates
-    :param atom_type_list: list of atom type (string)
+    :param coords: np.ndarray of shape (nb_atoms, 3) of the coordinates
+    :param atom_types: np.ndarray of atom types (byte strings or strings)
     :param molecule_is_protein: boolean
     :return: np.ndarray of dimension (nb_atoms, 3 + nb_atom_features)
     """
-    nb_atoms = len(x_list)
+    coords = np.asarray(coords, dtype=FLOAT_TYPE).reshape(-1, 3)
+    atom_types = np.asarray(atom_types)
+    nb_atoms = coords.shape[0]
 
     # One hot encoding for atom type and molecule types
-    is_hydrophobic_list = np.array([1. if atom_type in HYDROPHOBIC_TYPES else 0. for atom_type in atom_type_list])
-    is_polar_list = 1. - is_hydrophobic_list
+    hydrophobic_types = np.array(sorted(HYDROPHOBIC_TYPES)).astype(atom_types.dtype.kind)
 
-    is_from_protein_list = (1. * molecule_is_protein) * np.ones((nb_atoms,))
-    is_from_ligand_list = 1. - is_from_protein_list
+    molecule_features = np.zeros((nb_atoms, NB_FEATURES), dtype=FLOAT_TYPE)
 
     # See `FEATURES_NAMES` in settings to see how the features are organized
-    molecule_features = np.array([x_list, y_list, z_list,
-                                  is_hydrophobic_list, is_polar_list, is_from_protein_list, is_from_ligand_list]).T
+    molecule_features[:, 0:3] = coords
+    molecule_features[:, 3] = np.isin(atom_types, hydrophobic_types)
+    molecule_features[:, 4] = 1. - molecule_features[:, 3]
+    molecule_features[:, 5] = 1. * molecule_is_protein
+    molecule_features[:, 6] = 1. - molecule_features[:, 5]
 
     assert (molecule_features.shape == (nb_atoms, NB_FEATURES))
 
@@ -111,37 +198,37 @@ def build_molecule_features(x_list: list, y_list: list, z_list: list, atom_type_
 def save_given_data(pdb_file, group_indices):
     """
     Save the data for a file from the given data set. Data are splited based on ratio and saved into training,
-    validation and testing data folder in csv format.
+    validation and testing data folder in binary format.
 
     :param pdb_file:
     :return:
     """
     pdb_original_file_path = os.path.join(ORIGINAL_GIVEN_DATA_FOLDER, pdb_file)
     # Extract features from pdb files.
-    x_list, y_list, z_list, atom_type_list = read_pdb(pdb_original_file_path)
+    coords, atom_types = read_pdb(pdb_original_file_path)
 
     is_protein = "pro" in pdb_file
 
-    molecule = build_molecule_features(x_list, y_list, z_list, atom_type_list, is_protein)
+    molecule = build_molecule_features(coords, atom_types, is_protein)
 
-    # Saving the data is a csv file with the same name
+    # Saving the data is a binary file with the same name
     # Choosing the appropriate folder using the split index
     molecule_index = pdb_file.split("_")[0]
 
-    pdb_file_csv = pdb_file.replace(".pdb", ".csv")
+    pdb_file_npy = pdb_file.replace(".pdb", BINARY_FILE_EXTENSION)
 
     assert len(group_indices) > 0
     if molecule_index in group_indices[0]:
-        extracted_file_path = os.path.join(EXTRACTED_GIVEN_DATA_TRAIN_FOLDER, pdb_file_csv)
+        extracted_file_path = os.path.join(EXTRACTED_GIVEN_DATA_TRAIN_FOLDER, pdb_file_npy)
     elif molecule_index in group_indices[1]:
-        extracted_file_path = os.path.join(EXTRACTED_GIVEN_DATA_VALIDATION_FOLDER, pdb_file_csv)
+        extracted_file_path = os.path.join(EXTRACTED_GIVEN_DATA_VALIDATION_FOLDER, pdb_file_npy)
     elif molecule_index in group_indices[2]:
-        extracted_file_path = os.path.join(EXTRACTED_GIVEN_DATA_TEST_FOLDER, pdb_file_csv)
+        extracted_file_path = os.path.join(EXTRACTED_GIVEN_DATA_TEST_FOLDER, pdb_file_npy)
     else:
         logger.debug("Not inside indices. Something went wrong")
         raise ()
 
-    np.savetxt(fname=extracted_file_path, X=molecule, fmt=FORMATTER)
+    save_nparray(extracted_file_path, molecule)
 
 
 def save_predict_data(pdb_file):
@@ -154,19 +241,18 @@ def save_predict_data(pdb_file):
     """
     pdb_original_file_path = os.path.join(ORIGINAL_PREDICT_DATA_FOLDER, pdb_file)
     # Extract features from pdb files.
-    x_list, y_list, z_list, atom_type_list = read_pdb_predict(pdb_original_file_path)
+    coords, atom_types = read_pdb_predict(pdb_original_file_path)
 
     is_protein = "pro" in pdb_file
 
-    molecule = build_molecule_features(x_list, y_list, z_list, atom_type_list, is_protein)
+    molecule = build_molecule_features(coords, atom_types, is_protein)
 
-    # Saving the data is a csv file with the same name
-    # Choosing the appropriate folder using the split index
-    pdb_file_csv = pdb_file.replace(".pdb", ".csv")
+    # Saving the data is a binary file with the same name
+    pdb_file_npy = pdb_file.replace(".pdb", BINARY_FILE_EXTENSION)
 
-    extracted_file_path = os.path.join(EXTRACTED_PREDICT_DATA_FOLDER, pdb_file_csv)
+    extracted_file_path = os.path.join(EXTRACTED_PREDICT_DATA_FOLDER, pdb_file_npy)
 
-    np.savetxt(fname=extracted_file_path, X=molecule, fmt=FORMATTER)
+    save_nparray(extracted_file_path, molecule)
 
 
 def extract_predict_data():
@@ -188,7 +274,10 @@ def extract_predict_data():
         for pdb_original_file in original_files:
             executor.submit(save_predict_data, pdb_original_file)
 
-    logger.debug('Molecules saved into folders in csv format.')
+    logger.debug('Molecules saved into folders in binary format.')
+
+    nb_systems = write_molecules_store(EXTRACTED_PREDICT_DATA_FOLDER)
+    logger.debug('Store of %d systems written in %s.', nb_systems, EXTRACTED_PREDICT_DATA_FOLDER)
 
 
 def extract_given_data():
@@ -227,11 +316,29 @@ def extract_given_data():
         for pdb_original_file in original_files:
             executor.submit(save_given_data, pdb_original_file, group_indices)
 
-    logger.debug('Molecules saved into folders in csv format.')
+    logger.debug('Molecules saved into folders in binary format.')
 
+    for folder in [EXTRACTED_GIVEN_DATA_TRAIN_FOLDER, EXTRACTED_GIVEN_DATA_VALIDATION_FOLDER,
+                   EXTRACTED_GIVEN_DATA_TEST_FOLDER]:
+        nb_systems = write_molecules_store(folder)
+        logger.debug('Store of %d systems written in %s.', nb_systems, folder)
+
+
+def main(arguments: list = None):
+    """
+    Extract the given data and the data for prediction.
+
+    :param arguments: the arguments of the command line (default: the ones of `sys.argv`)
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Extract the given data and the data for prediction.')
+    parser.parse_args(arguments)
 
-if __name__ == "__main__":
     print("Extracting the given data")
     extract_given_data()
     print("Extracting the data for prediction")
     extract_predict_data()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,42 @@
+import argparse
+
 import keras
 from keras import Input, Model
+from keras import backend as K
 from keras.layers import Dense, Flatten, Conv3D, Activation, MaxPooling3D, Dropout, BatchNormalization, \
     AveragePooling2D, AveragePooling3D
 from keras.regularizers import l2
 
-from settings import LENGTH_CUBE_SIDE, NB_CHANNELS
+from settings import LENGTH_CUBE_SIDE, NB_CHANNELS, SHAPE_CONTACT_FINGERPRINT
 
 # Configurations of the shape of data
 input_shape = (LENGTH_CUBE_SIDE, LENGTH_CUBE_SIDE, LENGTH_CUBE_SIDE, NB_CHANNELS)
+fingerprint_shape = SHAPE_CONTACT_FINGERPRINT
 data_format = "channels_last"
 
 
-def ProtNet():
+def _fit(x, size):
+    """
+    Fit the size of a kernel or of a pool to the spatial dimensions of a tensor, so that models can be built
+    for cubes with few voxels. Sizes are unchanged for cubes of `LENGTH_CUBE_SIDE` voxels.
+
+    :param x: a tensor of shape (batch, res, res, res, channels)
+    :param size: an int or a tuple of ints
+    :return: the size, limited to the spatial dimension of x
+    """
+    spatial_dimension = K.int_shape(x)[1]
+    if isinstance(size, tuple):
+        return tuple(min(s, spatial_dimension) for s in size)
+
+    return min(size, spatial_dimension)
+
+
+def ProtNet(input_shape: tuple = input_shape):
     """
     Our really first proposition.
 
     A classic 3D Convolutional layers + dense layers architecture
+    :param input_shape: the shape of the cubes given to the model
     :return:
     """
 
@@ -23,13 +44,13 @@ def ProtNet():
     dropout_rate = 0.5
 
     inputs = Input(shape=input_shape)
-    x = Conv3D(kernel_size=(5, 5, 5), activation="relu", filters=64)(inputs)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(inputs, (5, 5, 5)), activation="relu", filters=64)(inputs)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=128)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=128)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=256)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=256)(x)
     x = Flatten()(x)
 
     x = Dense(1000, activation="relu")(x)
@@ -48,10 +69,11 @@ def ProtNet():
     return model
 
 
-def ProtNet07():
+def ProtNet07(input_shape: tuple = input_shape):
     """
     A second version with higher dropout.
 
+    :param input_shape: the shape of the cubes given to the model
     :return:
     """
 
@@ -59,13 +81,13 @@ def ProtNet07():
     dropout_rate = 0.7
 
     inputs = Input(shape=input_shape)
-    x = Conv3D(kernel_size=(5, 5, 5), activation="relu", filters=64)(inputs)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(inputs, (5, 5, 5)), activation="relu", filters=64)(inputs)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=128)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=128)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=256)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=256)(x)
     x = Flatten()(x)
 
     x = Dense(1000, activation="relu")(x)
@@ -84,10 +106,11 @@ def ProtNet07():
     return model
 
 
-def ProtNetBN():
+def ProtNetBN(input_shape: tuple = input_shape):
     """
     A variant with BatchNormalization
 
+    :param input_shape: the shape of the cubes given to the model
     :return:
     """
 
@@ -96,15 +119,15 @@ def ProtNetBN():
     inputs = Input(shape=input_shape)
     x = BatchNormalization()(inputs)
 
-    x = Conv3D(kernel_size=(5, 5, 5), activation="relu", filters=64)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(x, (5, 5, 5)), activation="relu", filters=64)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
     x = BatchNormalization()(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=128)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=128)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
     x = BatchNormalization()(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=256)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=256)(x)
     x = Flatten()(x)
     x = BatchNormalization()(x)
 
@@ -124,10 +147,11 @@ def ProtNetBN():
     return model
 
 
-def SimplerProtNet07():
+def SimplerProtNet07(input_shape: tuple = input_shape):
     """
     A simpler network (bottlenecked at the end) with dropout.
 
+    :param input_shape: the shape of the cubes given to the model
     :return:
     """
 
@@ -135,13 +159,13 @@ def SimplerProtNet07():
     dropout_rate = 0.7
 
     inputs = Input(shape=input_shape)
-    x = Conv3D(kernel_size=(5, 5, 5), activation="relu", filters=64)(inputs)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(inputs, (5, 5, 5)), activation="relu", filters=64)(inputs)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=128)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=128)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=256)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=256)(x)
     x = Flatten()(x)
 
     x = Dense(128, activation="relu")(x)
@@ -160,10 +184,11 @@ def SimplerProtNet07():
     return model
 
 
-def SimplerProtNetBN():
+def SimplerProtNetBN(input_shape: tuple = input_shape):
     """
     A simpler network (bottlenecked at the end) with batchnormalisation.
 
+    :param input_shape: the shape of the cubes given to the model
     :return:
     """
 
@@ -172,15 +197,15 @@ def SimplerProtNetBN():
     inputs = Input(shape=input_shape)
     x = BatchNormalization()(inputs)
 
-    x = Conv3D(kernel_size=(5, 5, 5), activation="relu", filters=64)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(x, (5, 5, 5)), activation="relu", filters=64)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
     x = BatchNormalization()(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=128)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=128)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
     x = BatchNormalization()(x)
 
-    x = Conv3D(kernel_size=(3, 3, 3), activation="relu", filters=256)(x)
+    x = Conv3D(kernel_size=_fit(x, (3, 3, 3)), activation="relu", filters=256)(x)
     x = Flatten()(x)
     x = BatchNormalization()(x)
 
@@ -200,12 +225,13 @@ def SimplerProtNetBN():
     return model
 
 
-def ProtVGGNet():
+def ProtVGGNet(input_shape: tuple = input_shape):
     """
     VGG inspired model : small (3,3) filter and periodic pooling.
 
     Some dropout used.
 
+    :param input_shape: the shape of the cubes given to the model
     :return:
     """
 
@@ -217,19 +243,19 @@ def ProtVGGNet():
 
     x = Conv3D(kernel_size=kernel_size, padding="same", activation="relu", filters=64)(inputs)
     x = Conv3D(kernel_size=kernel_size, padding="same", activation="relu", filters=64)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
     x = Conv3D(kernel_size=kernel_size, padding="same", activation="relu", filters=128)(x)
     x = Conv3D(kernel_size=kernel_size, padding="same", activation="relu", filters=128)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
     x = Conv3D(kernel_size=kernel_size, padding="same", activation="relu", filters=128)(x)
     x = Conv3D(kernel_size=kernel_size, padding="same", activation="relu", filters=128)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
     x = Conv3D(kernel_size=kernel_size, padding="same", activation="relu", filters=256)(x)
     x = Conv3D(kernel_size=kernel_size, padding="same", activation="relu", filters=256)(x)
-    x = MaxPooling3D(pool_size=pool_size)(x)
+    x = MaxPooling3D(pool_size=_fit(x, pool_size))(x)
 
     x = Flatten()(x)
 
@@ -280,12 +306,13 @@ def resnet_layer(inputs,
     return x
 
 
-def ProtResNet():
+def ProtResNet(input_shape: tuple = input_shape):
     """
     ResNet inspired model.
 
     Modified implementation : https://github.com/keras-team/keras/blob/master/examples/cifar10_resnet.py#L116
 
+    :param input_shape: the shape of the cubes given to the model
     :return:
     """
     depth = 22 # can be 20, 32, 44
@@ -321,7 +348,7 @@ def ProtResNet():
             x = Activation('relu')(x)
         num_filters *= 2
 
-    x = AveragePooling3D(pool_size=5)(x)
+    x = AveragePooling3D(pool_size=_fit(x, 5))(x)
     y = Flatten()(x)
     outputs = Dense(1,
                     activation='sigmoid',
@@ -332,11 +359,12 @@ def ProtResNet():
     return model
 
 
-def ProtInceptionNet():
+def ProtInceptionNet(input_shape: tuple = input_shape):
     """
     Inception inspired model.
 
 
+    :param input_shape: the shape of the cubes given to the model
     :return:
     """
     dropout_value = 0.5
@@ -363,7 +391,7 @@ def ProtInceptionNet():
         y = keras.layers.concatenate([sub_mod_1, sub_mod_2, sub_mod_3], axis=4)
 
         # To reduce dimensions:
-        x = MaxPooling3D((3, 3, 3), strides=(2, 2, 2))(y)
+        x = MaxPooling3D(_fit(y, (3, 3, 3)), strides=(2, 2, 2))(y)
 
     x = Flatten()(x)
 
@@ -381,13 +409,108 @@ def ProtInceptionNet():
     return model
 
 
-models_available = [ProtNet(), ProtNet07(), ProtNetBN(),
-                    SimplerProtNet07(), SimplerProtNetBN(),
-                    ProtVGGNet(), ProtResNet(), ProtInceptionNet()]
-models_available_names = list(map(lambda model: model.name, models_available))
+def ContactNet(input_shape: tuple = fingerprint_shape):
+    """
+    A small dense network scoring contact fingerprints instead of cubes
+    (to use with the `contact_fingerprint` representation).
+
+    Counts of contacts are normalized first, as their scale depends on the distance.
+
+    :param input_shape: the shape of the fingerprints given to the model
+    :return:
+    """
+    dropout_rate = 0.3
+
+    inputs = Input(shape=input_shape)
+    x = BatchNormalization()(inputs)
+
+    x = Dense(128, activation="relu")(x)
+    x = Dropout(rate=dropout_rate)(x)
+
+    x = Dense(64, activation="relu")(x)
+    x = Dropout(rate=dropout_rate)(x)
+
+    outputs = Dense(1, activation="sigmoid")(x)
+
+    model = Model(inputs=inputs, outputs=outputs, name="ContactNet")
+    return model
+
+
+# Functions building the models for a shape of cubes (or of fingerprints for ContactNet), in the order of their
+# indices. Models are only built when requested (see `get_model`): their names are the ones of their functions.
+models_builders = [ProtNet, ProtNet07, ProtNetBN,
+                   SimplerProtNet07, SimplerProtNetBN,
+                   ProtVGGNet, ProtResNet, ProtInceptionNet,
+                   ContactNet]
+models_available_names = [build_model.__name__ for build_model in models_builders]
+
+MODELS = dict(zip(models_available_names, models_builders))
+
+
+def _get_model_builder(model):
+    """
+    :param model: the index of the model in `models_builders` or its name (see `models_available_names`)
+    :return: the function building the model
+    """
+    if isinstance(model, str):
+        if model not in MODELS:
+            raise ValueError(f"Unknown model {model}: choose one of {models_available_names}")
+        return MODELS[model]
+
+    if model not in range(len(models_builders)):
+        raise ValueError(f"Unknown model #{model}: choose one of {models_available_names}")
+    return models_builders[model]
+
+
+def check_input_shape(model, shape: tuple):
+    """
+    Check that a model can take inputs of a shape: `ContactNet` takes fingerprints, the other models take cubes.
+
+    This is checked before building the model, as a dense model built for cubes would train without complaining.
+
+    :param model: the index of the model in `models_builders` or its name (see `models_available_names`)
+    :param shape: the shape of the inputs made by the representation (see `CubeRepresentation.get_cube_shape`)
+    :raise ValueError: if the model does not take inputs of this shape
+    """
+    build_model = _get_model_builder(model)
+    takes_fingerprints = build_model is ContactNet
+
+    if takes_fingerprints and len(shape) != len(fingerprint_shape):
+        raise ValueError(f"The model {build_model.__name__} scores fingerprints, not inputs of shape {shape}: "
+                         f"use it with the contact_fingerprint representation")
+
+    if not takes_fingerprints and len(shape) != len(input_shape):
+        raise ValueError(f"The model {build_model.__name__} scores cubes, not inputs of shape {shape}: "
+                         f"use ContactNet with the contact_fingerprint representation")
+
+
+def get_model(model, input_shape: tuple = None):
+    """
+    Build one of the models available.
+
+    :param model: the index of the model in `models_builders` or its name (see `models_available_names`)
+    :param input_shape: the shape of the cubes given to the model (default: the one of the model)
+    :return: the model built
+    """
+    build_model = _get_model_builder(model)
+
+    return build_model() if input_shape is None else build_model(input_shape=input_shape)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print the summaries of the models available.')
+
+    parser.add_argument('models', metavar='models', type=str, nargs='*', default=models_available_names,
+                        help=f'the names of the models to build {models_available_names} (default: all)')
+
+    args = parser.parse_args()
+
     print(f"{len(models_available_names)} Models availables: \n\n")
-    for i, model in enumerate(models_available):
-        print(f"#{i}: {model.name}")
+    for name in args.models:
+        model = get_model(name)
+        print(f"#{models_available_names.index(name)}: {model.name}")
         model.summary()
+
+        # Only one model is kept in memory at once
+        del model
+        K.clear_session()
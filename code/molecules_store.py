@@ -0,0 +1,439 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from pipeline_fixtures import load_nparray, records_to_molecule, extract_id
+from settings import FLOAT_TYPE, NB_FEATURES, MOLECULES_STORE_ATOMS_FILE_NAME, MOLECULES_STORE_INDEX_FILE_NAME, \
+    EXTRACTED_PROTEIN_SUFFIX, EXTRACTED_LIGAND_SUFFIX, BINARY_FILE_EXTENSION, TEXT_FILE_EXTENSION, \
+    PAIRS_FILE_NAME, SYSTEM_ID_FORMAT, INDICES_FEATURES, MANIFEST_FILE_NAME, MANIFEST_SHARDS_FOLDER_NAME, \
+    MANIFEST_DTYPE
+
+# Kinds of molecules : used as column in the index of the store
+PROTEIN = 0
+LIGAND = 1
+
+SUFFIXES = {PROTEIN: EXTRACTED_PROTEIN_SUFFIX, LIGAND: EXTRACTED_LIGAND_SUFFIX}
+
+
+class MoleculesStore:
+    """
+    A consolidated store of all the molecules of an extracted folder.
+
+    All the atoms of all the molecules are stored contiguously in one memory-mapped table
+    of shape (nb_atoms, NB_FEATURES) of FLOAT_TYPE, the layout of molecules ; an index gives the offset
+    and the number of atoms of the protein and of the ligand of each system.
+
+    Getting a molecule is then done in O(1) without opening any file nor copying its atoms,
+    and the pages of the table are shared in the page cache across all the processes using the store.
+
+    Systems are identified by their integer id (that is 1 for "0001_pro_cg.npy").
+
+    Stores are pickled as their folder: a process receiving a store opens it once (see `get_molecules_store`)
+    instead of copying its atoms.
+
+    """
+
+    def __init__(self, folder: str):
+        """
+        :param folder: the extracted folder where the store has been written (see `write_molecules_store`)
+        """
+        self._folder = folder
+        self._atoms = np.load(os.path.join(folder, MOLECULES_STORE_ATOMS_FILE_NAME), mmap_mode="r")
+        if self._atoms.ndim != 2:
+            raise ValueError(f"The store of {folder} has been written with an older layout: "
+                             f"write it again with `write_molecules_store`")
+
+        index = np.load(os.path.join(folder, MOLECULES_STORE_INDEX_FILE_NAME))
+        self._systems = index["systems"]
+        self._offsets = index["offsets"]
+        self._lengths = index["lengths"]
+
+        self._rows = dict(zip(self._systems.tolist(), range(len(self._systems))))
+
+    def __reduce__(self):
+        return get_molecules_store, (self._folder,)
+
+    @staticmethod
+    def exists(folder: str):
+        """
+        :param folder: an extracted folder
+        :return: True if a store has been written in this folder
+        """
+        return all(os.path.exists(os.path.join(folder, file_name))
+                   for file_name in [MOLECULES_STORE_ATOMS_FILE_NAME, MOLECULES_STORE_INDEX_FILE_NAME])
+
+    def get_systems(self):
+        """
+        :return: the sorted ids of systems present in the store
+        """
+        return self._systems
+
+    def __len__(self):
+        """
+        :return: the number of systems in the store
+        """
+        return len(self._systems)
+
+    def __contains__(self, system):
+        return int(system) in self._rows
+
+    def get_nb_atoms(self, system, kind: int):
+        """
+        :param system: the id of the system
+        :param kind: PROTEIN or LIGAND
+        :return: the number of atoms of the molecule
+        """
+        return int(self._lengths[self._rows[int(system)], kind])
+
+    def get_nb_atoms_of_systems(self, systems: np.ndarray, kind: int):
+        """
+        :param systems: the ids of systems
+        :param kind: PROTEIN or LIGAND
+        :return: np.ndarray of the numbers of atoms of their molecules
+        """
+        return self._lengths[np.searchsorted(self._systems, systems), kind]
+
+    def get_nb_bytes_per_atom(self):
+        """
+        :return: the number of bytes of an atom in the table of atoms
+        """
+        return self._atoms.itemsize * NB_FEATURES
+
+    def get_molecule(self, system, kind: int):
+        """
+        Return a zero-copy (read-only) view of a molecule in the table of atoms.
+
+        :param system: the id of the system
+        :param kind: PROTEIN or LIGAND
+        :return: np.ndarray of shape (nb_atoms, NB_FEATURES)
+        """
+        row = self._rows[int(system)]
+        offset = self._offsets[row, kind]
+        return self._atoms[offset:offset + self._lengths[row, kind]]
+
+    def get_protein(self, system):
+        return self.get_molecule(system, PROTEIN)
+
+    def get_ligand(self, system):
+        return self.get_molecule(system, LIGAND)
+
+    def get_system(self, protein, ligand):
+        """
+        Assemble the system of a protein and a ligand as it would be saved in an example file.
+
+        :param protein: the id of the system of the protein
+        :param ligand: the id of the system of the ligand
+        :return: np.ndarray of shape (nb_atoms_protein + nb_atoms_ligand, NB_FEATURES)
+        """
+        return np.concatenate((self.get_protein(protein), self.get_ligand(ligand)), axis=0)
+
+
+@lru_cache(maxsize=16)
+def _open_molecules_store(folder: str, version: tuple):
+    """
+    :param folder: an extracted folder
+    :param version: the times of modification of the files of its store
+    :return: the `MoleculesStore` of this folder
+    """
+    return MoleculesStore(folder)
+
+
+def get_molecules_store(folder: str):
+    """
+    Open the store of a folder once per process, and again when it has been written since.
+
+    :param folder: an extracted folder
+    :return: the `MoleculesStore` of this folder
+    """
+    version = tuple(os.stat(os.path.join(folder, file_name)).st_mtime_ns
+                    for file_name in [MOLECULES_STORE_ATOMS_FILE_NAME, MOLECULES_STORE_INDEX_FILE_NAME])
+
+    return _open_molecules_store(os.path.abspath(folder), version)
+
+
+def list_molecules_files(folder: str):
+    """
+    List the files of molecules present in an extracted folder, in the binary or the text format.
+
+    :param folder: an extracted folder
+    :return: a dictionary of the form {system_id : {kind: file_name}} where system_id is a string ("0001")
+    """
+    molecules_files = dict()
+    for file in sorted(os.listdir(folder)):
+        for kind, suffix in SUFFIXES.items():
+            suffix_root = os.path.splitext(suffix)[0]
+            if any(file.endswith(suffix_root + extension) for extension in [BINARY_FILE_EXTENSION,
+                                                                            TEXT_FILE_EXTENSION]):
+                molecules_files.setdefault(extract_id(file), dict())[kind] = file
+
+    return molecules_files
+
+
+def write_molecules_store(folder: str):
+    """
+    Consolidate all the molecules of an extracted folder in one store.
+
+    The table of atoms is preallocated as a memory-mapped file and filled molecule per molecule.
+
+    :param folder: an extracted folder
+    :return: the number of systems in the store
+    """
+    molecules_files = list_molecules_files(folder)
+    systems_names = sorted(molecules_files.keys(), key=int)
+    systems = np.array(list(map(int, systems_names)), dtype=np.int32)
+
+    # First pass to get the size of each molecule
+    lengths = np.zeros((len(systems), 2), dtype=np.int64)
+    for row, system in enumerate(systems_names):
+        for kind, file in molecules_files[system].items():
+            file_name = os.path.join(folder, file)
+            if file.endswith(BINARY_FILE_EXTENSION):
+                lengths[row, kind] = np.load(file_name, mmap_mode="r").shape[0]
+            else:
+                lengths[row, kind] = load_nparray(file_name).shape[0]
+
+    offsets = np.cumsum(lengths.ravel()).reshape(lengths.shape) - lengths
+
+    # Second pass to fill the table, with the layout of molecules so that they are read without conversion
+    atoms = np.lib.format.open_memmap(os.path.join(folder, MOLECULES_STORE_ATOMS_FILE_NAME), mode="w+",
+                                      dtype=FLOAT_TYPE, shape=(int(lengths.sum()), NB_FEATURES))
+    for row, system in enumerate(systems_names):
+        for kind, file in molecules_files[system].items():
+            file_name = os.path.join(folder, file)
+            if file.endswith(BINARY_FILE_EXTENSION):
+                molecule = records_to_molecule(np.load(file_name))
+            else:
+                molecule = load_nparray(file_name)
+            atoms[offsets[row, kind]:offsets[row, kind] + lengths[row, kind]] = molecule
+
+    atoms.flush()
+    del atoms
+
+    np.savez(os.path.join(folder, MOLECULES_STORE_INDEX_FILE_NAME), systems=systems, offsets=offsets,
+             lengths=lengths)
+
+    # A store previously opened for this folder is now stale
+    _open_molecules_store.cache_clear()
+
+    return len(systems)
+
+
+def list_systems(folder: str):
+    """
+    List the ids of systems present in an extracted folder.
+
+    :param folder: an extracted folder
+    :return: the set of ids as strings (for instance "0001")
+    """
+    return set(list_molecules_files(folder).keys())
+
+
+def load_molecule(folder: str, system: str, kind: int):
+    """
+    Load a molecule of an extracted folder, using its store if it exists and its file otherwise.
+
+    :param folder: an extracted folder
+    :param system: the id of the system (for instance "0001")
+    :param kind: PROTEIN or LIGAND
+    :return: np.ndarray of shape (nb_atoms, NB_FEATURES)
+    """
+    if MoleculesStore.exists(folder):
+        store = get_molecules_store(folder)
+        if system in store:
+            return store.get_molecule(system, kind)
+
+    return load_nparray(os.path.join(folder, system + SUFFIXES[kind]))
+
+
+def has_pairs(examples_folder: str):
+    """
+    :param examples_folder: a folder of examples
+    :return: True if the examples of this folder are virtual (see `save_pairs`)
+    """
+    return os.path.exists(os.path.join(examples_folder, PAIRS_FILE_NAME))
+
+
+def save_pairs(examples_folder: str, pairs: np.ndarray, molecules_folder: str):
+    """
+    Save virtual examples: pairs of (protein, ligand, label) referencing systems in the store of `molecules_folder`.
+
+    The path of `molecules_folder` is saved relatively to `examples_folder`.
+
+    :param examples_folder: the folder of examples
+    :param pairs: np.ndarray of `PAIRS_DTYPE`
+    :param molecules_folder: the extracted folder holding the store of molecules
+    :return:
+    """
+    np.savez(os.path.join(examples_folder, PAIRS_FILE_NAME), pairs=pairs,
+             molecules_folder=np.array(os.path.relpath(molecules_folder, examples_folder)))
+
+
+def load_pairs(examples_folder: str):
+    """
+    Load virtual examples saved with `save_pairs`.
+
+    :param examples_folder: the folder of examples
+    :return: the pairs as np.ndarray of `PAIRS_DTYPE` and the store of molecules they reference
+    """
+    content = np.load(os.path.join(examples_folder, PAIRS_FILE_NAME))
+    molecules_folder = os.path.normpath(os.path.join(examples_folder, str(content["molecules_folder"])))
+    return content["pairs"], get_molecules_store(molecules_folder)
+
+
+def pair_name(protein, ligand):
+    """
+    Return the name of the example file of a pair: "xxxx_yyyy.csv".
+
+    :param protein: the id of the system of the protein
+    :param ligand: the id of the system of the ligand
+    :return:
+    """
+    return SYSTEM_ID_FORMAT.format(int(protein)) + "_" + SYSTEM_ID_FORMAT.format(int(ligand)) + TEXT_FILE_EXTENSION
+
+
+def make_manifest(proteins, ligands, nb_protein_atoms, nb_ligand_atoms, nb_bytes):
+    """
+    Make the manifest of some examples.
+
+    :param proteins: the ids of the systems of the proteins
+    :param ligands: the ids of the systems of the ligands
+    :param nb_protein_atoms: the numbers of atoms of the proteins
+    :param nb_ligand_atoms: the numbers of atoms of the ligands
+    :param nb_bytes: the sizes in bytes of the examples
+    :return: np.ndarray of `MANIFEST_DTYPE` sorted by protein and ligand
+    """
+    manifest = np.empty(len(proteins), dtype=MANIFEST_DTYPE)
+    manifest["protein"] = proteins
+    manifest["ligand"] = ligands
+    manifest["label"] = manifest["protein"] == manifest["ligand"]
+    manifest["nb_protein_atoms"] = nb_protein_atoms
+    manifest["nb_ligand_atoms"] = nb_ligand_atoms
+    manifest["nb_bytes"] = nb_bytes
+
+    return manifest[np.lexsort((manifest["ligand"], manifest["protein"]))]
+
+
+def make_pairs_manifest(pairs: np.ndarray, molecules_store: MoleculesStore):
+    """
+    Make the manifest of virtual examples: their size is the one of their records in the store of molecules.
+
+    :param pairs: np.ndarray of `PAIRS_DTYPE`
+    :param molecules_store: the store of molecules they reference
+    :return: np.ndarray of `MANIFEST_DTYPE`
+    """
+    nb_protein_atoms = molecules_store.get_nb_atoms_of_systems(pairs["protein"], PROTEIN)
+    nb_ligand_atoms = molecules_store.get_nb_atoms_of_systems(pairs["ligand"], LIGAND)
+
+    return make_manifest(pairs["protein"], pairs["ligand"], nb_protein_atoms, nb_ligand_atoms,
+                         (nb_protein_atoms + nb_ligand_atoms) * molecules_store.get_nb_bytes_per_atom())
+
+
+def save_manifest(examples_folder: str, manifest: np.ndarray, shard_index: int = 0, nb_shards: int = 1):
+    """
+    Save the manifest of a folder of examples, or of one of its shards (see `create_examples`).
+
+    :param examples_folder: the folder of examples
+    :param manifest: np.ndarray of `MANIFEST_DTYPE`
+    :param shard_index: the index of the shard of the examples of the manifest
+    :param nb_shards: the number of shards of the folder
+    :return:
+    """
+    if nb_shards == 1:
+        np.save(os.path.join(examples_folder, MANIFEST_FILE_NAME), manifest)
+        return
+
+    shards_folder = os.path.join(examples_folder, MANIFEST_SHARDS_FOLDER_NAME)
+    os.makedirs(shards_folder, exist_ok=True)
+    np.save(os.path.join(shards_folder, f"{shard_index}_{nb_shards}{BINARY_FILE_EXTENSION}"), manifest)
+
+
+def load_manifest(examples_folder: str):
+    """
+    Load the manifest of a folder of examples.
+
+    The manifests of shards are merged. For folders created without a manifest, it is made from
+    the pairs of virtual examples or from the names of files: the sizes of examples are then unknown (-1).
+
+    :param examples_folder: the folder of examples
+    :return: np.ndarray of `MANIFEST_DTYPE` sorted by protein and ligand
+    """
+    manifest_file = os.path.join(examples_folder, MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_file):
+        return np.load(manifest_file)
+
+    shards_folder = os.path.join(examples_folder, MANIFEST_SHARDS_FOLDER_NAME)
+    if os.path.isdir(shards_folder):
+        manifest = np.concatenate([np.load(os.path.join(shards_folder, file))
+                                   for file in sorted(os.listdir(shards_folder))])
+        return manifest[np.lexsort((manifest["ligand"], manifest["protein"]))]
+
+    if has_pairs(examples_folder):
+        return make_pairs_manifest(*load_pairs(examples_folder))
+
+    files = [file for file in os.listdir(examples_folder) if file.endswith(TEXT_FILE_EXTENSION)]
+    systems = np.array([file[:-len(TEXT_FILE_EXTENSION)].split("_") for file in files], dtype=np.int32)
+
+    return make_manifest(systems[:, 0], systems[:, 1], -1, -1, -1) if len(files) > 0 else \
+        np.empty(0, dtype=MANIFEST_DTYPE)
+
+
+def manifest_names(manifest: np.ndarray):
+    """
+    :param manifest: np.ndarray of `MANIFEST_DTYPE`
+    :return: the names of its examples: "xxxx_yyyy.csv"
+    """
+    return list(map(pair_name, manifest["protein"], manifest["ligand"]))
+
+
+def load_examples_store(examples_folder: str):
+    """
+    :param examples_folder: the folder of examples
+    :return: the store of molecules of its examples if they are virtual, None otherwise
+    """
+    return load_pairs(examples_folder)[1] if has_pairs(examples_folder) else None
+
+
+def list_examples(examples_folder: str):
+    """
+    List the examples of a folder, materialized in files or virtual, using its manifest.
+
+    :param examples_folder: the folder containing the examples
+    :return: the manifest of the examples, sorted by protein and ligand (see `load_manifest`), and the store
+             of molecules of virtual examples (None otherwise)
+    """
+    return load_manifest(examples_folder), load_examples_store(examples_folder)
+
+
+def load_example(examples_folder: str, protein, ligand, molecules_store: MoleculesStore = None):
+    """
+    Load the system of an example, from its file or from the store of molecules.
+
+    :param examples_folder: the folder containing the examples
+    :param protein: the id of the system of the protein of the example
+    :param ligand: the id of the system of the ligand of the example
+    :param molecules_store: the store of molecules of virtual examples (see `list_examples`)
+    :return: np.ndarray of shape (nb_atoms, NB_FEATURES)
+    """
+    if molecules_store is None:
+        return load_nparray(os.path.join(examples_folder, pair_name(protein, ligand)))
+
+    return molecules_store.get_system(protein, ligand)
+
+
+def load_pair(examples_folder: str, protein, ligand, molecules_store: MoleculesStore = None):
+    """
+    Load the protein and the ligand of an example, from its file or from the store of molecules.
+
+    :param examples_folder: the folder containing the examples
+    :param protein: the id of the system of the protein of the example
+    :param ligand: the id of the system of the ligand of the example
+    :param molecules_store: the store of molecules of virtual examples (see `list_examples`)
+    :return: the protein and the ligand as np.ndarray of shape (nb_atoms, NB_FEATURES)
+    """
+    if molecules_store is None:
+        system = load_nparray(os.path.join(examples_folder, pair_name(protein, ligand)))
+        is_from_protein = system[:, INDICES_FEATURES["is_from_protein"]] == 1.
+        return system[is_from_protein], system[~is_from_protein]
+
+    return molecules_store.get_protein(protein), molecules_store.get_ligand(ligand)
@@ -0,0 +1,75 @@
+import numpy as np
+
+# Number of rows of the table of keys computed at once (bounds the memory used)
+NB_ROWS_PER_BLOCK = 512
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """
+    The SplitMix64 mixing function, applied element-wise on an array of uint64.
+
+    It maps integers to well distributed pseudo random integers: consecutive ids give independent values.
+
+    :param values: np.ndarray of uint64
+    :return: np.ndarray of uint64
+    """
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def systems_seeds(seed: int, systems: np.ndarray) -> np.ndarray:
+    """
+    Derive the seed of the stream of each system from the global seed and the id of the system.
+
+    :param seed: the global seed
+    :param systems: the integer ids of systems
+    :return: np.ndarray of uint64 of the same shape as `systems`
+    """
+    systems = np.asarray(systems).astype(np.uint64)
+    return _splitmix64(np.uint64(seed) ^ _splitmix64(systems))
+
+
+def sample_negatives(systems: list, nb_neg: int, seed: int, proteins: list = None) -> np.ndarray:
+    """
+    Sample `nb_neg` negative ligands for each protein among the ligands of all the other systems.
+
+    Each ligand of other systems gets a random key drawn from the stream of the protein: the key only
+    depends on (seed, protein id, ligand id). Negatives of a protein are the `nb_neg` ligands with the
+    smallest keys, ordered by key.
+
+    Hence the table is the same whatever the order of systems or the subset of proteins it is computed for:
+    the sampling can be split among any number of processes or nodes with the exact same results.
+
+    :param systems: the ids of all the systems (for instance ["0001", "0002", ...])
+    :param nb_neg: the number of negatives per protein (at most len(systems) - 1)
+    :param seed: the global seed
+    :param proteins: the ids of the proteins to sample negatives for (default: all the systems)
+    :return: np.ndarray of shape (len(proteins), nb_neg) of indices of ligands in `systems`
+    """
+    proteins = systems if proteins is None else proteins
+    assert 0 <= nb_neg < len(systems) or len(systems) == 0
+
+    ligands_ids = np.array(list(map(int, systems)), dtype=np.uint64)
+    proteins_ids = np.array(list(map(int, proteins)), dtype=np.uint64)
+    mixed_ligands_ids = _splitmix64(ligands_ids)
+
+    negatives = np.empty((len(proteins), nb_neg), dtype=np.int64)
+    for first_row in range(0, len(proteins), NB_ROWS_PER_BLOCK):
+        block_proteins = proteins_ids[first_row:first_row + NB_ROWS_PER_BLOCK]
+        keys = _splitmix64(systems_seeds(seed, block_proteins)[:, None] ^ mixed_ligands_ids[None, :])
+
+        # The ligand of the protein is never a negative
+        keys[block_proteins[:, None] == ligands_ids[None, :]] = np.iinfo(np.uint64).max
+
+        if nb_neg < len(systems) - 1:
+            candidates = np.argpartition(keys, nb_neg, axis=1)[:, :nb_neg]
+        else:
+            candidates = np.tile(np.arange(len(systems)), (len(block_proteins), 1))
+
+        rows = np.arange(len(block_proteins))[:, None]
+        order = np.argsort(keys[rows, candidates], axis=1, kind="mergesort")
+        negatives[first_row:first_row + len(block_proteins)] = candidates[rows, order][:, :nb_neg]
+
+    return negatives
@@ -0,0 +1,45 @@
+import argparse
+import importlib
+import sys
+
+# Stages of the pipeline and their modules : a module is only imported when its stage is run,
+# so that stages working with NumPy only don't import Keras nor scikit-learn
+STAGES = {
+    "extract": "extraction_data",
+    "create-examples": "create_examples",
+    "voxelize": "voxelize",
+    "train": "train_cnn",
+    "sweep": "sweep",
+    "evaluate": "evaluate",
+    "predict": "predict",
+}
+
+
+def run_stage(stage: str, arguments: list = None):
+    """
+    Run a stage of the pipeline as its module would be run on the command line.
+
+    :param stage: the name of the stage (see `STAGES`)
+    :param arguments: the arguments of the command line of the stage
+    :return:
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage {stage}: choose one of {list(STAGES.keys())}")
+
+    importlib.import_module(STAGES[stage]).main(arguments)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a stage of the pipeline.',
+                                     epilog='Use "pipeline.py <stage> --help" for the arguments of a stage.')
+
+    parser.add_argument('stage', metavar='stage', type=str, choices=list(STAGES.keys()),
+                        help=f'the stage to run {list(STAGES.keys())}')
+
+    # The arguments following the stage are the ones of its module
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    sys.argv[0] = f"{sys.argv[0]} {args.stage}"
+    run_stage(args.stage, args.arguments)
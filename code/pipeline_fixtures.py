@@ -1,12 +1,12 @@
 import datetime
 
-import keras
 import numpy as np
 import os
 import progressbar
 from collections import defaultdict
 
-from settings import FLOAT_TYPE, COMMENT_DELIMITER, PARAMETERS_FILE_NAME_SUFFIX
+from settings import FLOAT_TYPE, COMMENT_DELIMITER, PARAMETERS_FILE_NAME_SUFFIX, NB_FEATURES, MOLECULE_DTYPE, \
+    BINARY_FILE_EXTENSION, TEXT_FILE_EXTENSION
 
 widgets_progressbar = [
     ' [', progressbar.Timer(), '] ',
@@ -91,6 +91,20 @@ def extract_id(file_name):
     return file_name.split("_")[0]
 
 
+def parse_duration(duration: str):
+    """
+    Parse a duration given in seconds ("3600") or as a walltime ("hh:mm:ss", "mm:ss").
+
+    :param duration: the duration as a string
+    :return: the number of seconds of the duration
+    """
+    seconds = 0.
+    for field in duration.split(":"):
+        seconds = 60 * seconds + float(field)
+
+    return seconds
+
+
 def get_current_timestamp():
     """
     Return the current timestamp of the current time as a string.
@@ -101,46 +115,74 @@ def get_current_timestamp():
     return f"{local_time_dt}".replace(" ", "_")
 
 
-class LogEpochBatchCallback(keras.callbacks.LambdaCallback):
+def is_binary_file(file_name: str):
     """
-    Callback to log batch and epoch metrics.
+    Check if a file is a binary numpy file (.npy) by reading its magic string.
+
+    :param file_name: the file to check
+    :return: True/False
+    """
+    magic_string = np.lib.format.MAGIC_PREFIX
+    with open(file_name, "rb") as f:
+        return f.read(len(magic_string)) == magic_string
+
 
-    LambdaCallback are basically wrappers of function that get called after each batch or epoch.
+def molecule_to_records(molecule: np.ndarray):
+    """
+    Convert a molecule array of shape (nb_atoms, NB_FEATURES) into records of `MOLECULE_DTYPE`.
 
-    From Keras documentation : https://keras.io/callbacks/
-        > "on_epoch_end: logs include acc and loss, and optionally include val_loss (if validation is enabled in fit)
-        > and val_acc (if validation and accuracy monitoring are enabled).
-        > on_batch_begin: logs include size, the number of samples in the current batch.
-        > on_batch_end: logs include loss, and optionally acc (if accuracy monitoring is enabled)."
+    :param molecule: the molecule with columns (x, y, z, is_hydrophobic, is_polar, is_from_protein, is_from_ligand)
+    :return: np.ndarray of `MOLECULE_DTYPE` of shape (nb_atoms,)
     """
+    records = np.empty(molecule.shape[0], dtype=MOLECULE_DTYPE)
+    records["coords"] = molecule[:, 0:3]
+    records["features"] = molecule[:, 3:]
+    return records
 
-    def _on_batch_begin(self, batch, logs=None):
-        self.logger.debug(f"batch {batch} ; size {logs['size']}")
 
-    def _on_batch_end(self, batch, logs=None):
-        self.logger.debug("loss {:10.4f}".format(logs["loss"]))
+def records_to_molecule(records: np.ndarray):
+    """
+    Convert records of `MOLECULE_DTYPE` into a molecule array of shape (nb_atoms, NB_FEATURES).
 
-    def _on_epoch_begin(self, epoch, logs=None):
-        self.logger.debug(f"starting epoch {epoch}")
+    :param records: np.ndarray of `MOLECULE_DTYPE` of shape (nb_atoms,)
+    :return: np.ndarray of FLOAT_TYPE of shape (nb_atoms, NB_FEATURES)
+    """
+    molecule = np.empty((records.shape[0], NB_FEATURES), dtype=FLOAT_TYPE)
+    molecule[:, 0:3] = records["coords"]
+    molecule[:, 3:] = records["features"]
+    return molecule
 
-    def _on_epoch_end(self, epoch, logs=None):
-        self.logger.debug(f"ending epoch {epoch}" + " ; accuracy  {:.2%} ; loss {:10.4f}".format(logs["acc"],
-                                                                                                 logs["loss"]))
 
-    def __init__(self, logger):
-        self.logger = logger
-        super().__init__(on_epoch_begin=self._on_epoch_begin,
-                         on_epoch_end=self._on_epoch_end,
-                         on_batch_begin=self._on_batch_begin,
-                         on_batch_end=self._on_batch_end)
+def save_nparray(file_name: str, molecule: np.ndarray):
+    """
+    Saves a molecule in the binary format (see `MOLECULE_DTYPE` in settings).
+
+    :param file_name: the file to use (should end with BINARY_FILE_EXTENSION)
+    :param molecule: the molecule with columns (x, y, z, is_hydrophobic, is_polar, is_from_protein, is_from_ligand)
+    :return:
+    """
+    np.save(file_name, molecule_to_records(molecule))
 
 
 def load_nparray(file_name: str):
     """
-    Loads an numpy ndarray stored in given file
+    Loads an numpy ndarray stored in given file.
+
+    Binary files (see `save_nparray`) and text files are supported: the format is detected using the content
+    of the file. If the file does not exist, the same file with the other extension is used if present
+    (so that folders extracted with the text format can still be used).
+
     :param file_name: the file to use
     :return:
     """
+    if not (os.path.exists(file_name)):
+        root, extension = os.path.splitext(file_name)
+        other_extension = TEXT_FILE_EXTENSION if extension == BINARY_FILE_EXTENSION else BINARY_FILE_EXTENSION
+        if os.path.exists(root + other_extension):
+            file_name = root + other_extension
+
+    if is_binary_file(file_name):
+        return records_to_molecule(np.load(file_name))
 
     example = np.loadtxt(file_name, dtype=FLOAT_TYPE, comments=COMMENT_DELIMITER)
     # If it's a vector (i.e if there is just one atom),
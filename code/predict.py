@@ -9,9 +9,10 @@ from collections import defaultdict
 
 from keras.models import load_model
 
-from discretization import AbsoluteCubeRepresentation, RelativeCubeRepresentation
+from discretization import get_job_representation
 from pipeline_fixtures import get_parameters_dict
-from settings import TESTING_EXAMPLES_FOLDER, LENGTH_CUBE_SIDE, DELIMITER
+from examples_iterator import as_model_input
+from settings import TESTING_EXAMPLES_FOLDER, DELIMITER
 from predict_generator import PredictGenerator
 from settings import PREDICT_EXAMPLES_FOLDER, RESULTS_FOLDER
 from train_cnn import f1
@@ -114,18 +115,17 @@ def predict(serialized_model_path, evaluation=True):
 
     parameters = get_parameters_dict(job_folder=job_folder)
 
-    cube_representation = AbsoluteCubeRepresentation(length_cube_side=LENGTH_CUBE_SIDE) \
-        if parameters["representation"] == AbsoluteCubeRepresentation.name \
-        else RelativeCubeRepresentation(length_cube_side=LENGTH_CUBE_SIDE)
+    cube_representation = get_job_representation(parameters)
 
     # Getting predictions
     predictions = defaultdict(list)
 
     predict_examples_generator = PredictGenerator(predict_folder,
                                                   representation=cube_representation)
-    for pro, lig, cube in predict_examples_generator:
-        y_predict = model.predict(cube)
-        predictions[pro].append((y_predict[0][0], lig))
+    for proteins, ligands, cubes in predict_examples_generator:
+        y_predict = model.predict(as_model_input(cubes))
+        for pro, lig, y in zip(proteins, ligands, y_predict):
+            predictions[pro].append((y[0], lig))
 
     # Saving predictions
     with open(predictions_file_name, 'wb') as f:
@@ -146,7 +146,13 @@ def predict(serialized_model_path, evaluation=True):
     logger.debug(f'Success rate for model {id} is : {success_rate}')
 
 
-if __name__ == "__main__":
+def main(arguments: list = None):
+    """
+    Predict with a serialized model with the parameters given on the command line.
+
+    :param arguments: the arguments of the command line (default: the ones of `sys.argv`)
+    :return:
+    """
     # Parsing sysargv arguments
     parser = argparse.ArgumentParser(description='Evaluate a model using a serialized version of it.')
 
@@ -158,7 +164,7 @@ if __name__ == "__main__":
                         type=str, default="True",
                         help='if true: action on test data from training set')
 
-    args = parser.parse_args()
+    args = parser.parse_args(arguments)
 
     evaluation = (args.evaluation == "True")
 
@@ -166,3 +172,7 @@ if __name__ == "__main__":
 
     predict(serialized_model_path=args.model_path,
             evaluation=evaluation)
+
+
+if __name__ == "__main__":
+    main()
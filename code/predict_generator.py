@@ -1,25 +1,53 @@
-import os
-from discretization import RelativeCubeRepresentation, CubeRepresentation
-from pipeline_fixtures import load_nparray
-from settings import LENGTH_CUBE_SIDE
+from itertools import groupby
+
+from discretization import RelativeCubeRepresentation, CubeRepresentation, ProteinAnchoredCubeRepresentation, \
+    PocketCubeRepresentation, ContactFingerprintRepresentation
+from molecules_store import list_examples, load_example, load_pair
+from settings import LENGTH_CUBE_SIDE, BATCH_SIZE_DEFAULT, SYSTEM_ID_FORMAT
 import numpy as np
 
 
 def PredictGenerator(examples_folder,
-                     representation: CubeRepresentation) -> (str, str, np.ndarray):
+                     representation: CubeRepresentation,
+                     batch_size: int = BATCH_SIZE_DEFAULT) -> (list, list, np.ndarray):
     """
-    A Generator that return examples in a specific examples_folder with the id of the protein and of the ligand.
+    A Generator that return batches of examples in a specific examples_folder with the ids of the proteins
+    and of the ligands.
+
+    Virtual examples (see `create_examples`) are assembled from the store of molecules.
+    The cubes of a batch are made at once (see `CubeRepresentation.make_cubes`). With a protein-anchored
+    representation, the grid of each protein is made once for all its ligands (see `make_pair_cubes`); with a pocket
+    representation or contact fingerprints, its KD-tree is.
 
     :param examples_folder: the folder where files are
     :param representation: the representation to use
+    :param batch_size: the number of examples per batch
     :return:
     """
-    examples_files = os.listdir(examples_folder)
-    for file in examples_files:
-        example = load_nparray(os.path.join(examples_folder, file))
-        cube = representation.make_cube(example)
-        cube = np.array([cube])
-        protein = file.split('_')[0]
-        ligand = file.split('_')[1].split('.')[0]
-
-        yield (protein, ligand, cube)
+    manifest, molecules_store = list_examples(examples_folder)
+    by_protein = isinstance(representation, (ProteinAnchoredCubeRepresentation, PocketCubeRepresentation,
+                                             ContactFingerprintRepresentation))
+
+    for first_index in range(0, len(manifest), batch_size):
+        examples = manifest[first_index:first_index + batch_size]
+        pairs_ids = list(zip(examples["protein"].tolist(), examples["ligand"].tolist()))
+
+        if not by_protein:
+            cubes = representation.make_cubes([load_example(examples_folder, protein, ligand, molecules_store)
+                                               for protein, ligand in pairs_ids])
+        else:
+            cubes = np.empty((len(examples),) + representation.get_cube_shape(), dtype=representation.get_cube_dtype())
+            first_cube = 0
+            # Examples are sorted: the ones of a protein are consecutive
+            for protein, protein_pairs_ids in groupby(pairs_ids, key=lambda pair_ids: pair_ids[0]):
+                pairs = [load_pair(examples_folder, protein, ligand, molecules_store)
+                         for _, ligand in protein_pairs_ids]
+                representation.make_pair_cubes((examples_folder, protein), pairs[0][0], [ligand for _, ligand in pairs],
+                                               out=cubes[first_cube:first_cube + len(pairs)])
+                first_cube += len(pairs)
+
+        # The ids are formatted as in the names of systems, for the results
+        proteins = [SYSTEM_ID_FORMAT.format(protein) for protein, _ in pairs_ids]
+        ligands = [SYSTEM_ID_FORMAT.format(ligand) for _, ligand in pairs_ids]
+
+        yield (proteins, ligands, cubes)
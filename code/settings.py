@@ -1,7 +1,8 @@
 import os
 import numpy as np
-from keras.optimizers import Adam
-from sklearn.metrics import f1_score, recall_score, precision_score, accuracy_score, confusion_matrix
+
+# Settings are imported by all the stages of the pipeline (see pipeline.py): Keras and scikit-learn
+# are only imported by the stages using them, the objects they provide are referenced here by name
 
 # FOLDERS
 # Global folder for data and logs
@@ -63,6 +64,22 @@ INDICES_FEATURES = dict(zip(FEATURES_NAMES, list(range(NB_FEATURES))))
 # To scale protein-ligands system in a cube of shape (LENGTH_CUBE_SIDE,LENGTH_CUBE_SIDE,LENGTH_CUBE_SIDE)
 LENGTH_CUBE_SIDE = 20
 DEFAULT_CUBE_RES = 5.0
+# Pocket cubes only hold the atoms around the ligand: their voxels are finer
+POCKET_CUBE_RES_DEFAULT = 1.0
+# Types of the values of cubes : counts of atoms per voxel and feature are saturated with uint8
+CUBE_DTYPES = ["float32", "float16", "uint8"]
+CUBE_DTYPE_DEFAULT = "float32"
+# Densities of atoms (see discretization.py) are Gaussians truncated at this number of standard deviations
+DENSITY_TRUNCATION = 2.0
+# Contact fingerprints (see discretization.py): histograms of the distances between atoms of the protein and
+# of the ligand up to CONTACT_CUTOFF angstroms
+CONTACT_CUTOFF = 10.0
+NB_CONTACT_BINS = 10
+# One histogram per pair of types of atoms (hydrophobic or polar) of the protein and of the ligand
+SHAPE_CONTACT_FINGERPRINT = (4 * NB_CONTACT_BINS,)
+# Number of grids (protein-anchored representation) or KD-trees (pocket representation) of proteins kept in memory
+# (see discretization.py)
+NB_CACHED_PROTEIN_GRIDS_DEFAULT = 512
 SHAPE_CUBE = (LENGTH_CUBE_SIDE, LENGTH_CUBE_SIDE, LENGTH_CUBE_SIDE, NB_CHANNELS)
 
 # PREPROCESSING SETTINGS
@@ -75,12 +92,50 @@ PERCENT_TEST = 0.1
 # Used for creating training examples
 MAX_NB_NEG_PER_POS = 40
 
+# The global seed of the sampling of negative examples (see negative_sampling.py)
+NEGATIVES_SAMPLING_SEED = 1337
+
 # Pre-processing settings
 NB_WORKERS = 6
-EXTRACTED_PROTEIN_SUFFIX = "_pro_cg.csv"
-EXTRACTED_LIGAND_SUFFIX = "_lig_cg.csv"
+# Number of systems handled per task by workers creating examples
+NB_SYSTEMS_PER_TASK = 16
+EXAMPLES_WRITE_BUFFER_SIZE = 1 << 20
 FLOAT_TYPE = np.float32
-FORMATTER = "%.16f"
+
+# Extracted molecules are saved in binary (.npy) files of records holding
+# the coordinates in FLOAT_TYPE and the features flags as uint8
+BINARY_FILE_EXTENSION = ".npy"
+TEXT_FILE_EXTENSION = ".csv"
+MOLECULE_DTYPE = np.dtype([("coords", FLOAT_TYPE, (3,)), ("features", np.uint8, (NB_CHANNELS,))])
+EXTRACTED_PROTEIN_SUFFIX = "_pro_cg" + BINARY_FILE_EXTENSION
+EXTRACTED_LIGAND_SUFFIX = "_lig_cg" + BINARY_FILE_EXTENSION
+
+# Consolidated store of all the molecules of an extracted folder:
+# one memory-mapped table of atoms, with the layout of molecules, and an index of offsets per system
+MOLECULES_STORE_ATOMS_FILE_NAME = "store_atoms.npy"
+MOLECULES_STORE_INDEX_FILE_NAME = "store_index.npz"
+
+# Virtual examples : only the pairs (protein, ligand, label) are saved in the examples folder
+# and systems are assembled from the store of molecules when loading batches
+PAIRS_FILE_NAME = "pairs.npz"
+PAIRS_DTYPE = np.dtype([("protein", np.int32), ("ligand", np.int32), ("label", np.uint8)])
+# Systems ids are integers formatted this way in files names
+SYSTEM_ID_FORMAT = "{:04d}"
+
+# Manifest of a folder of examples (materialized or virtual) : one record per example, sorted by protein and ligand,
+# read instead of listing the folder and parsing the names of files (see molecules_store.py).
+# Shards of examples created on different nodes write their own manifest in MANIFEST_SHARDS_FOLDER_NAME.
+MANIFEST_FILE_NAME = "manifest.npy"
+MANIFEST_SHARDS_FOLDER_NAME = "manifest_shards"
+MANIFEST_DTYPE = np.dtype([("protein", np.int32), ("ligand", np.int32), ("label", np.uint8),
+                           ("nb_protein_atoms", np.int32), ("nb_ligand_atoms", np.int32), ("nb_bytes", np.int64)])
+
+# Voxelized examples : the cubes of all the examples of a folder made once with a representation (see voxelize.py)
+VOXELS_FOLDER_SUFFIX = "_voxels"
+VOXELS_CUBES_FILE_NAME = "cubes.npy"
+VOXELS_INDEX_FILE_NAME = "voxels_index.npz"
+NB_EXAMPLES_PER_VOXELIZATION_TASK = 256
+
 COMMENT_DELIMITER = "#"
 DELIMITER = "\t"
 
@@ -88,6 +143,9 @@ DELIMITER = "\t"
 
 # The environment to use for jobs
 JOBS_ENV = "CS5242_gpu"
+# The time budget of training jobs, under their walltime of 23 hours: they stop and save a checkpoint before it,
+# and resume from it when submitted again
+TRAIN_JOB_TIME_BUDGET = "22:30:00"
 
 # Training settings
 TRAINING_LOGFILE_SUFFIX = f"train_cnn.log"
@@ -99,8 +157,16 @@ SERIALIZED_MODEL_FILE_NAME_SUFFIX = "model.h5"
 HISTORY_FILE_NAME_SUFFIX = "history.pickle"
 NB_EPOCHS_DEFAULT = 15
 BATCH_SIZE_DEFAULT = 32
+# Number of batches that loader workers can build ahead of training (see batch_loader.py)
+PREFETCH_DEPTH_DEFAULT = 8
+# Memory budget in bytes of the in-memory tier of the cache of cubes (see cube_cache.py)
+CUBE_CACHE_RAM_BUDGET_DEFAULT = 2 << 30
+# Version of the way cubes are made, in the keys of the cache of cubes and with voxels: to be incremented when cubes
+# made with the same parameters change, so that the cubes saved in the disk tier or voxelized before aren't used
+# anymore
+CUBE_CACHE_FORMAT_VERSION = 4
 N_GPU_DEFAULT = 1
-OPTIMIZER_DEFAULT = Adam()
+OPTIMIZER_DEFAULT = "adam"
 
 # The number of negative example to use per positive example to train
 NB_NEG_EX_PER_POS = 40
@@ -110,8 +176,38 @@ WEIGHT_POS_CLASS = 1
 LR_DEFAULT = 0.001
 LR_DECAY_DEFAULT =0.0
 
+# Local sweeps of training jobs (see sweep.py): the queue of the jobs of a sweep is saved next to the file of
+# its grid, and the state of jobs is polled every SWEEP_POLL_PERIOD seconds
+SWEEP_QUEUE_FILE_SUFFIX = ".queue.json"
+SWEEP_LOG_FILE_NAME = "sweep.log"
+SWEEP_POLL_PERIOD = 1.0
+SWEEP_NB_THREADS_DEFAULT = 4
+
+# Checkpoints of training saved at the end of each epoch in the job folder (see train_cnn.py)
+CHECKPOINT_MODEL_FILE_NAME = "checkpoint.h5"
+CHECKPOINT_STATE_FILE_NAME = "checkpoint.pickle"
+# Exit code of a training job stopped before the end of its time budget: it can be resumed from its checkpoint
+TIME_BUDGET_EXIT_CODE = 75
+
+# Metrics of epochs that early stopping can monitor (see train_cnn.py): losses are minimized, others maximized
+EARLY_STOPPING_MONITORS = ["val_loss", "val_acc", "val_f1", "loss", "acc", "f1"]
+EARLY_STOPPING_MONITOR_DEFAULT = "val_loss"
+# Seed of the selection of the fixed subset of validation examples validated at each epoch
+VALIDATION_SUBSET_SEED = 1337
+
+# Default values of the options of train_cnn.py changing the model trained, as saved in its file of parameters:
+# jobs of sweeps leaving an option out are matched with models trained with its default value (see sweep.py)
+TRAIN_PARAMETERS_DEFAULTS = dict(model_index=0, nb_epochs=NB_EPOCHS_DEFAULT, batch_size=BATCH_SIZE_DEFAULT,
+                                 optimizer=OPTIMIZER_DEFAULT, lr=LR_DEFAULT, lr_decay=0.0, nb_neg=NB_NEG_EX_PER_POS,
+                                 max_examples=None, weight_pos_class=WEIGHT_POS_CLASS, representation="relative",
+                                 length_cube_side=LENGTH_CUBE_SIDE, cube_resolution=None, density_sigma=None,
+                                 cube_dtype=CUBE_DTYPE_DEFAULT, hard_negatives=False, nb_candidates=None,
+                                 mining_period=1, rotate_negatives=False, monitor=EARLY_STOPPING_MONITOR_DEFAULT,
+                                 patience=None, validation_subset=None, full_validation_period=None)
+
 # Evaluation settings
-METRICS_FOR_EVALUATION = [accuracy_score, precision_score, recall_score, f1_score, confusion_matrix]
+# Names of functions of sklearn.metrics
+METRICS_FOR_EVALUATION = ["accuracy_score", "precision_score", "recall_score", "f1_score", "confusion_matrix"]
 EVALUATION_LOGS_FOLDER = os.path.join(RESULTS_FOLDER, "evaluation")
 EVALUATION_CSV_FILE = os.path.join(EVALUATION_LOGS_FOLDER, "evaluation_results.csv")
 
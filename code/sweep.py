@@ -0,0 +1,401 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+from discretization import get_representation
+from models_inspector import ModelsInspector
+from pipeline_fixtures import get_parameters_dict
+from settings import RESULTS_FOLDER, SWEEP_QUEUE_FILE_SUFFIX, SWEEP_LOG_FILE_NAME, SWEEP_POLL_PERIOD, \
+    SWEEP_NB_THREADS_DEFAULT, TIME_BUDGET_EXIT_CODE, TRAIN_PARAMETERS_DEFAULTS
+
+# States of the jobs of a sweep
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+# Stopped before the end of its time budget: resumed from its checkpoint when the sweep is started again
+INTERRUPTED = "interrupted"
+
+# Options of `train_cnn.py` which only change how a job is run, not the model trained: they are not saved with it
+RUN_OPTIONS = ["nb_loader_workers", "prefetch_depth", "cube_cache", "cube_cache_ram_budget", "cube_cache_folder",
+               "training_voxels_folder", "validation_voxels_folder", "job_folder", "nb_threads", "resume",
+               "time_budget"]
+
+# Jobs run the training script in their own process
+TRAIN_COMMAND = [sys.executable, os.path.join(os.path.dirname(os.path.realpath(__file__)), "train_cnn.py")]
+
+
+def load_sweep(sweep_file: str):
+    """
+    Load the configurations of the jobs of a sweep.
+
+    A sweep is described by a JSON file of the form:
+
+        {
+            "grid": {"model_index": [0, 2], "optimizer": ["adam", "nadam"], "lr": [0.001, 0.0001], "nb_neg": [5, 10]},
+            "options": {"nb_epochs": 15, "nb_loader_workers": 2}
+        }
+
+    Values of `grid` are lists of values of options of `train_cnn.py`: one job is run per combination of values.
+    The `options` are given to all the jobs.
+
+    :param sweep_file: the JSON file of the sweep
+    :return: a list of (parameters, options) for each job: the values of the grid and all the options of the job
+    """
+    with open(sweep_file) as f:
+        sweep = json.load(f)
+
+    grid = sweep.get("grid", dict())
+    keys = sorted(grid.keys())
+    values = [grid[key] if isinstance(grid[key], list) else [grid[key]] for key in keys]
+
+    configurations = []
+    for combination in itertools.product(*values):
+        parameters = dict(zip(keys, combination))
+        configurations.append((parameters, dict(sweep.get("options", dict()), **parameters)))
+
+    return configurations
+
+
+def get_job_name(options: dict):
+    """
+    :param options: the options of `train_cnn.py` of a job
+    :return: the name of the job, which only depends on its options
+    """
+    return "sweep_" + hashlib.sha1(json.dumps(options, sort_keys=True).encode()).hexdigest()[0:12]
+
+
+def get_command_arguments(options: dict):
+    """
+    :param options: the options of `train_cnn.py` of a job
+    :return: the arguments of its command line: flags are given for true booleans only
+    """
+    arguments = []
+    for key, value in sorted(options.items()):
+        if isinstance(value, bool):
+            arguments += [f"--{key}"] if value else []
+        elif value is not None:
+            arguments += [f"--{key}", str(value)]
+
+    return arguments
+
+
+def get_kept_epoch(results_folder: str):
+    """
+    :param results_folder: the folder of results of a job
+    :return: the epoch whose weights have been kept in the model serialized in the folder,
+             None if it isn't known (see `train_cnn`)
+    """
+    kept_epoch = get_parameters_dict(results_folder).get("kept_epoch")
+
+    return int(kept_epoch) if kept_epoch not in [None, "", "None"] else None
+
+
+def _same_value(saved_value: str, value):
+    """
+    :param saved_value: a value read from a file of parameters
+    :param value: a value of a grid
+    :return: True if both values are the same
+    """
+    try:
+        return float(saved_value) == float(value)
+    except (TypeError, ValueError):
+        return saved_value == str(value)
+
+
+def get_trained_parameters(options: dict):
+    """
+    Return the parameters `train_cnn.py` saves for a job, the options left out taking their default values.
+
+    Only the parameters of the representation that it has are saved: the default resolution of absolute
+    representations is the one of the representation.
+
+    :param options: all the options of `train_cnn.py` of a job
+    :return: the parameters of the model trained by the job, as saved in its file of parameters
+    :raise ValueError: if the options don't define a representation
+    """
+    parameters = dict(TRAIN_PARAMETERS_DEFAULTS)
+    parameters.update((key, value) for key, value in options.items() if key not in RUN_OPTIONS)
+    # Names of optimizers are saved in lower case
+    parameters["optimizer"] = str(parameters["optimizer"]).lower()
+
+    representation_keys = ["length_cube_side", "cube_resolution", "density_sigma"]
+    representation = get_representation(parameters["representation"], cube_dtype=parameters["cube_dtype"],
+                                        **{key: parameters.pop(key) for key in representation_keys})
+    representation_parameters = representation.get_parameters()
+    parameters.update((key, representation_parameters[key]) for key in representation_keys
+                      if key in representation_parameters)
+
+    return parameters
+
+
+def find_trained_model(options: dict, trained_parameters: list):
+    """
+    Find a model already trained with the options of a job.
+
+    All the parameters of the model the job would train are matched (see `get_trained_parameters`), the options
+    left out taking their default values. Models whose files of parameters don't hold all these parameters
+    (models trained before they were saved) are never matched.
+
+    :param options: all the options of `train_cnn.py` of a job
+    :param trained_parameters: the folders of results with a serialized model and their parameters
+                               (see `ModelsInspector`)
+    :return: the folder of results of the model, None if no model has been trained with these options
+    """
+    try:
+        parameters = get_trained_parameters(options)
+    except ValueError:
+        # The job fails when run
+        return None
+
+    for folder, set_parameters in trained_parameters:
+        if all(key in set_parameters and _same_value(set_parameters[key], value)
+               for key, value in parameters.items()):
+            return folder
+
+    return None
+
+
+class SweepQueue:
+    """
+    The persistent queue of the jobs of a sweep.
+
+    The queue is saved in a JSON file after each change of state of a job, so that a sweep can be stopped
+    and started again: jobs that were running when it has been stopped, or that have been interrupted,
+    are pending again.
+
+    """
+
+    def __init__(self, queue_file: str):
+        """
+        :param queue_file: the file where the queue is saved (loaded if it exists)
+        """
+        self._queue_file = queue_file
+        self._jobs = OrderedDict()
+
+        if os.path.exists(queue_file):
+            with open(queue_file) as f:
+                for job in json.load(f):
+                    if job["state"] in [RUNNING, INTERRUPTED]:
+                        job["state"] = PENDING
+                    self._jobs[job["name"]] = job
+
+    def add(self, parameters: dict, options: dict):
+        """
+        Add a job to the queue if it isn't in it.
+
+        :param parameters: the values of the grid of the job
+        :param options: all the options of `train_cnn.py` of the job
+        :return: the job
+        """
+        name = get_job_name(options)
+        if name not in self._jobs:
+            self._jobs[name] = dict(name=name, parameters=parameters, options=options, state=PENDING,
+                                    returncode=None, results_folder=None, kept_epoch=None)
+
+        return self._jobs[name]
+
+    def get_jobs(self, state: str = None):
+        """
+        :param state: a state of jobs (default: all the states)
+        :return: the jobs in this state, in the order they have been added
+        """
+        return [job for job in self._jobs.values() if state is None or job["state"] == state]
+
+    def set_state(self, job: dict, state: str, **fields):
+        """
+        Change the state of a job and save the queue.
+
+        :param job: a job of the queue
+        :param state: its new state
+        :param fields: other fields of the job to update
+        :return:
+        """
+        job.update(fields, state=state)
+        self.save()
+
+    def save(self):
+        """
+        Save the queue: the file is replaced at once so that it is never partially written.
+
+        :return:
+        """
+        temporary_file = self._queue_file + ".tmp"
+        with open(temporary_file, "w") as f:
+            json.dump(list(self._jobs.values()), f, indent=2)
+        os.replace(temporary_file, self._queue_file)
+
+
+def get_cpus():
+    """
+    :return: the sorted ids of the CPUs this process can run on
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count()))
+
+
+def start_job(job: dict, job_folder: str, nb_threads: int, cpus: list, command: list = None):
+    """
+    Start the process of a job, limited to some CPUs and to a number of threads.
+
+    Its outputs are written in the log of the sweep in `job_folder`.
+    Jobs resume training from the checkpoint of `job_folder` if they have been stopped before.
+
+    :param job: a job of a `SweepQueue`
+    :param job_folder: the folder where the job saves its results
+    :param nb_threads: the number of threads of the job
+    :param cpus: the ids of the CPUs the job runs on
+    :param command: the command running a job (default: `TRAIN_COMMAND`)
+    :return: the process of the job
+    """
+    os.makedirs(job_folder, exist_ok=True)
+
+    # Numerical libraries read their number of threads in the environment
+    environment = dict(os.environ, OMP_NUM_THREADS=str(nb_threads), MKL_NUM_THREADS=str(nb_threads),
+                       OPENBLAS_NUM_THREADS=str(nb_threads))
+
+    def limit_cpus():
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+
+    arguments = get_command_arguments(job["options"]) + ["--job_folder", job_folder + os.sep,
+                                                         "--nb_threads", str(nb_threads), "--resume"]
+
+    with open(os.path.join(job_folder, SWEEP_LOG_FILE_NAME), "a") as log:
+        return subprocess.Popen((command or TRAIN_COMMAND) + arguments, stdout=log, stderr=subprocess.STDOUT,
+                                env=environment, preexec_fn=limit_cpus)
+
+
+def run_sweep(sweep_file: str, nb_jobs: int = None, nb_threads: int = SWEEP_NB_THREADS_DEFAULT,
+              results_folder: str = RESULTS_FOLDER, retry_failed: bool = False, command: list = None,
+              poll_period: float = SWEEP_POLL_PERIOD):
+    """
+    Run the jobs of a sweep concurrently on the local cores.
+
+    Jobs are run in the order of the queue of the sweep, saved next to `sweep_file`: running the sweep again
+    (after it has been stopped or extended) only runs the jobs which aren't done.
+    Jobs with the options of a model already serialized in `results_folder` are skipped (see `find_trained_model`).
+    The epoch kept in the model of jobs done or skipped is recorded in the queue (`kept_epoch`).
+
+    Each job runs on its own `nb_threads` CPUs and saves its results in the folder of its name in `results_folder`.
+
+    :param sweep_file: the JSON file of the sweep (see `load_sweep`)
+    :param nb_jobs: the number of jobs run at once (default: as many as the CPUs allow)
+    :param nb_threads: the number of threads (and of CPUs) of each job
+    :param results_folder: where jobs save their results
+    :param retry_failed: to run again the jobs that have failed
+    :param command: the command running a job (default: `TRAIN_COMMAND`)
+    :param poll_period: the number of seconds between two checks of the state of jobs
+    :return: the jobs of the queue
+    """
+    cpus = get_cpus()
+    nb_threads = min(nb_threads, len(cpus))
+    nb_jobs = nb_jobs or max(1, len(cpus) // nb_threads)
+
+    queue = SweepQueue(os.path.splitext(sweep_file)[0] + SWEEP_QUEUE_FILE_SUFFIX)
+    for parameters, options in load_sweep(sweep_file):
+        queue.add(parameters, options)
+
+    if retry_failed:
+        for job in queue.get_jobs(FAILED):
+            job["state"] = PENDING
+    queue.save()
+
+    os.makedirs(results_folder, exist_ok=True)
+    trained_parameters = [(folder, set_parameters) for folder, set_parameters, *_ in ModelsInspector(results_folder)]
+    for job in queue.get_jobs(PENDING):
+        trained_folder = find_trained_model(job["options"], trained_parameters)
+        if trained_folder is not None:
+            queue.set_state(job, SKIPPED, results_folder=trained_folder, kept_epoch=get_kept_epoch(trained_folder))
+            print(f"{job['name']} skipped: {job['parameters']} already trained in {trained_folder}")
+
+    pending_jobs = queue.get_jobs(PENDING)
+    print(f"{len(pending_jobs)} jobs to run, {nb_jobs} at once with {nb_threads} threads each")
+
+    # Jobs run in slots of CPUs: {slot: (job, process)}
+    running_jobs = dict()
+    try:
+        while len(pending_jobs) > 0 or len(running_jobs) > 0:
+            for slot, (job, process) in list(running_jobs.items()):
+                if process.poll() is not None:
+                    del running_jobs[slot]
+                    if process.returncode == 0:
+                        state = DONE
+                    elif process.returncode == TIME_BUDGET_EXIT_CODE:
+                        state = INTERRUPTED
+                    else:
+                        state = FAILED
+                    kept_epoch = get_kept_epoch(job["results_folder"]) if state == DONE else None
+                    queue.set_state(job, state, returncode=process.returncode, kept_epoch=kept_epoch)
+                    print(f"{job['name']} {job['state']}: {job['parameters']}")
+
+            for slot in range(nb_jobs):
+                if slot in running_jobs or len(pending_jobs) == 0:
+                    continue
+
+                job = pending_jobs.pop(0)
+                job_folder = os.path.join(results_folder, job["name"])
+                slot_cpus = [cpus[(slot * nb_threads + index) % len(cpus)] for index in range(nb_threads)]
+                running_jobs[slot] = (job, start_job(job, job_folder, nb_threads, slot_cpus, command))
+                queue.set_state(job, RUNNING, results_folder=job_folder)
+                print(f"{job['name']} started on CPUs {slot_cpus}: {job['parameters']}")
+
+            if len(running_jobs) > 0:
+                time.sleep(poll_period)
+    finally:
+        # Jobs interrupted are run again when the sweep is started again
+        for job, process in running_jobs.values():
+            process.terminate()
+            process.wait()
+            queue.set_state(job, PENDING, returncode=None)
+
+    return queue.get_jobs()
+
+
+def main(arguments: list = None):
+    """
+    Run a sweep with the parameters given on the command line.
+
+    :param arguments: the arguments of the command line (default: the ones of `sys.argv`)
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Run the training jobs of a sweep on the local cores.')
+
+    parser.add_argument('sweep_file', metavar='sweep_file', type=str,
+                        help='the JSON file of the grid of the sweep (see `load_sweep` in sweep.py)')
+
+    parser.add_argument('--nb_jobs', metavar='nb_jobs',
+                        type=int, default=None,
+                        help='the number of jobs run at once (default: as many as the cores allow)')
+
+    parser.add_argument('--nb_threads', metavar='nb_threads',
+                        type=int, default=SWEEP_NB_THREADS_DEFAULT,
+                        help='the number of threads (and of cores) of each job')
+
+    parser.add_argument('--results_folder', metavar='results_folder',
+                        type=str, default=RESULTS_FOLDER,
+                        help='where jobs save their results')
+
+    parser.add_argument('--retry_failed', action='store_true',
+                        help='to run again the jobs that have failed')
+
+    args = parser.parse_args(arguments)
+
+    jobs = run_sweep(args.sweep_file, nb_jobs=args.nb_jobs, nb_threads=args.nb_threads,
+                     results_folder=args.results_folder, retry_failed=args.retry_failed)
+
+    for state in [DONE, SKIPPED, FAILED, INTERRUPTED, PENDING]:
+        print(f"{len([job for job in jobs if job['state'] == state])} jobs {state}")
+
+
+if __name__ == "__main__":
+    main()
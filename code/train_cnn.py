@@ -2,21 +2,31 @@ import argparse
 import logging
 import os
 import pickle
+import sys
+import time
 from datetime import datetime
 
+import tensorflow as tf
 from keras import backend as K
+from keras.models import load_model
 from keras.optimizers import Adam, SGD, Adadelta, Nadam
 from keras.utils import print_summary
 from keras.losses import binary_crossentropy
 
-from discretization import RelativeCubeRepresentation, AbsoluteCubeRepresentation, CubeRepresentation
-from examples_iterator import ExamplesIterator
-from models import models_available, models_available_names
-from pipeline_fixtures import LogEpochBatchCallback, get_current_timestamp
+from batch_loader import BatchLoader
+from callbacks import LogEpochBatchCallback, CheckpointCallback, EarlyStoppingCallback, FullValidationCallback
+from cube_cache import CubeCache
+from discretization import RelativeCubeRepresentation, CubeRepresentation, REPRESENTATIONS, get_representation
+from examples_iterator import ExamplesIterator, HardNegativesSampler, HardNegativeMiningCallback, \
+    RotatingNegativesSampler
+from models import get_model, models_available_names, check_input_shape
+from pipeline_fixtures import get_current_timestamp, parse_duration
 from settings import LENGTH_CUBE_SIDE, HISTORY_FILE_NAME_SUFFIX, JOB_FOLDER_DEFAULT, \
-    WEIGHT_POS_CLASS, LR_DEFAULT
-from settings import TRAINING_EXAMPLES_FOLDER, RESULTS_FOLDER, NB_NEG_EX_PER_POS, OPTIMIZER_DEFAULT, BATCH_SIZE_DEFAULT, \
-    NB_EPOCHS_DEFAULT, SERIALIZED_MODEL_FILE_NAME_SUFFIX, PARAMETERS_FILE_NAME_SUFFIX, TRAINING_LOGFILE_SUFFIX, \
+    WEIGHT_POS_CLASS, LR_DEFAULT, PREFETCH_DEPTH_DEFAULT, CUBE_CACHE_RAM_BUDGET_DEFAULT, CUBE_DTYPES, \
+    DEFAULT_CUBE_RES, POCKET_CUBE_RES_DEFAULT, CHECKPOINT_MODEL_FILE_NAME, CHECKPOINT_STATE_FILE_NAME, \
+    TIME_BUDGET_EXIT_CODE, EARLY_STOPPING_MONITORS, EARLY_STOPPING_MONITOR_DEFAULT, TRAIN_PARAMETERS_DEFAULTS
+from settings import TRAINING_EXAMPLES_FOLDER, RESULTS_FOLDER, OPTIMIZER_DEFAULT, \
+    SERIALIZED_MODEL_FILE_NAME_SUFFIX, PARAMETERS_FILE_NAME_SUFFIX, TRAINING_LOGFILE_SUFFIX, \
     VALIDATION_EXAMPLES_FOLDER
 
 
@@ -52,6 +62,36 @@ def f1(y_true, y_pred):
     return 2 * ((precision * recall) / (precision + recall + K.epsilon()))
 
 
+def get_optimizer(name: str, lr: float = LR_DEFAULT, lr_decay: float = 0.0):
+    """
+    :param name: the name of the optimizer ("adam", "sgd", "nesterov","adadelta","nadam"): Adam for other names
+    :param lr: the learning rate
+    :param lr_decay: the decay of the learning rate
+    :return: the optimizer
+    """
+    if name == "sgd":
+        return SGD(decay=lr_decay, lr=lr)
+    if name == "nesterov":
+        return SGD(decay=lr_decay, nesterov=True, lr=lr)
+    if name == "adadelta":
+        return Adadelta(decay=lr_decay, lr=lr)
+    if name == "nadam":
+        return Nadam(schedule_decay=lr_decay, lr=lr)
+
+    return Adam(decay=lr_decay, lr=lr)
+
+
+def limit_threads(nb_threads: int):
+    """
+    Limit the number of threads used by TensorFlow to run the operations of models.
+
+    :param nb_threads: the number of threads
+    :return:
+    """
+    K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=nb_threads,
+                                                   inter_op_parallelism_threads=nb_threads)))
+
+
 def train_cnn(model_index: int,
               nb_epochs: int,
               nb_neg: int,
@@ -61,9 +101,26 @@ def train_cnn(model_index: int,
               weight_pos_class: float = WEIGHT_POS_CLASS,
               lr_decay:float=0.0,
               lr:float=LR_DEFAULT,
-              optimizer=OPTIMIZER_DEFAULT,
+              optimizer: str = OPTIMIZER_DEFAULT,
               results_folder: str = RESULTS_FOLDER,
-              job_folder: str = None):
+              job_folder: str = None,
+              hard_negatives: bool = False,
+              nb_candidates: int = None,
+              mining_period: int = 1,
+              rotate_negatives: bool = False,
+              nb_loader_workers: int = 0,
+              prefetch_depth: int = PREFETCH_DEPTH_DEFAULT,
+              use_cube_cache: bool = False,
+              cube_cache_ram_budget: int = CUBE_CACHE_RAM_BUDGET_DEFAULT,
+              cube_cache_folder: str = None,
+              training_voxels_folder: str = None,
+              validation_voxels_folder: str = None,
+              resume: bool = False,
+              time_budget: float = None,
+              monitor: str = EARLY_STOPPING_MONITOR_DEFAULT,
+              patience: int = None,
+              validation_subset: int = None,
+              full_validation_period: int = None):
     """
     Train a given CNN using some given parameters.
 
@@ -71,6 +128,9 @@ def train_cnn(model_index: int,
      - the serialized model
      - a log of the training procedure
      - a file listing the parameters
+     - a checkpoint of the last epoch done, to resume training
+
+    The epoch whose weights are kept in the serialized model is added to the file of parameters (`kept_epoch`).
 
     :param model_index: the index of the model to use in the list `model_available`
     :param nb_epochs: the number of epochs to use
@@ -81,11 +141,39 @@ def train_cnn(model_index: int,
     :param weight_pos_class: the weight to use for the positive class
     :param lr_decay: learning rate decay used
     :param lr: learning_rate used
-    :param optimizer: the optimizer to use to train (default = "Adam")
+    :param optimizer: the name of the optimizer to use to train (see `get_optimizer`)
     :param results_folder: where to save `job_folder` if it is None
     :param job_folder: where results can saved
-    :return:
+    :param hard_negatives: to train on the `nb_neg` hardest negatives examples per positive example,
+                           mined every `mining_period` epochs with the model being trained
+    :param nb_candidates: the number of candidates negatives examples scored per protein for mining (default: all)
+    :param mining_period: the number of epochs between two minings of hard negatives examples
+    :param rotate_negatives: to train on a different subset of `nb_neg` negatives examples per positive example
+                             at each epoch, in order to use all the negatives examples available
+    :param nb_loader_workers: the number of processes building batches ahead of training (see `BatchLoader`);
+                              if 0, batches are built by Keras in the training process (on demand with
+                              `hard_negatives` or `rotate_negatives`)
+    :param prefetch_depth: the number of batches that loader workers can build ahead of training
+    :param use_cube_cache: to keep the cubes made in a cache, so that they are made once over epochs
+    :param cube_cache_ram_budget: the number of bytes of cubes kept in memory by the cache of each iterator, shared
+                                  between its loader workers
+    :param cube_cache_folder: the folder where the cache saves the cubes evicted from memory (if None, they are dropped)
+    :param training_voxels_folder: a folder of cubes precomputed for training examples (see `voxelize`)
+    :param validation_voxels_folder: a folder of cubes precomputed for validation examples (see `voxelize`)
+    :param resume: to resume training from the checkpoint of `job_folder` if there is one
+    :param time_budget: the number of seconds training can last: it is stopped at the end of the last epoch
+                        that can end in time, after its checkpoint is saved
+    :param monitor: the metric of epochs monitored for early stopping (see `EARLY_STOPPING_MONITORS`)
+    :param patience: to stop training when `monitor` hasn't improved for this number of epochs, keeping the
+                     weights of the best epoch (default: no early stopping, the weights of the last epoch are kept)
+    :param validation_subset: the number of examples of a fixed stratified subset of the validation examples
+                              to validate each epoch on (default: all the validation examples)
+    :param full_validation_period: with `validation_subset`, the number of epochs between two validations on all
+                                   the validation examples (default: only the model kept at the end is validated
+                                   on all of them)
+    :return: True if training is done, False if it has been stopped before the end of the time budget
     """
+    deadline = None if time_budget is None else time.time() + time_budget
 
     # Making a folder for the job to save log, model, history in it.
     if job_folder is None:
@@ -119,13 +207,28 @@ def train_cnn(model_index: int,
 
     start_time = datetime.now()
 
-    logger.debug('Creating network model')
-    model = models_available[model_index]
+    checkpoint_model_file = os.path.join(job_folder, CHECKPOINT_MODEL_FILE_NAME)
+    checkpoint_state_file = os.path.join(job_folder, CHECKPOINT_STATE_FILE_NAME)
+    checkpoint = None
+    if resume and os.path.exists(checkpoint_model_file) and os.path.exists(checkpoint_state_file):
+        with open(checkpoint_state_file, "rb") as f:
+            checkpoint = pickle.load(f)
+
+    if checkpoint is not None:
+        # The model is saved compiled, with the state of its optimizer
+        logger.debug(f"Resuming training from the checkpoint of epoch {checkpoint['epoch']} in {job_folder}")
+        model = load_model(checkpoint_model_file, custom_objects={"f1": f1})
+        initial_epoch = checkpoint["epoch"] + 1
+    else:
+        logger.debug('Creating network model')
+        model = get_model(model_index, input_shape=representation.get_cube_shape())
+        model.compile(optimizer=get_optimizer(optimizer, lr, lr_decay), loss=binary_crossentropy,
+                      metrics=['accuracy', f1])
+        initial_epoch = 0
+
     logger.debug(f"Model {model.name} chosen")
     print_summary(model, print_fn=logger.debug)
 
-    model.compile(optimizer=optimizer, loss=binary_crossentropy, metrics=['accuracy', f1])
-
     logger.debug(f'{os.path.basename(__file__)} : Training the model with the following parameters')
     logger.debug(f'model = {model.name}')
     logger.debug(f'nb_epochs   = {nb_epochs}')
@@ -134,38 +237,135 @@ def train_cnn(model_index: int,
     logger.debug(f'nb_neg      = {nb_neg}')
     logger.debug(f'optimizer   = {optimizer}')
     logger.debug(f'representation   = {representation.name}')
+    logger.debug(f'cube_dtype   = {representation.get_cube_dtype().name}')
+    logger.debug(f'length_cube_side   = {representation.get_parameters().get("length_cube_side")}')
+    logger.debug(f'cube_resolution   = {representation.get_parameters().get("cube_resolution")}')
+    logger.debug(f'density_sigma   = {representation.get_parameters().get("density_sigma")}')
     logger.debug(f'weight_pos_class   = {weight_pos_class}')
     logger.debug(f'lr_decay   = {lr_decay}')
     logger.debug(f'lr   = {lr}')
+    logger.debug(f'hard_negatives   = {hard_negatives}')
+    logger.debug(f'nb_candidates   = {nb_candidates}')
+    logger.debug(f'mining_period   = {mining_period}')
+    logger.debug(f'rotate_negatives   = {rotate_negatives}')
+    logger.debug(f'nb_loader_workers   = {nb_loader_workers}')
+    logger.debug(f'prefetch_depth   = {prefetch_depth}')
+    logger.debug(f'use_cube_cache   = {use_cube_cache}')
+    logger.debug(f'cube_cache_ram_budget   = {cube_cache_ram_budget}')
+    logger.debug(f'cube_cache_folder   = {cube_cache_folder}')
+    logger.debug(f'training_voxels_folder   = {training_voxels_folder}')
+    logger.debug(f'validation_voxels_folder   = {validation_voxels_folder}')
+    logger.debug(f'monitor   = {monitor}')
+    logger.debug(f'patience   = {patience}')
+    logger.debug(f'validation_subset   = {validation_subset}')
+    logger.debug(f'full_validation_period   = {full_validation_period}')
 
     # Saving parameters in a file
     with open(parameters_file, "w") as f:
         f.write(f'model={model.name}\n')
+        f.write(f'model_index={model_index}\n')
         f.write(f'nb_epochs={nb_epochs}\n')
         f.write(f'max_examples={max_examples}\n')
         f.write(f'batch_size={batch_size}\n')
         f.write(f'nb_neg={nb_neg}\n')
         f.write(f'optimizer={optimizer}\n')
+        f.write(f'lr={lr}\n')
+        f.write(f'lr_decay={lr_decay}\n')
         f.write(f'representation={representation.name}\n')
+        f.write(f'cube_dtype={representation.get_cube_dtype().name}\n')
+        if "length_cube_side" in representation.get_parameters():
+            f.write(f'length_cube_side={representation.get_parameters()["length_cube_side"]}\n')
+        if "cube_resolution" in representation.get_parameters():
+            f.write(f'cube_resolution={representation.get_parameters()["cube_resolution"]}\n')
+        if "density_sigma" in representation.get_parameters():
+            f.write(f'density_sigma={representation.get_parameters()["density_sigma"]}\n')
         f.write(f'weight_pos_class={weight_pos_class}\n')
+        f.write(f'hard_negatives={hard_negatives}\n')
+        f.write(f'nb_candidates={nb_candidates}\n')
+        f.write(f'mining_period={mining_period}\n')
+        f.write(f'rotate_negatives={rotate_negatives}\n')
+        f.write(f'monitor={monitor}\n')
+        f.write(f'patience={patience}\n')
+        f.write(f'validation_subset={validation_subset}\n')
+        f.write(f'full_validation_period={full_validation_period}\n')
 
     logger.debug(f'Serialized model, log and history to be saved in {job_folder}')
 
+    # To make cubes once over epochs: loader workers each have a copy of the caches, sharing the budget
+    cube_cache_ram_budget //= max(1, nb_loader_workers)
+    train_cube_cache = CubeCache(cube_cache_ram_budget, cube_cache_folder) if use_cube_cache else None
+    validation_cube_cache = CubeCache(cube_cache_ram_budget, cube_cache_folder) if use_cube_cache else None
+
     # To load the data incrementally
+    negatives_sampler = None
+    if hard_negatives:
+        negatives_sampler = HardNegativesSampler()
+    elif rotate_negatives:
+        negatives_sampler = RotatingNegativesSampler()
     train_examples_iterator = ExamplesIterator(representation=representation,
                                                examples_folder=TRAINING_EXAMPLES_FOLDER,
                                                nb_neg=nb_neg,
                                                batch_size=batch_size,
-                                               max_examples=max_examples)
+                                               max_examples=max_examples,
+                                               negatives_sampler=negatives_sampler,
+                                               cube_cache=train_cube_cache,
+                                               voxels_folder=training_voxels_folder)
 
+    # Epochs are validated on a fixed subset of the validation examples if asked, and on all of them periodically
     validation_examples_iterator = ExamplesIterator(representation=representation,
                                                     examples_folder=VALIDATION_EXAMPLES_FOLDER,
                                                     nb_neg=nb_neg,
                                                     batch_size=batch_size,
-                                                    max_examples=max_examples)
+                                                    max_examples=max_examples,
+                                                    cube_cache=validation_cube_cache,
+                                                    voxels_folder=validation_voxels_folder,
+                                                    subset_size=validation_subset)
+
+    full_validation_examples_iterator = None
+    if validation_subset is not None:
+        full_validation_examples_iterator = ExamplesIterator(representation=representation,
+                                                             examples_folder=VALIDATION_EXAMPLES_FOLDER,
+                                                             nb_neg=nb_neg,
+                                                             batch_size=batch_size,
+                                                             max_examples=max_examples,
+                                                             cube_cache=validation_cube_cache,
+                                                             voxels_folder=validation_voxels_folder)
+        logger.debug(f'Validating epochs on {validation_examples_iterator.get_nb_examples()} examples out of '
+                     f'{full_validation_examples_iterator.get_nb_examples()}')
+
+    # To stop training when the monitored metric doesn't improve anymore, keeping the best weights
+    early_stopping = None
+    if patience is not None:
+        early_stopping = EarlyStoppingCallback(monitor, patience)
+
+    if checkpoint is not None:
+        train_examples_iterator.set_state(checkpoint["iterator_state"])
+        if early_stopping is not None and checkpoint.get("early_stopping_state") is not None:
+            early_stopping.set_state(checkpoint["early_stopping_state"])
+            # Training stopped early before being interrupted: only the best weights are to be set back
+            if early_stopping.stopped:
+                initial_epoch = nb_epochs
 
     # To log batches and epoch
     epoch_batch_callback = LogEpochBatchCallback(logger)
+    callbacks = [epoch_batch_callback]
+
+    # To select the hardest negatives examples for the next epochs
+    if hard_negatives:
+        callbacks.append(HardNegativeMiningCallback(train_examples_iterator, negatives_sampler,
+                                                    nb_candidates=nb_candidates, period=mining_period))
+
+    if full_validation_examples_iterator is not None and full_validation_period is not None:
+        callbacks.append(FullValidationCallback(full_validation_examples_iterator, full_validation_period))
+
+    if early_stopping is not None:
+        callbacks.append(early_stopping)
+
+    # To save a checkpoint at the end of each epoch, once negatives examples are mined
+    checkpoint_callback = CheckpointCallback(job_folder, train_examples_iterator,
+                                             history=None if checkpoint is None else checkpoint["history"],
+                                             deadline=deadline, early_stopping=early_stopping)
+    callbacks.append(checkpoint_callback)
 
     # To re-balance the class
     classes_weights = {
@@ -176,111 +376,281 @@ def train_cnn(model_index: int,
     logger.debug(f'Training with the following classes weights: {classes_weights}')
 
     # Here we go !
-    history = model.fit_generator(generator=train_examples_iterator,
-                                  epochs=nb_epochs,
-                                  validation_data=validation_examples_iterator,
-                                  callbacks=[epoch_batch_callback],
-                                  class_weight=classes_weights)
+    if nb_loader_workers > 0:
+        # Batches are built ahead by the loaders: Keras consumes them in the training process
+        logger.debug(f'Loading batches with {nb_loader_workers} workers per iterator')
+        with BatchLoader(train_examples_iterator, nb_loader_workers, prefetch_depth) as train_loader, \
+                BatchLoader(validation_examples_iterator, nb_loader_workers, prefetch_depth) as validation_loader:
+            model.fit_generator(generator=train_loader,
+                                steps_per_epoch=len(train_loader),
+                                epochs=nb_epochs,
+                                initial_epoch=initial_epoch,
+                                validation_data=validation_loader,
+                                validation_steps=len(validation_loader),
+                                callbacks=callbacks,
+                                class_weight=classes_weights,
+                                workers=0)
+            if use_cube_cache:
+                logger.debug(f"Cube cache statistics of the training loader workers: "
+                             f"{train_loader.get_cube_cache_statistics()}")
+    elif negatives_sampler is not None:
+        # Negatives examples resampled at the end of epochs are used by all the batches of the next epoch
+        # only if batches are built on demand in the training process (see `ExamplesIterator.generate_batches`)
+        model.fit_generator(generator=train_examples_iterator.generate_batches(),
+                            steps_per_epoch=len(train_examples_iterator),
+                            epochs=nb_epochs,
+                            initial_epoch=initial_epoch,
+                            validation_data=validation_examples_iterator.generate_batches(),
+                            validation_steps=len(validation_examples_iterator),
+                            callbacks=callbacks,
+                            class_weight=classes_weights,
+                            workers=0)
+    else:
+        model.fit_generator(generator=train_examples_iterator,
+                            epochs=nb_epochs,
+                            initial_epoch=initial_epoch,
+                            validation_data=validation_examples_iterator,
+                            callbacks=callbacks,
+                            class_weight=classes_weights)
 
     logger.debug('Done training !')
+    if use_cube_cache and nb_loader_workers == 0:
+        logger.debug(f"Cube cache statistics of the training process: {train_cube_cache.get_statistics()}")
     train_checkpoint = datetime.now()
 
+    if checkpoint_callback.stopped_before_deadline:
+        logger.debug(f"Training stopped before the end of the time budget, after {train_checkpoint - start_time}: "
+                     f"resume it from the checkpoint saved in {job_folder}")
+        return False
+
+    # The last epoch is kept without early stopping
+    nb_epochs_done = len(next(iter(checkpoint_callback.get_history().values()), []))
+    kept_epoch = nb_epochs_done - 1 if early_stopping is None else early_stopping.get_kept_epoch()
+    logger.debug(f"Weights of epoch {kept_epoch} kept ({nb_epochs_done} epochs done)")
+
+    if full_validation_examples_iterator is not None:
+        values = model.evaluate_generator(full_validation_examples_iterator)
+        logger.debug(f"Validation of the model kept on all the validation examples: "
+                     f"{dict(zip(model.metrics_names, values))}")
+
     # Saving the serialized model and its history
     model.save(model_file)
     logger.debug(f"Model saved in {model_file}")
     with open(history_file, "wb") as handle:
-        pickle.dump(history.history, handle)
+        pickle.dump(checkpoint_callback.get_history(), handle)
 
     logger.debug(f"History saved in {model_file}")
+
+    with open(parameters_file, "a") as f:
+        f.write(f'kept_epoch={kept_epoch}\n')
+
     logger.debug(f"Training done in      : {train_checkpoint - start_time}")
 
+    return True
 
-if __name__ == "__main__":
+
+def main(arguments: list = None):
+    """
+    Train a model with the parameters given on the command line.
+
+    :param arguments: the arguments of the command line (default: the ones of `sys.argv`)
+    :return:
+    """
     # Parsing sysargv arguments
     parser = argparse.ArgumentParser(description='Train a neural network.')
 
     parser.add_argument('--model_index', metavar='model_index',
-                        type=int, default=0,
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["model_index"],
                         help=f'the index of the model to use in the list {models_available_names}')
 
     parser.add_argument('--nb_epochs', metavar='nb_epochs',
-                        type=int, default=NB_EPOCHS_DEFAULT,
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["nb_epochs"],
                         help='the number of epochs to use')
 
     parser.add_argument('--batch_size', metavar='batch_size',
-                        type=int, default=BATCH_SIZE_DEFAULT,
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["batch_size"],
                         help='the number of examples to use per batch')
 
     parser.add_argument('--optimizer', metavar='optimizer',
-                        type=str, default="adam",
+                        type=str, default=TRAIN_PARAMETERS_DEFAULTS["optimizer"],
                         help='the optimizer to use ("adam", "sgd", "nesterov","adadelta","nadam")')
 
     parser.add_argument('--lr_decay', metavar='lr_decay',
-                        type=float, default=0.0,
+                        type=float, default=TRAIN_PARAMETERS_DEFAULTS["lr_decay"],
                         help='learning rate decay')
 
     parser.add_argument('--lr', metavar='lr',
-                        type=float, default=LR_DEFAULT,
+                        type=float, default=TRAIN_PARAMETERS_DEFAULTS["lr"],
                         help='learning')
 
     parser.add_argument('--nb_neg', metavar='nb_neg',
-                        type=int, default=NB_NEG_EX_PER_POS,
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["nb_neg"],
                         help='the number of negatives examples to use per positive example')
 
+    parser.add_argument('--hard_negatives', action='store_true',
+                        help='to train on the hardest negatives examples, mined with the model being trained')
+
+    parser.add_argument('--nb_candidates', metavar='nb_candidates',
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["nb_candidates"],
+                        help='the number of candidates negatives examples scored per protein to mine hard negatives '
+                             '(default: all the negatives examples)')
+
+    parser.add_argument('--mining_period', metavar='mining_period',
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["mining_period"],
+                        help='the number of epochs between two minings of hard negatives examples')
+
+    parser.add_argument('--rotate_negatives', action='store_true',
+                        help='to train on a different subset of nb_neg negatives examples per positive example '
+                             'at each epoch')
+
+    parser.add_argument('--nb_loader_workers', metavar='nb_loader_workers',
+                        type=int, default=0,
+                        help='the number of processes building batches ahead of training (0: no loader processes)')
+
+    parser.add_argument('--prefetch_depth', metavar='prefetch_depth',
+                        type=int, default=PREFETCH_DEPTH_DEFAULT,
+                        help='the number of batches that loader processes can build ahead of training')
+
+    parser.add_argument('--cube_cache', action='store_true',
+                        help='to keep the cubes made in a cache, so that they are made once over epochs')
+
+    parser.add_argument('--cube_cache_ram_budget', metavar='cube_cache_ram_budget',
+                        type=int, default=CUBE_CACHE_RAM_BUDGET_DEFAULT,
+                        help='the number of bytes of cubes kept in memory by the cache of each iterator, '
+                             'shared between its loader workers')
+
+    parser.add_argument('--cube_cache_folder', metavar='cube_cache_folder',
+                        type=str, default=None,
+                        help='the folder where the cache saves the cubes evicted from memory')
+
+    parser.add_argument('--training_voxels_folder', metavar='training_voxels_folder',
+                        type=str, default=None,
+                        help='a folder of cubes precomputed for the training examples (see voxelize.py)')
+
+    parser.add_argument('--validation_voxels_folder', metavar='validation_voxels_folder',
+                        type=str, default=None,
+                        help='a folder of cubes precomputed for the validation examples (see voxelize.py)')
+
     parser.add_argument('--max_examples', metavar='max_examples',
-                        type=int, default=None,
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["max_examples"],
                         help='the number of total examples to use in total')
 
     parser.add_argument('--weight_pos_class', metavar='weight_pos_class',
-                        type=float, default=WEIGHT_POS_CLASS,
+                        type=float, default=TRAIN_PARAMETERS_DEFAULTS["weight_pos_class"],
                         help='the weight to readjust the class of positive example with respect to training')
 
     parser.add_argument('--representation', metavar='weight_pos_class',
-                        type=str, default="relative",
-                        help=f'the representation to use for the 3D cube ("{RelativeCubeRepresentation.name}" or '
-                             f'"{AbsoluteCubeRepresentation.name}")')
+                        type=str, default=TRAIN_PARAMETERS_DEFAULTS["representation"],
+                        help=f'the representation to use for the 3D cube {list(REPRESENTATIONS.keys())}')
+
+    parser.add_argument('--length_cube_side', metavar='length_cube_side',
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["length_cube_side"],
+                        help='the number of voxels on each side of cubes')
+
+    parser.add_argument('--cube_resolution', metavar='cube_resolution',
+                        type=float, default=TRAIN_PARAMETERS_DEFAULTS["cube_resolution"],
+                        help=f'the side of voxels in angstrom, for absolute representations '
+                             f'(default {DEFAULT_CUBE_RES}, {POCKET_CUBE_RES_DEFAULT} for pockets)')
+
+    parser.add_argument('--density_sigma', metavar='density_sigma',
+                        type=float, default=TRAIN_PARAMETERS_DEFAULTS["density_sigma"],
+                        help='the standard deviation in voxels of the Gaussian density of atoms '
+                             '(default: atoms are counted in their nearest voxel)')
+
+    parser.add_argument('--cube_dtype', metavar='cube_dtype',
+                        type=str, default=TRAIN_PARAMETERS_DEFAULTS["cube_dtype"], choices=CUBE_DTYPES,
+                        help=f'the type of the values of cubes {CUBE_DTYPES}: cubes are cast to the float type '
+                             f'of the model only when fed to it')
 
     parser.add_argument('--job_folder', metavar='job_folder',
                         type=str, default=JOB_FOLDER_DEFAULT,
                         help='the folder where results are to be saved')
 
-    args = parser.parse_args()
+    parser.add_argument('--nb_threads', metavar='nb_threads',
+                        type=int, default=None,
+                        help='the number of threads used by TensorFlow (default: the number of cores)')
+
+    parser.add_argument('--resume', action='store_true',
+                        help='to resume training from the checkpoint of the job folder if there is one')
+
+    parser.add_argument('--time_budget', metavar='time_budget',
+                        type=parse_duration, default=None,
+                        help='the time training can last, in seconds or as "hh:mm:ss": training is stopped and '
+                             f'saved at the end of the last epoch that can end in time (exit code {TIME_BUDGET_EXIT_CODE})')
+
+    parser.add_argument('--monitor', metavar='monitor',
+                        type=str, default=TRAIN_PARAMETERS_DEFAULTS["monitor"], choices=EARLY_STOPPING_MONITORS,
+                        help=f'the metric of epochs monitored for early stopping {EARLY_STOPPING_MONITORS}')
+
+    parser.add_argument('--patience', metavar='patience',
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["patience"],
+                        help='to stop training when the monitored metric hasn\'t improved for this number of epochs, '
+                             'keeping the weights of the best epoch (default: no early stopping)')
+
+    parser.add_argument('--validation_subset', metavar='validation_subset',
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["validation_subset"],
+                        help='the number of examples of a fixed stratified subset of the validation examples '
+                             'to validate each epoch on (default: all the validation examples)')
+
+    parser.add_argument('--full_validation_period', metavar='full_validation_period',
+                        type=int, default=TRAIN_PARAMETERS_DEFAULTS["full_validation_period"],
+                        help='with --validation_subset, the number of epochs between two validations on all the '
+                             'validation examples (default: only the model kept is validated on all of them)')
+
+    args = parser.parse_args(arguments)
 
     print("Argument parsed : ", args)
 
     assert (args.model_index < len(models_available_names))
     assert (args.nb_epochs > 0)
     assert (args.nb_neg > 0)
+    assert not (args.hard_negatives and args.rotate_negatives)
 
-    representation = (RelativeCubeRepresentation(length_cube_side=LENGTH_CUBE_SIDE)
-                      if args.representation == RelativeCubeRepresentation.name else
-                      AbsoluteCubeRepresentation(length_cube_side=LENGTH_CUBE_SIDE))
+    representation = get_representation(args.representation, length_cube_side=args.length_cube_side,
+                                        cube_dtype=args.cube_dtype, cube_resolution=args.cube_resolution,
+                                        density_sigma=args.density_sigma)
+    check_input_shape(args.model_index, representation.get_cube_shape())
 
     lr_decay = args.lr_decay
     lr = args.lr
 
-    optimizer_arg = args.optimizer.lower()
-    optimizer = Adam(decay=lr_decay, lr=lr)
-    if optimizer_arg == "adam":
-        optimizer = Adam(decay=lr_decay, lr=lr)
-    if optimizer_arg == "sgd":
-        optimizer = SGD(decay=lr_decay, lr=lr)
-    if optimizer_arg == "nesterov":
-        optimizer = SGD(decay=lr_decay, nesterov=True, lr=lr)
-    if optimizer_arg == "adadelta":
-        optimizer = Adadelta(decay=lr_decay, lr=lr)
-    if optimizer_arg == "nadam":
-        optimizer = Nadam(schedule_decay=lr_decay, lr=lr)
-
-    print(optimizer)
-    train_cnn(model_index=args.model_index,
-              nb_epochs=args.nb_epochs,
-              nb_neg=args.nb_neg,
-              max_examples=args.max_examples,
-              representation=representation,
-              batch_size=args.batch_size,
-              optimizer=optimizer,
-              weight_pos_class=args.weight_pos_class,
-              lr_decay=lr_decay,
-              lr=lr,
-              job_folder=args.job_folder)
+    optimizer = args.optimizer.lower()
+
+    if args.nb_threads is not None:
+        limit_threads(args.nb_threads)
+
+    done = train_cnn(model_index=args.model_index,
+                     nb_epochs=args.nb_epochs,
+                     nb_neg=args.nb_neg,
+                     max_examples=args.max_examples,
+                     representation=representation,
+                     batch_size=args.batch_size,
+                     optimizer=optimizer,
+                     weight_pos_class=args.weight_pos_class,
+                     lr_decay=lr_decay,
+                     lr=lr,
+                     job_folder=args.job_folder,
+                     hard_negatives=args.hard_negatives,
+                     nb_candidates=args.nb_candidates,
+                     mining_period=args.mining_period,
+                     rotate_negatives=args.rotate_negatives,
+                     nb_loader_workers=args.nb_loader_workers,
+                     prefetch_depth=args.prefetch_depth,
+                     use_cube_cache=args.cube_cache,
+                     cube_cache_ram_budget=args.cube_cache_ram_budget,
+                     cube_cache_folder=args.cube_cache_folder,
+                     training_voxels_folder=args.training_voxels_folder,
+                     validation_voxels_folder=args.validation_voxels_folder,
+                     resume=args.resume,
+                     time_budget=args.time_budget,
+                     monitor=args.monitor,
+                     patience=args.patience,
+                     validation_subset=args.validation_subset,
+                     full_validation_period=args.full_validation_period)
+
+    if not done:
+        sys.exit(TIME_BUDGET_EXIT_CODE)
+
+
+if __name__ == "__main__":
+    main()
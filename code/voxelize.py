@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+from concurrent import futures
+from itertools import groupby
+
+import numpy as np
+
+from discretization import CubeRepresentation, RelativeCubeRepresentation, REPRESENTATIONS, get_representation
+from molecules_store import MoleculesStore, list_examples, load_example, load_pair, pair_name
+from settings import DEFAULT_CUBE_RES, VOXELS_CUBES_FILE_NAME, VOXELS_INDEX_FILE_NAME, NB_WORKERS, \
+    NB_EXAMPLES_PER_VOXELIZATION_TASK, VOXELS_FOLDER_SUFFIX, LENGTH_CUBE_SIDE, TRAINING_EXAMPLES_FOLDER, \
+    VALIDATION_EXAMPLES_FOLDER, TESTING_EXAMPLES_FOLDER, PREDICT_EXAMPLES_FOLDER, BATCH_SIZE_DEFAULT, CUBE_DTYPES, \
+    CUBE_DTYPE_DEFAULT, POCKET_CUBE_RES_DEFAULT, CUBE_CACHE_FORMAT_VERSION
+
+
+class Voxels:
+    """
+    The cubes of all the examples of a folder, made once with a representation (see `voxelize`).
+
+    Cubes are stored in one memory-mapped tensor of shape (nb_examples, res, res, res, nb_features) ; a sidecar index
+    gives the ids of the protein and of the ligand and the label of the example of each cube, and the parameters
+    of the representation used with the version of the way cubes are made (`CUBE_CACHE_FORMAT_VERSION`).
+
+    """
+
+    def __init__(self, voxels_folder: str):
+        """
+        :param voxels_folder: the folder where the cubes have been written
+        """
+        self._voxels_folder = voxels_folder
+        self._cubes = np.load(os.path.join(voxels_folder, VOXELS_CUBES_FILE_NAME), mmap_mode="r")
+
+        index = np.load(os.path.join(voxels_folder, VOXELS_INDEX_FILE_NAME))
+        if "proteins" not in index.files:
+            raise ValueError(f"The voxels of {voxels_folder} have been made with an older index: "
+                             f"voxelize the examples again")
+
+        self._proteins = index["proteins"]
+        self._ligands = index["ligands"]
+        self._labels = index["labels"]
+        self._parameters = json.loads(str(index["parameters"]))
+        if self._parameters.pop("format_version", None) != CUBE_CACHE_FORMAT_VERSION:
+            raise ValueError(f"The voxels of {voxels_folder} have been made with an older version of cubes: "
+                             f"voxelize the examples again")
+
+        # Cubes are found by the key of their pair with a binary search
+        keys = self._pairs_keys(self._proteins, self._ligands)
+        self._sorted_rows = np.argsort(keys)
+        self._sorted_keys = keys[self._sorted_rows]
+
+    @staticmethod
+    def _pairs_keys(proteins, ligands):
+        """
+        :param proteins: the ids of the systems of the proteins of examples
+        :param ligands: the ids of the systems of their ligands
+        :return: np.ndarray of one int64 per pair of ids
+        """
+        return (np.asarray(proteins, dtype=np.int64) << 32) | np.asarray(ligands, dtype=np.int64)
+
+    def get_parameters(self):
+        """
+        :return: the parameters of the representation used to make the cubes
+        """
+        return self._parameters
+
+    def get_proteins(self):
+        """
+        :return: the ids of the proteins of the examples, in the order of the cubes
+        """
+        return self._proteins
+
+    def get_ligands(self):
+        """
+        :return: the ids of the ligands of the examples, in the order of the cubes
+        """
+        return self._ligands
+
+    def get_examples(self):
+        """
+        :return: the names of the examples, in the order of the cubes
+        """
+        return list(map(pair_name, self._proteins, self._ligands))
+
+    def get_labels(self):
+        """
+        :return: the labels of the examples, in the order of the cubes
+        """
+        return self._labels
+
+    def __len__(self):
+        return len(self._proteins)
+
+    def get_cubes(self, proteins, ligands):
+        """
+        :param proteins: the ids of the systems of the proteins of examples
+        :param ligands: the ids of the systems of their ligands
+        :return: np.ndarray of their cubes with the first axis used for examples
+        """
+        keys = self._pairs_keys(proteins, ligands)
+        positions = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+        if len(keys) > 0 and (len(self._sorted_keys) == 0 or np.any(self._sorted_keys[positions] != keys)):
+            raise KeyError(f"Some examples have no cube in {self._voxels_folder}")
+        rows = self._sorted_rows[positions]
+
+        # Reading consecutive rows at once when possible
+        if len(rows) > 0 and np.all(np.diff(rows) == 1):
+            return np.array(self._cubes[rows[0]:rows[-1] + 1])
+
+        return self._cubes[rows]
+
+
+def _voxelize_examples(examples_folder: str, proteins: np.ndarray, ligands: np.ndarray, first_row: int,
+                       representation: CubeRepresentation, molecules_store: MoleculesStore, cubes_file: str):
+    """
+    Make the cubes of some examples and write them in the tensor of cubes.
+
+    The cubes of the examples of a protein are made at once if the representation can (see `make_pair_cubes`).
+
+    :param examples_folder: the folder containing the examples
+    :param proteins: the ids of the systems of the proteins of the examples
+    :param ligands: the ids of the systems of their ligands
+    :param first_row: the row of the cube of the first example in the tensor
+    :param representation: the representation to use
+    :param molecules_store: the store of molecules of virtual examples, None otherwise (see `list_examples`)
+    :param cubes_file: the file of the tensor of cubes
+    :return:
+    """
+    cubes = np.load(cubes_file, mmap_mode="r+")
+    by_protein = hasattr(representation, "make_pair_cubes")
+    for first_index in range(0, len(proteins), BATCH_SIZE_DEFAULT):
+        batch = slice(first_index, first_index + BATCH_SIZE_DEFAULT)
+        pairs_ids = list(zip(proteins[batch].tolist(), ligands[batch].tolist()))
+        rows = slice(first_row + first_index, first_row + first_index + len(pairs_ids))
+
+        if not by_protein:
+            representation.make_cubes([load_example(examples_folder, protein, ligand, molecules_store)
+                                       for protein, ligand in pairs_ids], out=cubes[rows])
+            continue
+
+        # Examples are sorted: the ones of a protein are consecutive
+        first_cube = rows.start
+        for protein, protein_pairs_ids in groupby(pairs_ids, key=lambda pair_ids: pair_ids[0]):
+            pairs = [load_pair(examples_folder, protein, ligand, molecules_store) for _, ligand in protein_pairs_ids]
+            representation.make_pair_cubes((examples_folder, protein), pairs[0][0], [ligand for _, ligand in pairs],
+                                           out=cubes[first_cube:first_cube + len(pairs)])
+            first_cube += len(pairs)
+
+    cubes.flush()
+
+
+def voxelize(examples_folder: str, representation: CubeRepresentation, voxels_folder: str,
+             nb_workers: int = NB_WORKERS):
+    """
+    Make the cubes of all the examples of a folder with a representation and save them in `voxels_folder`.
+
+    The tensor of cubes is preallocated as a memory-mapped file and filled by workers, each one handling
+    a range of consecutive examples. The manifest and the store of molecules of the folder are loaded once:
+    workers only receive the ids of the proteins and of the ligands of their examples.
+
+    :param examples_folder: the folder containing the examples (materialized or virtual)
+    :param representation: the representation to use
+    :param voxels_folder: where to save the cubes
+    :param nb_workers: the number of processes making cubes
+    :return: the number of cubes made
+    """
+    manifest, molecules_store = list_examples(examples_folder)
+    os.makedirs(voxels_folder, exist_ok=True)
+
+    cubes_file = os.path.join(voxels_folder, VOXELS_CUBES_FILE_NAME)
+    cubes = np.lib.format.open_memmap(cubes_file, mode="w+", dtype=representation.get_cube_dtype(),
+                                      shape=(len(manifest),) + representation.get_cube_shape())
+    del cubes
+
+    with futures.ProcessPoolExecutor(max_workers=nb_workers) as executor:
+        tasks = []
+        for first_row in range(0, len(manifest), NB_EXAMPLES_PER_VOXELIZATION_TASK):
+            examples = manifest[first_row:first_row + NB_EXAMPLES_PER_VOXELIZATION_TASK]
+            tasks.append(executor.submit(_voxelize_examples, examples_folder, examples["protein"],
+                                         examples["ligand"], first_row, representation, molecules_store, cubes_file))
+
+        # Raising the errors of workers, if any
+        for task in tasks:
+            task.result()
+
+    # The index is written last: a folder with an index is complete
+    np.savez(os.path.join(voxels_folder, VOXELS_INDEX_FILE_NAME),
+             proteins=manifest["protein"],
+             ligands=manifest["ligand"],
+             labels=manifest["label"].astype(np.uint8),
+             parameters=np.array(json.dumps(dict(representation.get_parameters(),
+                                                 format_version=CUBE_CACHE_FORMAT_VERSION))))
+
+    return len(manifest)
+
+
+def get_voxels_folder(examples_folder: str, representation: CubeRepresentation):
+    """
+    :param examples_folder: the folder containing the examples
+    :param representation: the representation used
+    :return: the default folder of the voxels of the examples made with the representation: its name holds
+             the version of the way cubes are made and all the parameters of the representation, so that cubes
+             made otherwise are never reused
+    """
+    parameters = representation.get_parameters()
+    name = "_".join([representation.name, f"v{CUBE_CACHE_FORMAT_VERSION}"]
+                    + [f"{key}-{parameters[key]}" for key in sorted(parameters) if key != "name"])
+
+    return os.path.join(examples_folder.rstrip(os.sep) + VOXELS_FOLDER_SUFFIX, name)
+
+
+def main(arguments: list = None):
+    """
+    Voxelize a data set with a representation.
+
+    :param arguments: the arguments of the command line (default: the ones of `sys.argv`)
+    :return:
+    """
+    examples_folders = {"training": TRAINING_EXAMPLES_FOLDER,
+                        "validation": VALIDATION_EXAMPLES_FOLDER,
+                        "testing": TESTING_EXAMPLES_FOLDER,
+                        "predict": PREDICT_EXAMPLES_FOLDER}
+
+    parser = argparse.ArgumentParser(description='Make once the cubes of all the examples of a data set.')
+
+    parser.add_argument('--examples', metavar='examples',
+                        type=str, default="training",
+                        help=f'the data set to voxelize {list(examples_folders.keys())}')
+
+    parser.add_argument('--representation', metavar='representation',
+                        type=str, default=RelativeCubeRepresentation.name,
+                        help=f'the representation to use for the 3D cube {list(REPRESENTATIONS.keys())}')
+
+    parser.add_argument('--length_cube_side', metavar='length_cube_side',
+                        type=int, default=LENGTH_CUBE_SIDE,
+                        help='the number of voxels on each side of cubes')
+
+    parser.add_argument('--cube_resolution', metavar='cube_resolution',
+                        type=float, default=None,
+                        help=f'the side of voxels in angstrom, for absolute representations '
+                             f'(default {DEFAULT_CUBE_RES}, {POCKET_CUBE_RES_DEFAULT} for pockets)')
+
+    parser.add_argument('--density_sigma', metavar='density_sigma',
+                        type=float, default=None,
+                        help='the standard deviation in voxels of the Gaussian density of atoms '
+                             '(default: atoms are counted in their nearest voxel)')
+
+    parser.add_argument('--cube_dtype', metavar='cube_dtype',
+                        type=str, default=CUBE_DTYPE_DEFAULT, choices=CUBE_DTYPES,
+                        help=f'the type of the values of cubes {CUBE_DTYPES}')
+
+    parser.add_argument('--voxels_folder', metavar='voxels_folder',
+                        type=str, default=None,
+                        help='where to save the cubes (default: next to the folder of examples)')
+
+    args = parser.parse_args(arguments)
+
+    representation = get_representation(args.representation, length_cube_side=args.length_cube_side,
+                                        cube_dtype=args.cube_dtype, cube_resolution=args.cube_resolution,
+                                        density_sigma=args.density_sigma)
+
+    examples_folder = examples_folders[args.examples]
+    voxels_folder = args.voxels_folder or get_voxels_folder(examples_folder, representation)
+
+    print(f"Voxelizing {examples_folder} with the {representation.name} representation in {voxels_folder}")
+    nb_cubes = voxelize(examples_folder, representation, voxels_folder)
+    print(f"{nb_cubes} cubes made")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent import futures
+
+import numpy as np
+
+from create_examples import create_examples
+from molecules_store import load_molecule, list_systems, PROTEIN, LIGAND
+from pipeline_fixtures import save_nparray
+from settings import COMMENT_DELIMITER, FEATURES_NAMES, NB_WORKERS
+
+NB_SYSTEMS = 100
+NB_NEG = 40
+
+
+def save_example_reference(examples_folder, protein, ligand, protein_system, ligand_system):
+    """
+    The previous way to save an example, used as a reference.
+    """
+    file_path = os.path.join(examples_folder, protein_system + "_" + ligand_system + ".csv")
+    example = np.concatenate((protein, ligand), axis=0)
+    type_example = (" Positive" if protein_system == ligand_system else " Negative") + " example "
+    comments = [f"{type_example} of (Protein, Ligand) : ({protein_system},{ligand_system})",
+                f" - Number of atoms in Protein: {protein.shape[0]}",
+                f" - Number of atoms in Ligand : {ligand.shape[0]}",
+                ','.join(FEATURES_NAMES)]
+    comment = COMMENT_DELIMITER + f"\n{COMMENT_DELIMITER} ".join(comments) + "\n"
+
+    with open(file_path, "w") as f:
+        f.write(comment)
+        np.savetxt(fname=f, X=example)
+
+
+def save_system_examples_reference(system, systems, nb_neg, extracted_data_folder, examples_folder):
+    """
+    The previous way to save the examples of one system (ligands loaded for each example), used as a reference.
+    """
+    system_protein = load_molecule(extracted_data_folder, system, PROTEIN)
+    system_ligand = load_molecule(extracted_data_folder, system, LIGAND)
+    save_example_reference(examples_folder, system_protein, system_ligand, system, system)
+
+    other_systems = sorted(list(systems.difference({system})))
+    for index in np.random.permutation(len(other_systems))[0:nb_neg]:
+        other_ligand = load_molecule(extracted_data_folder, other_systems[index], LIGAND)
+        save_example_reference(examples_folder, system_protein, other_ligand, system, other_systems[index])
+
+
+def create_examples_reference(from_folder, to_folder, nb_neg):
+    """
+    The previous way to create examples : one task per system.
+    """
+    os.makedirs(to_folder)
+    systems = list_systems(from_folder)
+    with futures.ProcessPoolExecutor(max_workers=NB_WORKERS) as executor:
+        for system in sorted(systems):
+            executor.submit(save_system_examples_reference, system, systems, nb_neg, from_folder, to_folder)
+
+
+def write_synthetic_molecules(folder, nb_systems):
+    """
+    Write synthetic extracted molecules.
+    """
+    random_state = np.random.RandomState(1337)
+    for system in range(1, nb_systems + 1):
+        for kind, suffix, nb_atoms in [(PROTEIN, "_pro_cg.npy", 500), (LIGAND, "_lig_cg.npy", 20)]:
+            molecule = np.zeros((nb_atoms, len(FEATURES_NAMES)), dtype=np.float32)
+            molecule[:, 0:3] = random_state.uniform(-50, 50, size=(nb_atoms, 3))
+            molecule[:, 3] = random_state.randint(0, 2, nb_atoms)
+            molecule[:, 4] = 1 - molecule[:, 3]
+            molecule[:, 5 + kind] = 1
+            save_nparray(os.path.join(folder, f"{system:04d}{suffix}"), molecule)
+
+
+if __name__ == "__main__":
+    folder = tempfile.mkdtemp()
+    try:
+        extracted_folder = os.path.join(folder, "extracted")
+        os.makedirs(extracted_folder)
+        write_synthetic_molecules(extracted_folder, NB_SYSTEMS)
+
+        reference_folder = os.path.join(folder, "reference_examples")
+        start = time.time()
+        create_examples_reference(extracted_folder, reference_folder, NB_NEG)
+        reference_time = time.time() - start
+
+        new_folder = os.path.join(folder, "examples")
+        start = time.time()
+        create_examples(extracted_folder, new_folder, NB_NEG)
+        new_time = time.time() - start
+
+        # Negatives are random: files created in both folders should be identical
+        common_files = set(os.listdir(reference_folder)).intersection(os.listdir(new_folder))
+        for file in common_files:
+            with open(os.path.join(reference_folder, file), "rb") as f_ref, \
+                    open(os.path.join(new_folder, file), "rb") as f_new:
+                assert f_ref.read() == f_new.read(), f"{file} differs"
+
+        print(f"create_examples ({NB_SYSTEMS} systems, nb_neg={NB_NEG}, {len(os.listdir(new_folder))} files)")
+        print(f" - previous procedure : {reference_time:.2f} s")
+        print(f" - current procedure  : {new_time:.2f} s")
+        print(f" - speedup            : {reference_time / new_time:.1f}x")
+        print(f" - {len(common_files)} common files are byte identical")
+    finally:
+        shutil.rmtree(folder)
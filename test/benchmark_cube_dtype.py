@@ -0,0 +1,69 @@
+import timeit
+
+import numpy as np
+
+from cube_cache import CubeCache
+from discretization import RelativeCubeRepresentation
+from settings import LENGTH_CUBE_SIDE, CUBE_DTYPES, BATCH_SIZE_DEFAULT, NB_NEG_EX_PER_POS, PERCENT_TRAIN
+
+NB_PROTEIN_ATOMS = 3000
+NB_LIGAND_ATOMS = 30
+NB_SYSTEMS = 3000
+NB_CACHED_BATCHES = 50
+
+# The examples of a full training set: the positive examples and `NB_NEG_EX_PER_POS` negatives examples for each
+NB_TRAINING_EXAMPLES = int(NB_SYSTEMS * PERCENT_TRAIN) * (1 + NB_NEG_EX_PER_POS)
+
+
+def make_system(random_state):
+    """
+    Make a synthetic system of a protein and a ligand.
+    """
+    system = np.zeros((NB_PROTEIN_ATOMS + NB_LIGAND_ATOMS, 7), dtype=np.float32)
+    system[:, 0:3] = random_state.uniform(-30, 30, size=(len(system), 3))
+    system[:, 3] = random_state.randint(0, 2, len(system))
+    system[:, 4] = 1 - system[:, 3]
+    system[:NB_PROTEIN_ATOMS, 5] = 1
+    system[NB_PROTEIN_ATOMS:, 6] = 1
+    return system
+
+
+def benchmark(cube_dtype, systems):
+    """
+    Print the memory and the timings of batches of cubes of a type, made or read from a cache and given to a model.
+    """
+    representation = RelativeCubeRepresentation(LENGTH_CUBE_SIDE, cube_dtype=cube_dtype)
+    cubes = representation.make_cubes(systems)
+    batch_bytes = cubes.nbytes
+
+    make_time = min(timeit.repeat(lambda: representation.make_cubes(systems), number=3, repeat=5)) / 3
+    cast_time = min(timeit.repeat(lambda: cubes.astype(np.float32, copy=False), number=10, repeat=5)) / 10
+
+    # Batches read from a cache holding all the cubes in memory
+    cube_cache = CubeCache(ram_budget=NB_CACHED_BATCHES * batch_bytes)
+    keys = [str(index) for index in range(NB_CACHED_BATCHES * len(systems))]
+    for index, key in enumerate(keys):
+        cube_cache.put(key, cubes[index % len(systems)].copy())
+
+    def read_epoch():
+        for first_index in range(0, len(keys), len(systems)):
+            batch = np.array([cube_cache.get(key) for key in keys[first_index:first_index + len(systems)]])
+            batch.astype(np.float32, copy=False)
+
+    epoch_time = min(timeit.repeat(read_epoch, number=1, repeat=3)) / NB_CACHED_BATCHES
+
+    print(f"{cube_dtype} cubes")
+    print(f" - batch of {len(systems)}         : {batch_bytes / 2 ** 20:.2f} MiB")
+    print(f" - full training set   : {NB_TRAINING_EXAMPLES * batch_bytes / len(systems) / 2 ** 30:.2f} GiB "
+          f"({NB_TRAINING_EXAMPLES} cubes)")
+    print(f" - making a batch      : {1000 * make_time:.2f} ms")
+    print(f" - cast for the model  : {1000 * cast_time:.2f} ms")
+    print(f" - cached batch        : {1000 * epoch_time:.2f} ms (read from the cache and cast)")
+
+
+if __name__ == "__main__":
+    random_state = np.random.RandomState(1337)
+    systems = [make_system(random_state) for _ in range(BATCH_SIZE_DEFAULT)]
+
+    for cube_dtype in CUBE_DTYPES:
+        benchmark(cube_dtype, systems)
@@ -0,0 +1,241 @@
+import timeit
+
+import numpy as np
+
+from discretization import AbsoluteCubeRepresentation, RelativeCubeRepresentation, ProteinAnchoredCubeRepresentation, \
+    PocketCubeRepresentation, ContactFingerprintRepresentation
+from settings import LENGTH_CUBE_SIDE, INDICES_FEATURES
+
+NB_PROTEIN_ATOMS = 3000
+NB_LIGAND_ATOMS = 30
+NB_REPEATS = 20
+NB_SCREENED_LIGANDS = 300
+NB_LARGE_PROTEIN_ATOMS = 30000
+
+
+class AbsoluteCubeRepresentationReference(AbsoluteCubeRepresentation):
+    """
+    The previous filling of absolute cubes, atom per atom, used as a reference.
+    """
+
+    def make_cube(self, system):
+        coords = system[:, 0:3]
+        if self._use_rotation_invariance:
+            is_from_protein_indices = np.where(system[:, INDICES_FEATURES["is_from_protein"]] == 1.)
+            coords = self._representation_invariance(coords, is_from_protein_indices)
+        atom_features = system[:, 3:]
+
+        centered_coords = coords - np.mean(coords, axis=0)
+        translation_distance = float(LENGTH_CUBE_SIDE) / 2 * self._cube_resolution
+        scaled_coords = ((centered_coords + translation_distance) / self._cube_resolution).round().astype(int)
+
+        in_box = ((scaled_coords >= 0) & (scaled_coords < LENGTH_CUBE_SIDE)).all(axis=1)
+        cube = np.zeros((LENGTH_CUBE_SIDE,) * 3 + (atom_features.shape[1],), dtype=np.float32)
+        for (x, y, z), f in zip(scaled_coords[in_box], atom_features[in_box]):
+            cube[x, y, z] += f
+
+        return cube
+
+
+class RelativeCubeRepresentationReference(RelativeCubeRepresentation):
+    """
+    The previous scaling and filling of relative cubes, atom per atom, used as a reference.
+    """
+
+    def make_cube(self, system):
+        coords = system[:, 0:3]
+        if self._use_rotation_invariance:
+            is_from_protein_indices = np.where(system[:, INDICES_FEATURES["is_from_protein"]] == 1.)
+            coords = self._representation_invariance(coords, is_from_protein_indices)
+        atom_features = system[:, 3:]
+
+        x_min, y_min, z_min = [np.min(coords[:, i]) for i in range(3)]
+        x_max, y_max, z_max = [np.max(coords[:, i]) for i in range(3)]
+        x_range, y_range, z_range = x_max - x_min, y_max - y_min, z_max - z_min
+        if self._keep_proportions:
+            x_range = y_range = z_range = max([x_range, y_range, z_range])
+
+        scaled_coords = (coords * 0).astype(int)
+        eps = 10e-4
+        scaled_coords[:, 0] = np.floor((coords[:, 0] - x_min) / (x_range + eps) * LENGTH_CUBE_SIDE).astype(int)
+        scaled_coords[:, 1] = np.floor((coords[:, 1] - y_min) / (y_range + eps) * LENGTH_CUBE_SIDE).astype(int)
+        scaled_coords[:, 2] = np.floor((coords[:, 2] - z_min) / (z_range + eps) * LENGTH_CUBE_SIDE).astype(int)
+
+        cube = np.zeros((LENGTH_CUBE_SIDE, LENGTH_CUBE_SIDE, LENGTH_CUBE_SIDE, atom_features.shape[1]))
+        for (x, y, z), f in zip(scaled_coords, atom_features):
+            cube[x, y, z] += f
+
+        return cube
+
+
+def make_system(random_state):
+    """
+    Make a synthetic system of a protein and a ligand.
+    """
+    system = np.zeros((NB_PROTEIN_ATOMS + NB_LIGAND_ATOMS, 7), dtype=np.float32)
+    system[:, 0:3] = random_state.uniform(-30, 30, size=(len(system), 3))
+    system[:, 3] = random_state.randint(0, 2, len(system))
+    system[:, 4] = 1 - system[:, 3]
+    system[:NB_PROTEIN_ATOMS, 5] = 1
+    system[NB_PROTEIN_ATOMS:, 6] = 1
+    return system
+
+
+def benchmark(representation, reference_representation, systems):
+    """
+    Check that both representations give the same cubes and print their timings per cube.
+    """
+    for system in systems:
+        cube = representation.make_cube(system.copy())
+        reference_cube = reference_representation.make_cube(system.copy())
+        np.testing.assert_array_equal(cube, reference_cube)
+
+    reference_time = min(timeit.repeat(lambda: [reference_representation.make_cube(system) for system in systems],
+                                       number=1, repeat=3)) / len(systems)
+    new_time = min(timeit.repeat(lambda: [representation.make_cube(system) for system in systems],
+                                 number=1, repeat=3)) / len(systems)
+    batch_time = min(timeit.repeat(lambda: representation.make_cubes(systems), number=1, repeat=3)) / len(systems)
+    np.testing.assert_array_equal(representation.make_cubes(systems),
+                                  [representation.make_cube(system.copy()) for system in systems])
+
+    print(f"{representation.name} cubes ({NB_PROTEIN_ATOMS + NB_LIGAND_ATOMS} atoms, "
+          f"rotation invariance: {representation._use_rotation_invariance})")
+    print(f" - loop filling   : {1000 * reference_time:.2f} ms per cube")
+    print(f" - scatter        : {1000 * new_time:.2f} ms per cube")
+    print(f" - speedup        : {reference_time / new_time:.1f}x")
+    print(f" - batched        : {1000 * batch_time:.2f} ms per cube ({reference_time / batch_time:.1f}x)")
+
+
+def benchmark_screening(systems):
+    """
+    Print the timings of the cubes of a protein with many ligands, made system per system or from the grid of
+    the protein.
+    """
+    protein = systems[0][:NB_PROTEIN_ATOMS]
+    ligands = [systems[index % len(systems)][NB_PROTEIN_ATOMS:] for index in range(NB_SCREENED_LIGANDS)]
+
+    representation = ProteinAnchoredCubeRepresentation(LENGTH_CUBE_SIDE)
+    screened_systems = [np.concatenate((protein, ligand)) for ligand in ligands]
+
+    absolute_time = min(timeit.repeat(
+        lambda: AbsoluteCubeRepresentation(LENGTH_CUBE_SIDE).make_cubes(screened_systems), number=1, repeat=3))
+    systems_time = min(timeit.repeat(lambda: representation.make_cubes(screened_systems), number=1, repeat=3))
+    pairs_time = min(timeit.repeat(lambda: [ProteinAnchoredCubeRepresentation(LENGTH_CUBE_SIDE)
+                                            .make_pair_cubes("protein", protein, ligands)], number=1, repeat=3))
+
+    print(f"Screening of {NB_SCREENED_LIGANDS} ligands ({NB_LIGAND_ATOMS} atoms) "
+          f"against a protein ({NB_PROTEIN_ATOMS} atoms)")
+    print(f" - absolute cubes          : {1000 * absolute_time:.1f} ms")
+    print(f" - protein-anchored cubes  : {1000 * systems_time:.1f} ms")
+    print(f" - cached protein grid     : {1000 * pairs_time:.1f} ms ({systems_time / pairs_time:.1f}x)")
+
+
+def benchmark_pockets(random_state):
+    """
+    Print the timings of the cubes of ligands around a protein, made with all the atoms of the protein or only with
+    the ones of their pockets.
+    """
+    # A protein filling a sphere and compact ligands near its surface
+    directions = random_state.normal(size=(NB_LARGE_PROTEIN_ATOMS, 3))
+    radii = 40 * random_state.uniform(0, 1, size=(NB_LARGE_PROTEIN_ATOMS, 1)) ** (1 / 3)
+    protein = make_system(random_state)[:1].repeat(NB_LARGE_PROTEIN_ATOMS, axis=0)
+    protein[:, 0:3] = directions / np.linalg.norm(directions, axis=1, keepdims=True) * radii
+    protein[:, 3] = random_state.randint(0, 2, len(protein))
+    protein[:, 4] = 1 - protein[:, 3]
+
+    ligands = []
+    for _ in range(NB_SCREENED_LIGANDS):
+        ligand = make_system(random_state)[NB_PROTEIN_ATOMS:]
+        direction = random_state.normal(size=3)
+        ligand[:, 0:3] = random_state.uniform(-4, 4, size=(len(ligand), 3)) + 35 * direction / np.linalg.norm(direction)
+        ligands.append(ligand)
+    systems = [np.concatenate((protein, ligand)) for ligand in ligands]
+
+    for use_rotation_invariance in [True, False]:
+        absolute_representation = AbsoluteCubeRepresentation(LENGTH_CUBE_SIDE, cube_resolution=1.,
+                                                             use_rotation_invariance=use_rotation_invariance)
+        representation = PocketCubeRepresentation(LENGTH_CUBE_SIDE, use_rotation_invariance=use_rotation_invariance)
+
+        absolute_time = min(timeit.repeat(lambda: absolute_representation.make_cubes(systems), number=1, repeat=3))
+        pockets_time = min(timeit.repeat(lambda: representation.make_cubes(systems), number=1, repeat=3))
+        trees_time = min(timeit.repeat(lambda: [PocketCubeRepresentation(
+            LENGTH_CUBE_SIDE, use_rotation_invariance=use_rotation_invariance).make_pair_cubes(
+            "protein", protein, ligands)], number=1, repeat=3))
+        np.testing.assert_array_equal(representation.make_pair_cubes("protein", protein, ligands),
+                                      representation.make_cubes(systems))
+
+        print(f"Cubes of {NB_SCREENED_LIGANDS} ligands ({NB_LIGAND_ATOMS} atoms) around a protein "
+              f"({NB_LARGE_PROTEIN_ATOMS} atoms), rotation invariance: {use_rotation_invariance}")
+        print(f" - absolute cubes          : {1000 * absolute_time / len(ligands):.2f} ms per cube")
+        print(f" - pocket cubes            : {1000 * pockets_time / len(ligands):.2f} ms per cube "
+              f"({absolute_time / pockets_time:.1f}x)")
+        print(f" - KD-tree of the protein  : {1000 * trees_time / len(ligands):.2f} ms per cube "
+              f"({absolute_time / trees_time:.1f}x)")
+
+
+def benchmark_densities(systems):
+    """
+    Print the timings of batches of cubes counting atoms in their nearest voxel or holding their densities.
+    """
+    for representation_class in [RelativeCubeRepresentation, AbsoluteCubeRepresentation]:
+        for length_cube_side in [LENGTH_CUBE_SIDE, 12]:
+            nearest_time = min(timeit.repeat(lambda: representation_class(length_cube_side).make_cubes(systems),
+                                             number=1, repeat=3)) / len(systems)
+
+            print(f"{representation_class.name} cubes of {length_cube_side}³ voxels "
+                  f"({NB_PROTEIN_ATOMS + NB_LIGAND_ATOMS} atoms)")
+            print(f" - nearest voxel      : {1000 * nearest_time:.2f} ms per cube")
+            for density_sigma in [0.5, 1.]:
+                representation = representation_class(length_cube_side, density_sigma=density_sigma)
+                density_time = min(timeit.repeat(lambda: representation.make_cubes(systems),
+                                                 number=1, repeat=3)) / len(systems)
+                print(f" - density (sigma {density_sigma}) : {1000 * density_time:.2f} ms per cube "
+                      f"({density_time / nearest_time:.1f}x)")
+
+
+def benchmark_fingerprints(systems):
+    """
+    Print the timings and the sizes of the cubes and of the contact fingerprints of a protein with many ligands.
+    """
+    protein = systems[0][:NB_PROTEIN_ATOMS]
+    ligands = [systems[index % len(systems)][NB_PROTEIN_ATOMS:].copy() for index in range(NB_SCREENED_LIGANDS)]
+    # Ligands in contact with the protein
+    for ligand in ligands:
+        ligand[:, 0:3] = ligand[:, 0:3] / 10 + protein[len(ligand), 0:3]
+    screened_systems = [np.concatenate((protein, ligand)) for ligand in ligands]
+
+    cubes_time = min(timeit.repeat(lambda: AbsoluteCubeRepresentation(LENGTH_CUBE_SIDE).make_cubes(screened_systems),
+                                   number=1, repeat=3))
+    representation = ContactFingerprintRepresentation()
+    fingerprints_time = min(timeit.repeat(lambda: representation.make_cubes(screened_systems), number=1, repeat=3))
+    pairs_time = min(timeit.repeat(lambda: ContactFingerprintRepresentation().make_pair_cubes("protein", protein,
+                                                                                              ligands),
+                                   number=1, repeat=3))
+
+    print(f"Featurization of {NB_SCREENED_LIGANDS} ligands ({NB_LIGAND_ATOMS} atoms) "
+          f"against a protein ({NB_PROTEIN_ATOMS} atoms)")
+    print(f" - absolute cubes          : {1000 * cubes_time:.1f} ms "
+          f"({np.prod(AbsoluteCubeRepresentation(LENGTH_CUBE_SIDE).get_cube_shape())} values per pair)")
+    print(f" - contact fingerprints    : {1000 * fingerprints_time:.1f} ms "
+          f"({np.prod(representation.get_cube_shape())} values per pair)")
+    print(f" - KD-tree of the protein  : {1000 * pairs_time:.1f} ms ({cubes_time / pairs_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    random_state = np.random.RandomState(1337)
+    systems = [make_system(random_state) for _ in range(NB_REPEATS)]
+
+    for use_rotation_invariance in [True, False]:
+        benchmark(AbsoluteCubeRepresentation(LENGTH_CUBE_SIDE, use_rotation_invariance=use_rotation_invariance),
+                  AbsoluteCubeRepresentationReference(LENGTH_CUBE_SIDE,
+                                                      use_rotation_invariance=use_rotation_invariance),
+                  systems)
+        benchmark(RelativeCubeRepresentation(LENGTH_CUBE_SIDE, use_rotation_invariance=use_rotation_invariance),
+                  RelativeCubeRepresentationReference(LENGTH_CUBE_SIDE,
+                                                      use_rotation_invariance=use_rotation_invariance),
+                  systems)
+
+    benchmark_screening(systems)
+    benchmark_pockets(random_state)
+    benchmark_densities(systems)
+    benchmark_fingerprints(systems)
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import timeit
+from collections import defaultdict
+
+import numpy as np
+
+from molecules_store import make_manifest, save_manifest, load_manifest, pair_name
+from pipeline_fixtures import is_positive, is_negative
+
+NB_SYSTEMS = 300
+
+
+def list_examples_reference(examples_folder):
+    """
+    The previous way to list examples: the folder is listed and the names of files are parsed.
+    """
+    all_files = sorted(file for file in os.listdir(examples_folder) if file.endswith(".csv"))
+    pos_files = list(filter(is_positive, all_files))
+    neg_files = list(filter(is_negative, all_files))
+
+    negatives_pool = defaultdict(list)
+    for neg_file in neg_files:
+        negatives_pool[int(neg_file.split("_")[0])].append(neg_file)
+
+    return pos_files, negatives_pool
+
+
+def list_examples_manifest(examples_folder):
+    """
+    The current way to list examples: the manifest is loaded and grouped per protein.
+    """
+    manifest = load_manifest(examples_folder)
+    is_positive_row = manifest["label"] == 1
+    neg_rows = np.flatnonzero(~is_positive_row)
+    proteins, first_indices = np.unique(manifest["protein"][neg_rows], return_index=True)
+
+    return np.flatnonzero(is_positive_row), dict(zip(proteins.tolist(), np.split(neg_rows, first_indices[1:])))
+
+
+if __name__ == "__main__":
+    folder = tempfile.mkdtemp()
+    try:
+        # All the pairs of systems, as for validation examples, with empty files
+        systems = np.arange(1, NB_SYSTEMS + 1, dtype=np.int32)
+        proteins, ligands = np.repeat(systems, NB_SYSTEMS), np.tile(systems, NB_SYSTEMS)
+        for protein, ligand in zip(proteins, ligands):
+            open(os.path.join(folder, pair_name(protein, ligand)), "w").close()
+        save_manifest(folder, make_manifest(proteins, ligands, 0, 0, 0))
+
+        reference_time = min(timeit.repeat(lambda: list_examples_reference(folder), number=1, repeat=3))
+        manifest_time = min(timeit.repeat(lambda: list_examples_manifest(folder), number=1, repeat=3))
+
+        print(f"Listing {len(proteins)} examples")
+        print(f" - directory listing and names parsing : {1000 * reference_time:.1f} ms")
+        print(f" - manifest                            : {1000 * manifest_time:.1f} ms")
+        print(f" - speedup                             : {reference_time / manifest_time:.1f}x")
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+from extraction_data import read_pdb, read_pdb_predict, build_molecule_features
+from settings import FLOAT_TYPE
+
+NB_LINES = 100000
+NB_REPEATS = 3
+
+
+def read_pdb_per_line(file_name):
+    """
+    The previous parser of `extraction_data.read_pdb`, used as a reference.
+
+    :param file_name: the file to extract data
+    :return: lists of coordinates and atom type for each atom
+    """
+    x_list, y_list, z_list, atom_type_list = list(), list(), list(), list()
+
+    with open(file_name, 'r') as file:
+        for strline in file.readlines():
+            stripped_line = strline.strip()
+            x_list.append(FLOAT_TYPE(stripped_line[30:38].strip()))
+            y_list.append(FLOAT_TYPE(stripped_line[38:46].strip()))
+            z_list.append(FLOAT_TYPE(stripped_line[46:54].strip()))
+            atom_type_list.append(stripped_line[76:].strip())
+
+    return x_list, y_list, z_list, atom_type_list
+
+
+def read_pdb_predict_per_line(file_name):
+    """
+    The previous parser of `extraction_data.read_pdb_predict`, used as a reference.
+
+    :param file_name: the file to extract data
+    :return: lists of coordinates and atom type for each atom
+    """
+    x_list, y_list, z_list, atom_type_list = list(), list(), list(), list()
+
+    with open(file_name, 'r') as file:
+        for strline in file.readlines():
+            splitted_line = strline.strip().split('\t')
+            x_list.append(FLOAT_TYPE(splitted_line[0]))
+            y_list.append(FLOAT_TYPE(splitted_line[1]))
+            z_list.append(FLOAT_TYPE(splitted_line[2]))
+            atom_type_list.append(str(splitted_line[3]))
+
+    return x_list, y_list, z_list, atom_type_list
+
+
+def write_synthetic_files(folder, nb_lines):
+    """
+    Write a synthetic pdb file and a synthetic file for prediction with `nb_lines` atoms.
+
+    :return: the path of both files
+    """
+    random_state = np.random.RandomState(1337)
+    coords = random_state.uniform(-999, 999, size=(nb_lines, 3))
+    atom_types = random_state.choice(["C", "N", "O", "h", "p", "O1-", "CL"], size=nb_lines)
+
+    pdb_file = os.path.join(folder, "0001_pro_cg.pdb")
+    with open(pdb_file, "w") as f:
+        for i, ((x, y, z), atom_type) in enumerate(zip(coords, atom_types)):
+            f.write(f"ATOM  {i % 100000:5d}  CA  HIS A   0    {x:8.3f}{y:8.3f}{z:8.3f}  1.00 26.12"
+                    f"          {atom_type:>2}\n")
+
+    predict_file = os.path.join(folder, "0001_pro_cg_predict.pdb")
+    with open(predict_file, "w") as f:
+        for (x, y, z), atom_type in zip(coords, atom_types):
+            f.write(f"{x:.3f}\t{y:.3f}\t{z:.3f}\t{atom_type}\n")
+
+    return pdb_file, predict_file
+
+
+def benchmark(name, new_parser, reference_parser, file_name):
+    """
+    Check that both parsers give the same molecule and print their timings.
+    """
+    x_list, y_list, z_list, atom_type_list = reference_parser(file_name)
+    coords, atom_types = new_parser(file_name)
+
+    np.testing.assert_array_equal(coords, np.array([x_list, y_list, z_list], dtype=FLOAT_TYPE).T)
+    np.testing.assert_array_equal(build_molecule_features(coords, atom_types, True),
+                                  build_molecule_features(np.array([x_list, y_list, z_list]).T,
+                                                          atom_type_list, True))
+
+    reference_time = min(timeit.repeat(lambda: reference_parser(file_name), number=1, repeat=NB_REPEATS))
+    new_time = min(timeit.repeat(lambda: new_parser(file_name), number=1, repeat=NB_REPEATS))
+
+    print(f"{name} ({NB_LINES} lines)")
+    print(f" - per line parser : {reference_time:.3f} s")
+    print(f" - bulk parser     : {new_time:.3f} s")
+    print(f" - speedup         : {reference_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        pdb_file, predict_file = write_synthetic_files(folder, NB_LINES)
+        benchmark("read_pdb", read_pdb, read_pdb_per_line, pdb_file)
+        benchmark("read_pdb_predict", read_pdb_predict, read_pdb_predict_per_line, predict_file)
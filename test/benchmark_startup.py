@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from create_examples import save_systems_examples
+from extraction_data import _decode_decimals
+from pipeline import STAGES
+
+CODE_FOLDER = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "code"))
+
+HEAVY_MODULES = ["tensorflow", "keras", "sklearn", "matplotlib"]
+
+NB_REPEATS = 3
+
+
+def time_import(module):
+    """
+    Return the time taken by a fresh interpreter to import a module, and the heavy modules it imported.
+    """
+    code = f"import sys, time\n" \
+           f"start = time.time()\n" \
+           f"import {module}\n" \
+           f"print(time.time() - start)\n" \
+           f"print(' '.join(name for name in {HEAVY_MODULES} if name in sys.modules))"
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([CODE_FOLDER, os.environ.get("PYTHONPATH", "")]))
+
+    timings = []
+    for _ in range(NB_REPEATS):
+        output = subprocess.run([sys.executable, "-c", code], env=environment, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True).stdout.decode().split("\n")
+        timings.append(float(output[0]))
+
+    return min(timings), output[1].split()
+
+
+def time_worker(function, args):
+    """
+    Return the time taken to start a worker process with the spawn method and to run a task in it:
+    the module of the task is imported by the worker.
+    """
+    context = multiprocessing.get_context("spawn")
+    timings = []
+    for _ in range(NB_REPEATS):
+        start = time.time()
+        with context.Pool(1) as pool:
+            pool.apply(function, args)
+        timings.append(time.time() - start)
+
+    return min(timings)
+
+
+if __name__ == "__main__":
+    print("Import of the module of each stage (fresh interpreter)")
+    for stage, module in STAGES.items():
+        try:
+            import_time, heavy_modules = time_import(module)
+            print(f" - {stage:16}: {1000 * import_time:8.1f} ms  heavy modules: {', '.join(heavy_modules) or '-'}")
+        except subprocess.CalledProcessError:
+            print(f" - {stage:16}: {module} can't be imported here")
+
+    # Tasks doing nothing: only the start of workers is measured
+    print("Start of a worker process and of an empty task")
+    print(f" - extract         : {1000 * time_worker(_decode_decimals, (np.zeros((0, 8), np.uint8),)):8.1f} ms")
+    print(f" - create-examples : {1000 * time_worker(save_systems_examples, ([], [], '', '')):8.1f} ms")
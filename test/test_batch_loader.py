@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+from code.batch_loader import BatchLoader
+from code.cube_cache import CubeCache
+from code.create_examples import create_examples
+from code.discretization import RelativeCubeRepresentation
+from code.examples_iterator import ExamplesIterator, RotatingNegativesSampler
+from code.molecules_store import PROTEIN, LIGAND
+from code.pipeline_fixtures import save_nparray
+
+
+class BatchLoaderTest(unittest.TestCase):
+    """
+    Testing the loading of batches by worker processes.
+
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        extracted_folder = os.path.join(self.folder, "extracted")
+        self.examples_folder = os.path.join(self.folder, "examples")
+        os.makedirs(extracted_folder)
+
+        random_state = np.random.RandomState(1337)
+        for system in range(1, 21):
+            for kind, suffix in [(PROTEIN, "_pro_cg.npy"), (LIGAND, "_lig_cg.npy")]:
+                nb_atoms = random_state.randint(5, 50)
+                molecule = np.zeros((nb_atoms, 7), dtype=np.float32)
+                molecule[:, 0:3] = random_state.randn(nb_atoms, 3)
+                molecule[:, 3] = random_state.randint(0, 2, nb_atoms)
+                molecule[:, 4] = 1 - molecule[:, 3]
+                molecule[:, 5 + kind] = 1
+                save_nparray(os.path.join(extracted_folder, f"{system:04d}{suffix}"), molecule)
+
+        create_examples(extracted_folder, self.examples_folder, nb_neg=6, virtual=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_batches(self):
+        """
+        Batches of the loader should be the ones of the iterator, epoch after epoch.
+        """
+        for cube_dtype in ["float32", "uint8"]:
+            np.random.seed(1337)
+            examples_iterator = ExamplesIterator(RelativeCubeRepresentation(length_cube_side=20, cube_dtype=cube_dtype),
+                                                 self.examples_folder, batch_size=7, nb_neg=2,
+                                                 negatives_sampler=RotatingNegativesSampler())
+
+            with BatchLoader(examples_iterator, nb_workers=2, prefetch_depth=3) as loader:
+                self.assertEqual(len(loader), len(examples_iterator))
+                for epoch in range(3):
+                    for index in range(len(loader)):
+                        cubes, ys = next(loader)
+                        expected_cubes, expected_ys = examples_iterator[index]
+
+                        # Cubes are given to models as floats
+                        self.assertEqual(cubes.dtype, np.float32)
+                        np.testing.assert_allclose(cubes, expected_cubes, rtol=1e-6)
+                        np.testing.assert_array_equal(ys, expected_ys)
+
+    def test_cube_cache_statistics(self):
+        """
+        The statistics of the caches of the workers should count all the cubes of the batches built.
+        """
+        np.random.seed(1337)
+        examples_iterator = ExamplesIterator(RelativeCubeRepresentation(length_cube_side=20), self.examples_folder,
+                                             batch_size=7, nb_neg=2, cube_cache=CubeCache())
+
+        with BatchLoader(examples_iterator, nb_workers=2, prefetch_depth=3) as loader:
+            for _ in range(2 * len(loader)):
+                next(loader)
+            statistics = loader.get_cube_cache_statistics()
+
+        self.assertEqual(len(statistics), 2)
+        nb_requests = sum(worker_statistics["ram_hits"] + worker_statistics["disk_hits"] + worker_statistics["misses"]
+                          for worker_statistics in statistics if worker_statistics is not None)
+        self.assertEqual(nb_requests, 2 * examples_iterator.get_nb_examples())
+
+        # The cache of the training process is not used
+        self.assertEqual(examples_iterator.get_cube_cache().get_statistics()["misses"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import warnings
+warnings.simplefilter("ignore")
+
+from code.callbacks import EarlyStoppingCallback
+
+
+class FakeModel:
+    """
+    A model whose weights are the index of the last epoch done.
+
+    """
+
+    def __init__(self):
+        self.weights = None
+        self.stop_training = False
+
+    def get_weights(self):
+        return self.weights
+
+    def set_weights(self, weights):
+        self.weights = weights
+
+
+class EarlyStoppingCallbackTest(unittest.TestCase):
+    """
+    Testing the early stopping of training.
+
+    """
+
+    def run_epochs(self, callback, values, monitor):
+        model = FakeModel()
+        callback.set_model(model)
+        for epoch, value in enumerate(values):
+            model.weights = epoch
+            callback.on_epoch_end(epoch, {monitor: value})
+            if model.stop_training:
+                break
+        callback.on_train_end()
+
+        return model, epoch
+
+    def test_loss(self):
+        """
+        Training should stop after `patience` epochs without a smaller loss, keeping the weights of the best epoch.
+        """
+        callback = EarlyStoppingCallback("val_loss", patience=2)
+        model, last_epoch = self.run_epochs(callback, [0.9, 0.5, 0.6, 0.4, 0.45, 0.41, 0.3], "val_loss")
+
+        self.assertEqual(last_epoch, 5)
+        self.assertEqual(callback.get_kept_epoch(), 3)
+        self.assertEqual(model.weights, 3)
+
+    def test_score(self):
+        """
+        Other metrics than losses should be maximized.
+        """
+        callback = EarlyStoppingCallback("val_f1", patience=3)
+        model, last_epoch = self.run_epochs(callback, [0.1, 0.5, 0.4, 0.6, 0.7], "val_f1")
+
+        self.assertEqual(last_epoch, 4)
+        self.assertEqual(callback.get_kept_epoch(), 4)
+        self.assertEqual(model.weights, 4)
+
+    def test_resume(self):
+        """
+        A callback resumed from the state of another one should stop at the same epoch.
+        """
+        values = [0.9, 0.5, 0.6, 0.4, 0.45, 0.41, 0.3]
+        callback = EarlyStoppingCallback("val_loss", patience=2)
+        self.run_epochs(callback, values[0:5], "val_loss")
+
+        resumed_callback = EarlyStoppingCallback("val_loss", patience=2)
+        resumed_callback.set_state(callback.get_state())
+        model = FakeModel()
+        resumed_callback.set_model(model)
+        model.weights = 5
+        resumed_callback.on_epoch_end(5, {"val_loss": values[5]})
+
+        self.assertTrue(model.stop_training)
+        self.assertEqual(resumed_callback.get_kept_epoch(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
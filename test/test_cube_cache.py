@@ -0,0 +1,109 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+from code import cube_cache
+from code.cube_cache import CubeCache
+from code.discretization import RelativeCubeRepresentation, AbsoluteCubeRepresentation
+
+
+class CubeCacheTest(unittest.TestCase):
+    """
+    Testing the cache of cubes.
+
+    """
+
+    def setUp(self):
+        self.spill_folder = tempfile.mkdtemp()
+        self.cubes = {f"{system:04d}": np.full((2, 2, 2, 4), system, dtype=np.float32) for system in range(1, 6)}
+        self.cube_nbytes = self.cubes["0001"].nbytes
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_folder)
+
+    def test_keys(self):
+        """
+        Keys should depend on the folder, the example, all the parameters of the representation and the version.
+        """
+        relative = RelativeCubeRepresentation(length_cube_side=20)
+        keys = {CubeCache.make_key("examples", "0001_0001.csv", relative),
+                CubeCache.make_key("other_examples", "0001_0001.csv", relative),
+                CubeCache.make_key("examples", "0001_0002.csv", relative),
+                CubeCache.make_key("examples", "0001_0001.csv", RelativeCubeRepresentation(length_cube_side=16)),
+                CubeCache.make_key("examples", "0001_0001.csv", RelativeCubeRepresentation(20, translate_ligand=True)),
+                CubeCache.make_key("examples", "0001_0001.csv", AbsoluteCubeRepresentation(length_cube_side=20)),
+                CubeCache.make_key("examples", "0001_0001.csv", AbsoluteCubeRepresentation(20, cube_resolution=1.)),
+                CubeCache.make_key("examples", "0001_0001.csv", RelativeCubeRepresentation(20, cube_dtype="uint8")),
+                CubeCache.make_key("examples", "0001_0001.csv", RelativeCubeRepresentation(20, density_sigma=0.5))}
+
+        self.assertEqual(len(keys), 9)
+        self.assertEqual(CubeCache.make_key("examples", "0001_0001.csv", relative),
+                         CubeCache.make_key("examples", "0001_0001.csv", RelativeCubeRepresentation(20)))
+
+        version = cube_cache.CUBE_CACHE_FORMAT_VERSION
+        try:
+            cube_cache.CUBE_CACHE_FORMAT_VERSION = version + 1
+            self.assertNotIn(CubeCache.make_key("examples", "0001_0001.csv", relative), keys)
+        finally:
+            cube_cache.CUBE_CACHE_FORMAT_VERSION = version
+
+    def test_memory_tier(self):
+        """
+        The least recently used cubes should be evicted once the budget is exceeded.
+        """
+        cache = CubeCache(ram_budget=3 * self.cube_nbytes)
+        for key, cube in self.cubes.items():
+            cache.put(key, cube)
+        cache.get("0003")
+        cache.put("0006", self.cubes["0001"])
+
+        self.assertIsNone(cache.get("0001"))
+        self.assertIsNone(cache.get("0004"))
+        np.testing.assert_array_equal(cache.get("0003"), self.cubes["0003"])
+        np.testing.assert_array_equal(cache.get("0005"), self.cubes["0005"])
+
+        statistics = cache.get_statistics()
+        self.assertEqual((statistics["ram_hits"], statistics["disk_hits"], statistics["misses"]), (3, 0, 2))
+        self.assertEqual(statistics["nb_bytes_in_ram"], 3 * self.cube_nbytes)
+
+    def test_disk_tier(self):
+        """
+        Cubes evicted from memory should be read back from the disk tier.
+        """
+        cache = CubeCache(ram_budget=2 * self.cube_nbytes, spill_folder=self.spill_folder)
+        for key, cube in self.cubes.items():
+            cache.put(key, cube)
+
+        for key, cube in self.cubes.items():
+            np.testing.assert_array_equal(cache.get(key), cube)
+
+        statistics = cache.get_statistics()
+        self.assertEqual(statistics["misses"], 0)
+        self.assertGreater(statistics["disk_hits"], 0)
+
+        # Another process would find them as well
+        other_cache = CubeCache(ram_budget=2 * self.cube_nbytes, spill_folder=self.spill_folder)
+        np.testing.assert_array_equal(other_cache.get("0001"), self.cubes["0001"])
+
+    def test_get_or_make(self):
+        """
+        A cube should only be made when it is missing.
+        """
+        cache = CubeCache()
+        nb_calls = []
+
+        def make_cube():
+            nb_calls.append(1)
+            return self.cubes["0001"]
+
+        for _ in range(3):
+            np.testing.assert_array_equal(cache.get_or_make("0001", make_cube), self.cubes["0001"])
+
+        self.assertEqual(len(nb_calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+import unittest
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+from code.discretization import AbsoluteCubeRepresentation, RelativeCubeRepresentation, \
+    ProteinAnchoredCubeRepresentation, PocketCubeRepresentation, ContactFingerprintRepresentation, \
+    get_representation, get_job_representation
+from code.settings import LENGTH_CUBE_SIDE
+
+
+class DiscretizationTest(unittest.TestCase):
+    """
+    Testing the making of cubes.
+
+    """
+
+    def setUp(self):
+        random_state = np.random.RandomState(1337)
+        self.system = np.zeros((200, 7), dtype=np.float32)
+        self.system[:, 0:3] = random_state.uniform(-20, 20, size=(200, 3))
+        self.system[:, 3] = random_state.randint(0, 2, 200)
+        self.system[:, 4] = 1 - self.system[:, 3]
+        self.system[:180, 5] = 1
+        self.system[180:, 6] = 1
+
+    def test_features_are_summed(self):
+        """
+        All the features of the atoms should be in the cube, summed when atoms are in the same voxel.
+        """
+        # Atoms at the same position
+        self.system[1:4, 0:3] = self.system[0, 0:3]
+
+        for representation in [RelativeCubeRepresentation(LENGTH_CUBE_SIDE),
+                               AbsoluteCubeRepresentation(LENGTH_CUBE_SIDE, cube_resolution=4.)]:
+            cube = representation.make_cube(self.system.copy())
+
+            self.assertEqual(cube.shape, (LENGTH_CUBE_SIDE,) * 3 + (4,))
+            np.testing.assert_array_equal(cube.sum(axis=(0, 1, 2)), self.system[:, 3:].sum(axis=0))
+            self.assertGreaterEqual(cube.max(), 4)
+
+    def test_make_cubes(self):
+        """
+        Cubes made at once for several systems should be the ones made system per system.
+        """
+        random_state = np.random.RandomState(42)
+        systems = [self.system, self.system[random_state.permutation(len(self.system))][:50], self.system[:181]]
+
+        for use_rotation_invariance in [True, False]:
+            for representation in [RelativeCubeRepresentation(LENGTH_CUBE_SIDE,
+                                                              use_rotation_invariance=use_rotation_invariance),
+                                   AbsoluteCubeRepresentation(LENGTH_CUBE_SIDE, cube_resolution=4.,
+                                                              use_rotation_invariance=use_rotation_invariance)]:
+                cubes = representation.make_cubes(systems)
+
+                self.assertEqual(cubes.shape, (len(systems),) + (LENGTH_CUBE_SIDE,) * 3 + (4,))
+                for cube, system in zip(cubes, systems):
+                    np.testing.assert_array_equal(cube, representation.make_cube(system.copy()))
+
+        self.assertEqual(len(RelativeCubeRepresentation(LENGTH_CUBE_SIDE).make_cubes([])), 0)
+
+    def test_protein_anchored_pairs(self):
+        """
+        Cubes of pairs made from the cached grid of a protein should be the cubes of their systems.
+        """
+        protein = self.system[:180]
+        random_state = np.random.RandomState(42)
+        ligands = [self.system[180:], self.system[180:] + np.array([5., -3., 2., 0, 0, 0, 0], dtype=np.float32),
+                   self.system[random_state.permutation(20) + 180][:7]]
+
+        for use_rotation_invariance in [True, False]:
+            for translate_ligand in [True, False]:
+                representation = ProteinAnchoredCubeRepresentation(LENGTH_CUBE_SIDE, cube_resolution=2.,
+                                                                   use_rotation_invariance=use_rotation_invariance,
+                                                                   translate_ligand=translate_ligand)
+                systems = [np.concatenate((protein, ligand)) for ligand in ligands]
+                cubes = [representation.make_cube(system) for system in systems]
+
+                for cube, ligand in zip(cubes, ligands):
+                    np.testing.assert_array_equal(representation.make_pair_cube("protein", protein, ligand), cube)
+                np.testing.assert_array_equal(representation.make_pair_cubes("protein", protein, ligands), cubes)
+                np.testing.assert_array_equal(representation.make_cubes(systems), cubes)
+
+                # The grid of the protein is made once
+                self.assertIs(representation.get_protein_grid("protein", None),
+                              representation.get_protein_grid("protein", protein))
+
+    def test_rotation_frame(self):
+        """
+        Cubes of rotation invariant representations should be made in the canonical frame models have been trained
+        with: the axes given by `np.linalg.eig` for the covariance of the coordinates of the protein.
+        """
+        protein_coords = self.system[self.system[:, 5] == 1, 0:3]
+        _, rotation_mat = np.linalg.eig(np.cov((protein_coords - np.mean(protein_coords, axis=0)).T))
+        rotated_system = self.system.astype(np.float64)
+        rotated_system[:, 0:3] = self.system[:, 0:3].dot(rotation_mat)
+
+        for representation_class, parameters in [(RelativeCubeRepresentation, dict()),
+                                                 (AbsoluteCubeRepresentation, dict(cube_resolution=2.))]:
+            representation = representation_class(LENGTH_CUBE_SIDE, **parameters)
+            expected_cube = representation_class(LENGTH_CUBE_SIDE, use_rotation_invariance=False,
+                                                 **parameters).make_cube(rotated_system)
+
+            np.testing.assert_array_equal(representation.make_cube(self.system), expected_cube)
+            np.testing.assert_array_equal(representation.make_cubes([self.system, self.system]),
+                                          [expected_cube, expected_cube])
+
+    def test_pocket(self):
+        """
+        Cubes of pockets should hold the atoms around the ligand, whether the pocket is found with the KD-tree
+        of the protein or not.
+        """
+        protein = self.system[:180]
+        random_state = np.random.RandomState(42)
+        ligands = [self.system[180:], self.system[180:] + np.array([5., -3., 2., 0, 0, 0, 0], dtype=np.float32),
+                   self.system[random_state.permutation(20) + 180][:7]]
+        systems = [np.concatenate((protein, ligand)) for ligand in ligands]
+
+        # Without rotation, the cube is the one of an absolute representation centered on the ligand
+        representation = PocketCubeRepresentation(8, cube_resolution=2., use_rotation_invariance=False)
+        absolute_representation = AbsoluteCubeRepresentation(8, cube_resolution=2., use_rotation_invariance=False)
+        for system, ligand in zip(systems, ligands):
+            # Atoms without features, mirroring the system around the center of the ligand to center it there
+            far_atoms = np.repeat(ligand[:1], len(system), axis=0)
+            far_atoms[:, 0:3] = 2 * np.mean(ligand[:, 0:3], axis=0) - system[:, 0:3]
+            far_atoms[:, 3:] = 0
+            np.testing.assert_array_equal(representation.make_cube(system),
+                                          absolute_representation.make_cube(np.concatenate((system, far_atoms))))
+
+        for use_rotation_invariance in [True, False]:
+            for cube_resolution in [1., 4.]:
+                representation = PocketCubeRepresentation(LENGTH_CUBE_SIDE, cube_resolution=cube_resolution,
+                                                          use_rotation_invariance=use_rotation_invariance)
+                cubes = [representation.make_cube(system) for system in systems]
+
+                for cube, ligand in zip(cubes, ligands):
+                    np.testing.assert_array_equal(representation.make_pair_cube("protein", protein, ligand), cube)
+                np.testing.assert_array_equal(representation.make_pair_cubes("protein", protein, ligands), cubes)
+                np.testing.assert_array_equal(representation.make_cubes(systems), cubes)
+
+                # The KD-tree of the protein is built once
+                self.assertIs(representation.get_protein_tree("protein", None),
+                              representation.get_protein_tree("protein", protein))
+                # Without its id, the KD-tree of the protein of systems is kept under a hash of its atoms
+                protein_key = representation._protein_key(protein)
+                self.assertIs(representation.get_protein_tree(protein_key, None),
+                              representation.get_protein_tree(protein_key, protein))
+
+    def test_contact_fingerprint(self):
+        """
+        Fingerprints should be the histograms of the distances of the atoms in contact per pair of types of atoms,
+        whether contacts are found with the KD-tree of the protein or not.
+        """
+        representation = ContactFingerprintRepresentation(cutoff=8., nb_bins=4)
+        protein, ligand = self.system[:180], self.system[180:]
+
+        fingerprint = representation.make_cube(self.system)
+        self.assertEqual(fingerprint.shape, representation.get_cube_shape())
+        self.assertEqual(representation.get_cube_shape(), (16,))
+
+        distances = np.linalg.norm(protein[:, None, 0:3] - ligand[None, :, 0:3], axis=2)
+        expected_fingerprint = np.zeros((2, 2, 4))
+        for protein_type in range(2):
+            for ligand_type in range(2):
+                in_contact = (protein[:, None, 3 + protein_type] * ligand[None, :, 3 + ligand_type] == 1) \
+                             & (distances <= 8.)
+                expected_fingerprint[protein_type, ligand_type] = np.histogram(distances[in_contact], bins=4,
+                                                                               range=(0., 8.))[0]
+        np.testing.assert_array_equal(fingerprint, expected_fingerprint.reshape(-1))
+
+        ligands = [ligand, ligand[:5], ligand + np.array([5., -3., 2., 0, 0, 0, 0], dtype=np.float32)]
+        fingerprints = representation.make_cubes([np.concatenate((protein, ligand)) for ligand in ligands])
+        np.testing.assert_array_equal(fingerprints[0], fingerprint)
+        np.testing.assert_array_equal(representation.make_pair_cubes("protein", protein, ligands), fingerprints)
+        np.testing.assert_array_equal(representation.make_pair_cube("protein", protein, ligands[1]), fingerprints[1])
+
+        # A ligand far from the protein has no contacts
+        far_ligand = ligand + np.array([100., 0, 0, 0, 0, 0, 0], dtype=np.float32)
+        np.testing.assert_array_equal(representation.make_cube(np.concatenate((protein, far_ligand))), 0)
+        np.testing.assert_array_equal(representation.make_pair_cube("protein", protein, far_ligand), 0)
+        np.testing.assert_array_equal(representation.make_cubes([self.system, np.concatenate((protein, far_ligand))]),
+                                      [fingerprint, np.zeros_like(fingerprint)])
+
+        self.assertEqual(get_representation("contact_fingerprint").get_parameters(),
+                         ContactFingerprintRepresentation().get_parameters())
+        with self.assertRaises(ValueError):
+            get_representation("contact_fingerprint", cube_resolution=2.)
+
+    def test_cube_dtypes(self):
+        """
+        Cubes of compact types should have the counts of float cubes, saturated for integer types.
+        """
+        # More than 255 atoms at the same position
+        crowded_system = np.concatenate((self.system, np.repeat(self.system[-1:], 300, axis=0)))
+
+        for representation_class in [RelativeCubeRepresentation, AbsoluteCubeRepresentation,
+                                     ProteinAnchoredCubeRepresentation, PocketCubeRepresentation]:
+            cube = representation_class(LENGTH_CUBE_SIDE).make_cube(self.system)
+            cubes = representation_class(LENGTH_CUBE_SIDE).make_cubes([crowded_system, self.system])
+            self.assertGreater(cubes.max(), 255)
+
+            for cube_dtype in ["float16", "uint8"]:
+                representation = representation_class(LENGTH_CUBE_SIDE, cube_dtype=cube_dtype)
+                self.assertEqual(representation.get_parameters()["cube_dtype"], cube_dtype)
+
+                compact_cube = representation.make_cube(self.system)
+                self.assertEqual(compact_cube.dtype, np.dtype(cube_dtype))
+                np.testing.assert_array_equal(compact_cube, cube)
+
+                compact_cubes = representation.make_cubes([crowded_system, self.system])
+                self.assertEqual(compact_cubes.dtype, np.dtype(cube_dtype))
+                np.testing.assert_array_equal(compact_cubes,
+                                              np.minimum(cubes, 255) if cube_dtype == "uint8" else cubes)
+
+    def test_densities(self):
+        """
+        Cubes of densities should spread the features of each atom over the voxels around it, with the same totals,
+        whatever the way they are made.
+        """
+        representations = [RelativeCubeRepresentation(LENGTH_CUBE_SIDE, density_sigma=0.7),
+                           AbsoluteCubeRepresentation(LENGTH_CUBE_SIDE, cube_resolution=4., density_sigma=0.7),
+                           ProteinAnchoredCubeRepresentation(LENGTH_CUBE_SIDE, cube_resolution=4., density_sigma=0.7),
+                           PocketCubeRepresentation(LENGTH_CUBE_SIDE, cube_resolution=4., density_sigma=0.7)]
+
+        protein, ligand = self.system[:180], self.system[180:]
+        systems = [self.system, np.concatenate((protein[:90], ligand[:5]))]
+
+        for representation in representations:
+            self.assertEqual(representation.get_parameters()["density_sigma"], 0.7)
+
+            cubes = representation.make_cubes(systems)
+            for cube, system in zip(cubes, systems):
+                np.testing.assert_allclose(cube, representation.make_cube(system), rtol=1e-5, atol=1e-6)
+
+            # Atoms are spread over several voxels
+            self.assertGreater(np.count_nonzero(cubes[0]), np.count_nonzero(
+                representation.__class__(LENGTH_CUBE_SIDE).make_cube(self.system)))
+
+        # All the atoms are far from the sides of absolute cubes: their features are kept
+        np.testing.assert_allclose(representations[1].make_cube(self.system).sum(axis=(0, 1, 2)),
+                                   self.system[:, 3:].sum(axis=0), rtol=1e-5)
+
+        for representation in representations[2:]:
+            np.testing.assert_allclose(representation.make_pair_cube("protein", protein, ligand),
+                                       representation.make_cube(self.system), rtol=1e-5, atol=1e-6)
+
+        with self.assertRaises(ValueError):
+            RelativeCubeRepresentation(LENGTH_CUBE_SIDE, cube_dtype="uint8", density_sigma=0.7)
+
+    def test_length_cube_side(self):
+        """
+        Cubes should have the number of voxels of their representation.
+        """
+        for representation in [RelativeCubeRepresentation(12),
+                               AbsoluteCubeRepresentation(12, cube_resolution=8.),
+                               ProteinAnchoredCubeRepresentation(12, cube_resolution=8.)]:
+            self.assertEqual(representation.get_cube_shape(), (12, 12, 12, 4))
+
+            cube = representation.make_cube(self.system.copy())
+            self.assertEqual(cube.shape, (12, 12, 12, 4))
+            np.testing.assert_array_equal(cube.sum(axis=(0, 1, 2)), self.system[:, 3:].sum(axis=0))
+
+            np.testing.assert_array_equal(representation.make_cubes([self.system]), [cube])
+
+    def test_job_representation(self):
+        """
+        The representation of a job should be the one described by its parameters, or the default one.
+        """
+        representation = get_job_representation(dict(representation="absolute", length_cube_side="12",
+                                                      cube_resolution="3.0", cube_dtype="uint8"))
+        self.assertEqual(representation.get_parameters(), AbsoluteCubeRepresentation(
+            12, cube_resolution=3., cube_dtype="uint8").get_parameters())
+
+        self.assertEqual(get_job_representation(dict()).get_parameters(),
+                         RelativeCubeRepresentation(LENGTH_CUBE_SIDE).get_parameters())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,5 @@
+import shutil
+import tempfile
 import unittest
 import numpy as np
 import warnings
@@ -8,8 +10,12 @@ from discretization import RelativeCubeRepresentation
 
 warnings.simplefilter("ignore")
 
+from code.create_examples import create_examples
+from code.cube_cache import CubeCache
+from code.discretization import ProteinAnchoredCubeRepresentation, PocketCubeRepresentation
 from code.examples_iterator import ExamplesIterator
-from code.pipeline_fixtures import is_positive
+from code.molecules_store import PROTEIN, LIGAND
+from code.pipeline_fixtures import is_positive, save_nparray
 from code.settings import TRAINING_EXAMPLES_FOLDER, LENGTH_CUBE_SIDE, VALIDATION_EXAMPLES_FOLDER, TESTING_EXAMPLES_FOLDER
 
 
@@ -58,7 +64,7 @@ class ExamplesIteratorTest(unittest.TestCase):
         """
         for folder in self.folders_to_test:
             iterator = ExamplesIterator(representation=self.repr, examples_folder=folder)
-            nb_files_in_folder = len(os.listdir(folder))
+            nb_files_in_folder = len([file for file in os.listdir(folder) if file.endswith(".csv")])
             self.assertEquals(nb_files_in_folder, iterator.get_nb_examples())
             self.assertEquals(len(iterator), int(np.ceil(iterator.get_nb_examples() / iterator.get_batch_size())))
 
@@ -66,3 +72,71 @@ class ExamplesIteratorTest(unittest.TestCase):
             last_batch, _ = iterator[-1]
             self.assertEquals(last_batch.shape[0] % iterator.get_batch_size(), iterator.get_nb_examples() % iterator.get_batch_size())
 
+
+class PairCubesExamplesIteratorTest(unittest.TestCase):
+    """
+    Testing the cubes of batches made protein per protein by the ExamplesIterator.
+
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        extracted_folder = os.path.join(self.folder, "extracted")
+        self.examples_folder = os.path.join(self.folder, "examples")
+        os.makedirs(extracted_folder)
+
+        random_state = np.random.RandomState(1337)
+        for system in range(1, 11):
+            for kind, suffix in [(PROTEIN, "_pro_cg.npy"), (LIGAND, "_lig_cg.npy")]:
+                nb_atoms = random_state.randint(5, 50)
+                molecule = np.zeros((nb_atoms, 7), dtype=np.float32)
+                molecule[:, 0:3] = random_state.randn(nb_atoms, 3) * 5
+                molecule[:, 3] = random_state.randint(0, 2, nb_atoms)
+                molecule[:, 4] = 1 - molecule[:, 3]
+                molecule[:, 5 + kind] = 1
+                save_nparray(os.path.join(extracted_folder, f"{system:04d}{suffix}"), molecule)
+
+        create_examples(extracted_folder, self.examples_folder, nb_neg=4, virtual=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_pair_cubes(self):
+        """
+        Cubes made protein per protein should be the cubes of the systems, in the order of the batch.
+        """
+        for cube_cache in [None, CubeCache()]:
+            representation = ProteinAnchoredCubeRepresentation(length_cube_side=20)
+            np.random.seed(1337)
+            examples_iterator = ExamplesIterator(representation, self.examples_folder, batch_size=16,
+                                                 cube_cache=cube_cache)
+
+            for index in range(len(examples_iterator)):
+                rows = examples_iterator.get_batch_rows(index)
+                examples = examples_iterator.get_manifest()[rows]
+                expected_cubes = representation.make_cubes(examples_iterator._load_examples(examples))
+
+                np.testing.assert_array_equal(examples_iterator.get_cubes(rows), expected_cubes)
+
+            # The grids of the proteins are identified by their ids
+            self.assertIn((self.examples_folder, 1), representation._protein_grids)
+
+    def test_pocket_trees(self):
+        """
+        The KD-trees of the proteins of pockets should be identified by their ids, not by hashes of their atoms.
+        """
+        representation = PocketCubeRepresentation(length_cube_side=20)
+        np.random.seed(1337)
+        examples_iterator = ExamplesIterator(representation, self.examples_folder, batch_size=16)
+
+        for index in range(len(examples_iterator)):
+            rows = examples_iterator.get_batch_rows(index)
+            examples = examples_iterator.get_manifest()[rows]
+            expected_cubes = PocketCubeRepresentation(length_cube_side=20).make_cubes(
+                examples_iterator._load_examples(examples))
+
+            np.testing.assert_array_equal(examples_iterator.get_cubes(rows), expected_cubes)
+
+        self.assertEqual(sorted(representation._protein_trees),
+                         [(self.examples_folder, protein) for protein in range(1, 11)])
+
@@ -1,8 +1,11 @@
+import os
+import tempfile
 import unittest
 import warnings
+import numpy as np
 warnings.simplefilter("ignore")
 
-from code.pipeline_fixtures import is_positive, is_negative, extract_id
+from code.pipeline_fixtures import is_positive, is_negative, extract_id, save_nparray, load_nparray, parse_duration
 
 
 class TestFixtures(unittest.TestCase):
@@ -28,3 +31,32 @@ class TestFixtures(unittest.TestCase):
                       "1373_lig_cg.pdb,1114_lig_cg.pdb,0_lig_cg.pdb"]
         ids = ["0000", "7", "17482891", "1373", "1114", "0"]
         self.assertTrue(ids, list(map(extract_id, to_extract)))
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration("3600"), 3600)
+        self.assertEqual(parse_duration("1:30"), 90)
+        self.assertEqual(parse_duration("22:30:00"), 81000)
+
+    def test_load_nparray(self):
+        """
+        Molecules saved in binary or in text should be loaded identically.
+
+        """
+        folder = tempfile.mkdtemp()
+        molecule = np.array([[17.186, -28.155, -12.495, 1, 0, 1, 0],
+                             [-1., 0.05, 100.1, 0, 1, 1, 0]], dtype=np.float32)
+
+        binary_file = os.path.join(folder, "0001_pro_cg.npy")
+        text_file = os.path.join(folder, "0002_pro_cg.csv")
+        save_nparray(binary_file, molecule)
+        np.savetxt(text_file, molecule, fmt="%.16f")
+
+        np.testing.assert_array_equal(load_nparray(binary_file), molecule)
+        np.testing.assert_array_equal(load_nparray(text_file), molecule)
+
+        # Old folders extracted in text are still read
+        np.testing.assert_array_equal(load_nparray(os.path.join(folder, "0002_pro_cg.npy")), molecule)
+
+        for file in os.listdir(folder):
+            os.remove(os.path.join(folder, file))
+        os.rmdir(folder)
@@ -0,0 +1,37 @@
+import unittest
+import warnings
+warnings.simplefilter("ignore")
+
+from code.discretization import RelativeCubeRepresentation, ContactFingerprintRepresentation
+from code.models import check_input_shape, models_available_names
+
+
+class ModelsTest(unittest.TestCase):
+    """
+    Testing the choice of models for representations.
+
+    """
+
+    def test_check_input_shape(self):
+        """
+        ContactNet should only take fingerprints, and the other models only cubes.
+        """
+        cube_shape = RelativeCubeRepresentation(length_cube_side=12).get_cube_shape()
+        fingerprint_shape = ContactFingerprintRepresentation().get_cube_shape()
+
+        for model in models_available_names:
+            if model == "ContactNet":
+                check_input_shape(model, fingerprint_shape)
+                with self.assertRaises(ValueError):
+                    check_input_shape(model, cube_shape)
+            else:
+                check_input_shape(model, cube_shape)
+                with self.assertRaises(ValueError):
+                    check_input_shape(model, fingerprint_shape)
+
+        with self.assertRaises(ValueError):
+            check_input_shape(len(models_available_names), cube_shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
+import os
+import tempfile
 import unittest
 import numpy as np
 import warnings
 warnings.simplefilter("ignore")
 
-from code.extraction_data import build_molecule_features
+from code.extraction_data import build_molecule_features, read_pdb, read_pdb_predict
 
 
 class TestMolecule(unittest.TestCase):
@@ -16,6 +18,7 @@ class TestMolecule(unittest.TestCase):
         self.x_list = [1, 2, 3]
         self.y_list = [1, 5, 4]
         self.z_list = [-1, 0, 2]
+        self.coords = np.array([self.x_list, self.y_list, self.z_list]).T
         self.atom_types = ['C', 'N', 'O']
         self.is_hydrophobic_m = [1, 0, 0]
         self.is_polar_m = [0, 1, 1]
@@ -29,7 +32,7 @@ class TestMolecule(unittest.TestCase):
         is_protein_m = [1, 1, 1]
         is_ligand_m = [0, 0, 0]
 
-        extracted_molecule = build_molecule_features(self.x_list, self.y_list, self.z_list, self.atom_types, is_protein)
+        extracted_molecule = build_molecule_features(self.coords, self.atom_types, is_protein)
         molecule_from_protein = np.array([self.x_list, self.y_list, self.z_list,
                                           self.is_hydrophobic_m, self.is_polar_m, is_protein_m, is_ligand_m]).T
 
@@ -41,7 +44,7 @@ class TestMolecule(unittest.TestCase):
         is_protein_m = [0, 0, 0]
         is_ligand_m = [1, 1, 1]
 
-        extracted_molecule = build_molecule_features(self.x_list, self.y_list, self.z_list, self.atom_types, is_protein)
+        extracted_molecule = build_molecule_features(self.coords, self.atom_types, is_protein)
         molecule_from_ligand = np.array([self.x_list, self.y_list, self.z_list,
                                          self.is_hydrophobic_m, self.is_polar_m, is_protein_m, is_ligand_m]).T
 
@@ -53,7 +56,7 @@ class TestMolecule(unittest.TestCase):
         is_hydrophobic_m = [1, 1, 1]
         is_polar_m = [0, 0, 0]
 
-        extracted_molecule = build_molecule_features(self.x_list, self.y_list, self.z_list, atom_types, self.is_protein)
+        extracted_molecule = build_molecule_features(self.coords, atom_types, self.is_protein)
         molecule_hydro = np.array([self.x_list, self.y_list, self.z_list,
                                    is_hydrophobic_m, is_polar_m, self.is_protein_m, self.is_ligand_m]).T
 
@@ -65,12 +68,51 @@ class TestMolecule(unittest.TestCase):
         is_hydrophobic_m = [0, 0, 0]
         is_polar_m = [1, 1, 1]
 
-        extracted_molecule = build_molecule_features(self.x_list, self.y_list, self.z_list, atom_types, self.is_protein)
+        extracted_molecule = build_molecule_features(self.coords, atom_types, self.is_protein)
         molecule_polar = np.array([self.x_list, self.y_list, self.z_list,
                                    is_hydrophobic_m, is_polar_m, self.is_protein_m, self.is_ligand_m]).T
 
         np.testing.assert_array_equal(extracted_molecule, molecule_polar)
 
 
+class TestReadPdb(unittest.TestCase):
+    """
+    Testing the parsing of original files.
+
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for file in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, file))
+        os.rmdir(self.folder)
+
+    def test_read_pdb(self):
+        file_name = os.path.join(self.folder, "0001_lig_cg.pdb")
+        with open(file_name, "w") as f:
+            f.write("ATOM      2  CA  HIS A   0      17.186 -28.155 -12.495  1.00 26.12           C\n")
+            f.write("ATOM      3  O   HIS A   0      -1.000   0.050 100.100  1.00 26.12           O1-\n")
+
+        coords, atom_types = read_pdb(file_name)
+
+        np.testing.assert_array_equal(coords, np.array([[17.186, -28.155, -12.495],
+                                                        [-1., 0.05, 100.1]], dtype=np.float32))
+        self.assertEqual(list(atom_types), [b"C", b"O1-"])
+
+    def test_read_pdb_predict(self):
+        file_name = os.path.join(self.folder, "0001_lig_cg.pdb")
+        with open(file_name, "w") as f:
+            f.write("17.186\t-28.155\t-12.495\tC\n")
+            f.write("-1.0\t0.05\t100.1\tO1-\n")
+
+        coords, atom_types = read_pdb_predict(file_name)
+
+        np.testing.assert_array_equal(coords, np.array([[17.186, -28.155, -12.495],
+                                                        [-1., 0.05, 100.1]], dtype=np.float32))
+        self.assertEqual(list(atom_types), [b"C", b"O1-"])
+
+
 if __name__ == '__main__':
     unittest.main()
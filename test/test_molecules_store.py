@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+from code.create_examples import create_examples
+from code.molecules_store import MoleculesStore, write_molecules_store, load_molecule, list_systems, PROTEIN, LIGAND, \
+    load_manifest, manifest_names, MANIFEST_FILE_NAME, get_molecules_store
+from code.pipeline_fixtures import save_nparray
+
+
+class MoleculesStoreTest(unittest.TestCase):
+    """
+    Testing the consolidated store of molecules.
+
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        random_state = np.random.RandomState(1337)
+        self.molecules = dict()
+        for system in ["0001", "0002", "0010"]:
+            for kind, suffix in [(PROTEIN, "_pro_cg.npy"), (LIGAND, "_lig_cg.npy")]:
+                nb_atoms = random_state.randint(1, 30)
+                molecule = np.zeros((nb_atoms, 7), dtype=np.float32)
+                molecule[:, 0:3] = random_state.randn(nb_atoms, 3)
+                molecule[:, 3] = random_state.randint(0, 2, nb_atoms)
+                molecule[:, 4] = 1 - molecule[:, 3]
+                molecule[:, 5 + kind] = 1
+                self.molecules[(system, kind)] = molecule
+                save_nparray(os.path.join(self.folder, system + suffix), molecule)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_store_content(self):
+        """
+        Molecules read from the store should be the ones of the files.
+
+        """
+        self.assertFalse(MoleculesStore.exists(self.folder))
+        self.assertEqual(write_molecules_store(self.folder), 3)
+        self.assertTrue(MoleculesStore.exists(self.folder))
+
+        # Files of the store are not systems
+        self.assertEqual(list_systems(self.folder), {"0001", "0002", "0010"})
+
+        store = MoleculesStore(self.folder)
+        np.testing.assert_array_equal(store.get_systems(), [1, 2, 10])
+        for (system, kind), molecule in self.molecules.items():
+            np.testing.assert_array_equal(store.get_molecule(system, kind), molecule)
+            np.testing.assert_array_equal(load_molecule(self.folder, system, kind), molecule)
+            self.assertEqual(store.get_nb_atoms(system, kind), molecule.shape[0])
+
+    def test_store_views(self):
+        """
+        Molecules should be views of the table of atoms, and a store written again should be opened again.
+
+        """
+        write_molecules_store(self.folder)
+        store = get_molecules_store(self.folder)
+        self.assertIs(get_molecules_store(self.folder), store)
+
+        molecule = store.get_molecule("0002", PROTEIN)
+        self.assertIsInstance(molecule, np.memmap)
+        self.assertFalse(molecule.flags.writeable)
+
+        # Rewriting a molecule and the store in the same process
+        new_molecule = self.molecules[("0002", PROTEIN)] + 1
+        save_nparray(os.path.join(self.folder, "0002_pro_cg.npy"), new_molecule)
+        write_molecules_store(self.folder)
+
+        np.testing.assert_array_equal(get_molecules_store(self.folder).get_molecule("0002", PROTEIN), new_molecule)
+
+    def test_manifest(self):
+        """
+        The manifests of materialized, sharded and virtual examples should describe the same examples.
+
+        """
+        examples_folder = os.path.join(self.folder, "examples")
+        create_examples(self.folder, examples_folder, nb_neg=2)
+        manifest = load_manifest(examples_folder)
+
+        examples_files = sorted(file for file in os.listdir(examples_folder) if file.endswith(".csv"))
+        self.assertEqual(manifest_names(manifest), examples_files)
+        np.testing.assert_array_equal(manifest["label"], manifest["protein"] == manifest["ligand"])
+        for example in manifest:
+            system, other_system = f"{example['protein']:04d}", f"{example['ligand']:04d}"
+            self.assertEqual(example["nb_protein_atoms"], self.molecules[(system, PROTEIN)].shape[0])
+            self.assertEqual(example["nb_ligand_atoms"], self.molecules[(other_system, LIGAND)].shape[0])
+            self.assertEqual(example["nb_bytes"],
+                             os.path.getsize(os.path.join(examples_folder, f"{system}_{other_system}.csv")))
+
+        # Without its manifest, a folder is listed
+        os.remove(os.path.join(examples_folder, MANIFEST_FILE_NAME))
+        listed_manifest = load_manifest(examples_folder)
+        np.testing.assert_array_equal(listed_manifest[["protein", "ligand", "label"]],
+                                      manifest[["protein", "ligand", "label"]])
+
+        sharded_folder = os.path.join(self.folder, "sharded_examples")
+        for shard_index in range(2):
+            create_examples(self.folder, sharded_folder, nb_neg=2, shard_index=shard_index, nb_shards=2)
+        np.testing.assert_array_equal(load_manifest(sharded_folder), manifest)
+
+        virtual_folder = os.path.join(self.folder, "virtual_examples")
+        create_examples(self.folder, virtual_folder, nb_neg=2, virtual=True)
+        virtual_manifest = load_manifest(virtual_folder)
+        for field in ["protein", "ligand", "label", "nb_protein_atoms", "nb_ligand_atoms"]:
+            np.testing.assert_array_equal(virtual_manifest[field], manifest[field])
+
+
+if __name__ == '__main__':
+    unittest.main()
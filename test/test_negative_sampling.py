@@ -0,0 +1,242 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+from code.negative_sampling import sample_negatives
+from code.create_examples import create_examples
+from code.discretization import RelativeCubeRepresentation
+from code.examples_iterator import ExamplesIterator, NegativesSampler, HardNegativesSampler, RotatingNegativesSampler, \
+    stratified_subset
+from code.molecules_store import PROTEIN, LIGAND
+from code.pipeline_fixtures import save_nparray, is_positive
+
+
+class NegativeSamplingTest(unittest.TestCase):
+    """
+    Testing the sampling of negative examples.
+
+    """
+
+    def setUp(self):
+        self.systems = [f"{system:04d}" for system in range(1, 1200, 3)]
+
+    def test_negatives_are_other_distinct_systems(self):
+        """
+        Each protein should get `nb_neg` distinct negatives, none being its own ligand.
+        """
+        nb_neg = 40
+        negatives = sample_negatives(self.systems, nb_neg, seed=1337)
+
+        self.assertEqual(negatives.shape, (len(self.systems), nb_neg))
+        for row, protein_negatives in enumerate(negatives):
+            self.assertEqual(len(set(protein_negatives)), nb_neg)
+            self.assertNotIn(row, protein_negatives)
+
+    def test_all_negatives(self):
+        """
+        With the maximum number of negatives, every other ligand should be used once.
+        """
+        negatives = sample_negatives(self.systems, len(self.systems) - 1, seed=1337)
+
+        for row, protein_negatives in enumerate(negatives):
+            self.assertEqual(sorted(protein_negatives), [i for i in range(len(self.systems)) if i != row])
+
+    def test_reproducible(self):
+        """
+        The same seed should give the same negatives, another seed other negatives.
+        """
+        negatives = sample_negatives(self.systems, 10, seed=1337)
+
+        np.testing.assert_array_equal(negatives, sample_negatives(self.systems, 10, seed=1337))
+        self.assertFalse(np.array_equal(negatives, sample_negatives(self.systems, 10, seed=1338)))
+
+    def test_sharding(self):
+        """
+        Negatives of a subset of proteins, in any order, should be the ones computed for all the proteins.
+        """
+        negatives = sample_negatives(self.systems, 10, seed=1337)
+
+        nb_shards = 3
+        for shard_index in range(nb_shards):
+            proteins = self.systems[shard_index::nb_shards][::-1]
+            np.testing.assert_array_equal(sample_negatives(self.systems, 10, seed=1337, proteins=proteins),
+                                          negatives[shard_index::nb_shards][::-1])
+
+
+class NegativesSamplersTest(unittest.TestCase):
+    """
+    Testing the selection of negatives examples used by `ExamplesIterator`.
+
+    """
+
+    def setUp(self):
+        self.negatives_pool = {protein: [f"{protein:04d}_{ligand:04d}.csv"
+                                         for ligand in range(1, 8) if ligand != protein]
+                               for protein in range(1, 8)}
+
+    def test_first_negatives(self):
+        """
+        By default, the first negatives examples of each protein should be selected.
+        """
+        selected_files = NegativesSampler().select(self.negatives_pool, 2)
+
+        self.assertEqual(selected_files, [file for files in self.negatives_pool.values() for file in files[0:2]])
+
+    def test_hard_negatives(self):
+        """
+        The negatives examples with the highest scores should be selected, then the ones not scored.
+        """
+        sampler = HardNegativesSampler()
+        self.assertEqual(sampler.select(self.negatives_pool, 2), NegativesSampler().select(self.negatives_pool, 2))
+
+        sampler.update_scores(["0001_0005.csv", "0001_0007.csv", "0001_0002.csv"], np.array([0.9, 0.1, 0.5]))
+        selected_files = sampler.select(self.negatives_pool, 4)
+
+        self.assertEqual(selected_files[0:4], ["0001_0005.csv", "0001_0002.csv", "0001_0007.csv", "0001_0003.csv"])
+        self.assertEqual(len(selected_files), 4 * len(self.negatives_pool))
+
+    def test_rotating_negatives(self):
+        """
+        Each selection should have distinct negatives examples, and all of them should be seen over the epochs.
+        """
+        np.random.seed(1337)
+        sampler = RotatingNegativesSampler()
+
+        seen_files = []
+        for epoch in range(3):
+            selected_files = sampler.select(self.negatives_pool, 4)
+            self.assertEqual(len(selected_files), 4 * len(self.negatives_pool))
+            self.assertEqual(len(set(selected_files)), len(selected_files))
+            seen_files.extend(selected_files)
+
+        all_files = {file for files in self.negatives_pool.values() for file in files}
+        self.assertEqual(set(seen_files), all_files)
+
+
+class RotatingExamplesIteratorTest(unittest.TestCase):
+    """
+    Testing the rotation of negatives examples in `ExamplesIterator`.
+
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        extracted_folder = os.path.join(self.folder, "extracted")
+        self.examples_folder = os.path.join(self.folder, "examples")
+        os.makedirs(extracted_folder)
+
+        random_state = np.random.RandomState(1337)
+        for system in range(1, 11):
+            for kind, suffix in [(PROTEIN, "_pro_cg.npy"), (LIGAND, "_lig_cg.npy")]:
+                molecule = np.zeros((5, 7), dtype=np.float32)
+                molecule[:, 0:3] = random_state.randn(5, 3)
+                molecule[:, 3] = 1
+                molecule[:, 5 + kind] = 1
+                save_nparray(os.path.join(extracted_folder, f"{system:04d}{suffix}"), molecule)
+
+        create_examples(extracted_folder, self.examples_folder, nb_neg=6, virtual=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_rotation(self):
+        """
+        Labels and files should stay consistent when negatives examples change at the end of each epoch.
+        """
+        np.random.seed(1337)
+        examples_iterator = ExamplesIterator(RelativeCubeRepresentation(length_cube_side=20), self.examples_folder,
+                                             batch_size=8, nb_neg=2, negatives_sampler=RotatingNegativesSampler())
+        nb_batches = len(examples_iterator)
+
+        seen_files = set()
+        for epoch in range(3):
+            files = examples_iterator.get_examples_files()
+            labels = examples_iterator.get_labels()
+
+            self.assertEqual(len(examples_iterator), nb_batches)
+            self.assertEqual(len(files), 10 * (1 + 2))
+            self.assertEqual(list(labels), [1 * is_positive(file) for file in files])
+            seen_files.update(files)
+
+            examples_iterator.on_epoch_end()
+
+        self.assertEqual(len(seen_files), 10 * (1 + 6))
+
+    def test_generate_batches(self):
+        """
+        Negatives examples should only change when the first batch of the next epoch is requested.
+        """
+        np.random.seed(1337)
+        examples_iterator = ExamplesIterator(RelativeCubeRepresentation(length_cube_side=20), self.examples_folder,
+                                             batch_size=8, nb_neg=2, negatives_sampler=RotatingNegativesSampler())
+        batches = examples_iterator.generate_batches()
+
+        previous_files = None
+        for epoch in range(3):
+            for index in range(len(examples_iterator)):
+                cubes, ys = next(batches)
+                if index == 0:
+                    files = examples_iterator.get_examples_files()
+                    self.assertNotEqual(files, previous_files)
+                self.assertEqual(examples_iterator.get_examples_files(), files)
+                np.testing.assert_array_equal(ys, [1 * is_positive(file)
+                                                   for file in examples_iterator.get_batch_files(index)])
+
+            # The end of the epoch, callbacks included
+            self.assertEqual(examples_iterator.get_examples_files(), files)
+            previous_files = files
+
+    def test_resume(self):
+        """
+        An iterator resumed from the state of another one should give the same batches in the next epochs.
+        """
+        def make_iterator():
+            return ExamplesIterator(RelativeCubeRepresentation(length_cube_side=20), self.examples_folder,
+                                    batch_size=8, nb_neg=2, negatives_sampler=RotatingNegativesSampler())
+
+        def next_epochs_batches(examples_iterator):
+            batches = []
+            for epoch in range(3):
+                examples_iterator.on_epoch_end()
+                batches.append([examples_iterator.get_batch_files(index) for index in range(len(examples_iterator))])
+            return batches
+
+        np.random.seed(1337)
+        examples_iterator = make_iterator()
+        examples_iterator.on_epoch_end()
+        state = pickle.loads(pickle.dumps(examples_iterator.get_state()))
+        batches = next_epochs_batches(examples_iterator)
+
+        np.random.seed(42)
+        resumed_iterator = make_iterator()
+        resumed_iterator.set_state(state)
+
+        self.assertEqual(next_epochs_batches(resumed_iterator), batches)
+
+    def test_subset(self):
+        """
+        A subset of examples should keep the proportion of positive examples, and stay the same over epochs.
+        """
+        labels = np.array([1] * 10 + [0] * 60)
+        subset = stratified_subset(labels, 14)
+        self.assertEqual(len(subset), 14)
+        self.assertEqual(labels[subset].sum(), 2)
+        np.testing.assert_array_equal(stratified_subset(labels, 14), subset)
+
+        examples_iterator = ExamplesIterator(RelativeCubeRepresentation(length_cube_side=20), self.examples_folder,
+                                             batch_size=8, nb_neg=6, subset_size=14)
+        files = sorted(examples_iterator.get_examples_files())
+        self.assertEqual(len(files), 14)
+        self.assertEqual(len(list(filter(is_positive, files))), 2)
+
+        examples_iterator.on_epoch_end()
+        self.assertEqual(sorted(examples_iterator.get_examples_files()), files)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import warnings
+warnings.simplefilter("ignore")
+
+from code.discretization import get_representation
+from code.sweep import load_sweep, run_sweep, SweepQueue, get_command_arguments, find_trained_model, \
+    get_trained_parameters, PENDING, RUNNING, DONE, SKIPPED, FAILED, INTERRUPTED
+
+# A training job saving a serialized model and the parameters train_cnn.py would save for its options, failing
+# for 2 negatives; with a time budget, it is first stopped after saving a checkpoint, and resumed from it
+FAKE_TRAINING = """
+import os, sys
+sys.path.insert(0, CODE_FOLDER)
+from sweep import get_trained_parameters
+options = dict()
+for argument in sys.argv[1:]:
+    if argument.startswith("--"):
+        key = argument
+        options[key] = True
+    else:
+        options[key] = argument
+if options["--nb_neg"] == "2":
+    sys.exit(1)
+job_folder = options["--job_folder"]
+checkpoint_file = os.path.join(job_folder, "checkpoint.h5")
+if "--time_budget" in options and not os.path.exists(checkpoint_file):
+    open(checkpoint_file, "w").close()
+    sys.exit(75)
+if "--time_budget" in options and "--resume" not in options:
+    sys.exit(1)
+parameters = get_trained_parameters({key[2:]: value for key, value in options.items()})
+with open(os.path.join(job_folder, "job_parameters.txt"), "w") as f:
+    f.writelines(f"{key}={value}\\n" for key, value in parameters.items())
+    f.write("kept_epoch=1\\n")
+open(os.path.join(job_folder, "job_model.h5"), "w").close()
+"""
+
+
+class SweepTest(unittest.TestCase):
+    """
+    Testing the local sweeps of training jobs.
+
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.results_folder = os.path.join(self.folder, "results")
+        self.sweep_file = os.path.join(self.folder, "sweep.json")
+        with open(self.sweep_file, "w") as f:
+            json.dump({"grid": {"model_index": [0, 1], "lr": [0.001, 0.0001], "nb_neg": [2, 5]},
+                       "options": {"nb_epochs": 3, "cube_cache": True, "max_examples": None}}, f)
+
+        code_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "code")
+        self.command = [sys.executable, "-c", FAKE_TRAINING.replace("CODE_FOLDER", repr(code_folder))]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_grid(self):
+        """
+        One job should be run per combination of the values of the grid, with all the options.
+        """
+        configurations = load_sweep(self.sweep_file)
+
+        self.assertEqual(len(configurations), 8)
+        for parameters, options in configurations:
+            self.assertEqual(sorted(parameters.keys()), ["lr", "model_index", "nb_neg"])
+            self.assertEqual(options, dict(parameters, nb_epochs=3, cube_cache=True, max_examples=None))
+
+        self.assertEqual(get_command_arguments(configurations[0][1]),
+                         ["--cube_cache", "--lr", "0.001", "--model_index", "0", "--nb_epochs", "3", "--nb_neg", "2"])
+
+    def test_run(self):
+        """
+        Jobs should all be run once, and skipped when their model is already trained, recording the epoch kept.
+        """
+        jobs = run_sweep(self.sweep_file, nb_jobs=3, nb_threads=1, results_folder=self.results_folder,
+                         command=self.command, poll_period=0.05)
+
+        self.assertEqual([job["state"] for job in jobs], [FAILED if job["parameters"]["nb_neg"] == 2 else DONE
+                                                          for job in jobs])
+        for job in jobs:
+            if job["state"] == DONE:
+                self.assertTrue(os.path.exists(os.path.join(job["results_folder"], "job_model.h5")))
+                self.assertEqual(job["kept_epoch"], 1)
+
+        # Running again: jobs done are not run again, failed ones only if asked
+        jobs = run_sweep(self.sweep_file, nb_jobs=3, nb_threads=1, results_folder=self.results_folder,
+                         command=self.command, poll_period=0.05, retry_failed=True)
+        self.assertEqual(len([job for job in jobs if job["state"] == FAILED]), 4)
+        self.assertEqual(len([job for job in jobs if job["state"] == DONE]), 4)
+
+        # With a new queue, the models trained are found in the results
+        os.remove(os.path.join(self.folder, "sweep.queue.json"))
+        jobs = run_sweep(self.sweep_file, nb_jobs=3, nb_threads=1, results_folder=self.results_folder,
+                         command=self.command, poll_period=0.05)
+        self.assertEqual([job["kept_epoch"] for job in jobs if job["state"] == SKIPPED], [1] * 4)
+
+        # Models are only found with the same options, whatever the options running the jobs: options left out
+        # are the default ones
+        for options, nb_skipped in [({"nb_epochs": 3, "cube_cache": False, "nb_loader_workers": 2}, 4),
+                                    ({"nb_epochs": 4, "cube_cache": True}, 0),
+                                    ({"cube_cache": True}, 0)]:
+            with open(self.sweep_file, "w") as f:
+                json.dump({"grid": {"model_index": [0, 1], "lr": [0.001, 0.0001], "nb_neg": [2, 5]},
+                           "options": options}, f)
+            os.remove(os.path.join(self.folder, "sweep.queue.json"))
+            jobs = run_sweep(self.sweep_file, nb_jobs=3, nb_threads=1, results_folder=self.results_folder,
+                             command=self.command, poll_period=0.05)
+            self.assertEqual(len([job for job in jobs if job["state"] == SKIPPED]), nb_skipped)
+
+    def test_default_options(self):
+        """
+        Options left out of a job should be matched with their default values.
+        """
+        options = {"model_index": 0, "optimizer": "adam", "nb_epochs": 1, "lr": 0.1, "representation": "absolute"}
+        trained_parameters = [("trained", get_trained_parameters({"model_index": 0, "optimizer": "adam"})),
+                              ("other", get_trained_parameters(options))]
+        trained_parameters = [(folder, {key: str(value) for key, value in parameters.items()})
+                              for folder, parameters in trained_parameters]
+
+        self.assertEqual(find_trained_model({"model_index": 0, "optimizer": "adam"}, trained_parameters), "trained")
+        self.assertEqual(find_trained_model({"model_index": 0, "optimizer": "adam", "nb_threads": 2},
+                                            trained_parameters), "trained")
+        self.assertIsNone(find_trained_model({"model_index": 0, "optimizer": "adam"}, trained_parameters[1:]))
+        self.assertEqual(find_trained_model(options, trained_parameters), "other")
+
+        # The resolution of absolute representations is saved even if it is the default one
+        parameters = get_trained_parameters({"representation": "absolute"})
+        representation_parameters = get_representation("absolute").get_parameters()
+        self.assertEqual(parameters["cube_resolution"], representation_parameters["cube_resolution"])
+
+    def test_interrupted(self):
+        """
+        Jobs stopped at the end of their time budget should be resumed when the sweep is run again.
+        """
+        with open(self.sweep_file, "w") as f:
+            json.dump({"grid": {"nb_neg": [2, 5, 10]}, "options": {"time_budget": "00:01"}}, f)
+
+        jobs = run_sweep(self.sweep_file, nb_jobs=3, nb_threads=1, results_folder=self.results_folder,
+                         command=self.command, poll_period=0.05)
+        self.assertEqual([job["state"] for job in jobs], [FAILED, INTERRUPTED, INTERRUPTED])
+
+        jobs = run_sweep(self.sweep_file, nb_jobs=3, nb_threads=1, results_folder=self.results_folder,
+                         command=self.command, poll_period=0.05)
+        self.assertEqual([job["state"] for job in jobs], [FAILED, DONE, DONE])
+
+    def test_queue(self):
+        """
+        Jobs running when the sweep has been stopped, or interrupted, should be pending when the queue is loaded.
+        """
+        queue_file = os.path.join(self.folder, "queue.json")
+        queue = SweepQueue(queue_file)
+        for parameters, options in load_sweep(self.sweep_file):
+            queue.add(parameters, options)
+
+        jobs = queue.get_jobs()
+        queue.set_state(jobs[0], RUNNING)
+        queue.set_state(jobs[1], DONE)
+        queue.set_state(jobs[2], INTERRUPTED)
+
+        loaded_jobs = SweepQueue(queue_file).get_jobs()
+        self.assertEqual([job["name"] for job in loaded_jobs], [job["name"] for job in jobs])
+        self.assertEqual([job["state"] for job in loaded_jobs], [PENDING, DONE] + [PENDING] * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+from code.create_examples import create_examples
+from code.discretization import RelativeCubeRepresentation, AbsoluteCubeRepresentation, PocketCubeRepresentation
+from code.examples_iterator import ExamplesIterator
+from code.molecules_store import PROTEIN, LIGAND, load_manifest, load_example
+from code.pipeline_fixtures import save_nparray, is_positive
+from code import voxelize as voxelize_module
+from code.voxelize import voxelize, Voxels, get_voxels_folder
+
+
+class VoxelizeTest(unittest.TestCase):
+    """
+    Testing the cubes precomputed for a folder of examples.
+
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.extracted_folder = extracted_folder = os.path.join(self.folder, "extracted")
+        self.examples_folder = os.path.join(self.folder, "examples")
+        self.voxels_folder = os.path.join(self.folder, "voxels")
+        os.makedirs(extracted_folder)
+
+        random_state = np.random.RandomState(1337)
+        for system in range(1, 9):
+            for kind, suffix in [(PROTEIN, "_pro_cg.npy"), (LIGAND, "_lig_cg.npy")]:
+                nb_atoms = random_state.randint(5, 50)
+                molecule = np.zeros((nb_atoms, 7), dtype=np.float32)
+                molecule[:, 0:3] = random_state.randn(nb_atoms, 3)
+                molecule[:, 3] = random_state.randint(0, 2, nb_atoms)
+                molecule[:, 4] = 1 - molecule[:, 3]
+                molecule[:, 5 + kind] = 1
+                save_nparray(os.path.join(extracted_folder, f"{system:04d}{suffix}"), molecule)
+
+        create_examples(extracted_folder, self.examples_folder, nb_neg=3)
+        self.representation = RelativeCubeRepresentation(length_cube_side=20)
+        voxelize(self.examples_folder, self.representation, self.voxels_folder, nb_workers=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_voxels(self):
+        """
+        Voxels should hold the cubes and the labels of all the examples.
+        """
+        voxels = Voxels(self.voxels_folder)
+
+        examples_files = sorted(file for file in os.listdir(self.examples_folder) if file.endswith(".csv"))
+        self.assertEqual(voxels.get_examples(), examples_files)
+        self.assertEqual(list(voxels.get_labels()), [1 * is_positive(file) for file in voxels.get_examples()])
+        self.assertEqual(voxels.get_parameters(), self.representation.get_parameters())
+
+        # Cubes are found by the ids of the protein and of the ligand of their examples, in any order
+        manifest = load_manifest(self.examples_folder)[::-1]
+        expected_cubes = self.representation.make_cubes([load_example(self.examples_folder, protein, ligand)
+                                                         for protein, ligand in zip(manifest["protein"],
+                                                                                    manifest["ligand"])])
+        np.testing.assert_array_equal(voxels.get_cubes(manifest["protein"], manifest["ligand"]), expected_cubes)
+        with self.assertRaises(KeyError):
+            voxels.get_cubes([1], [100])
+
+    def test_pair_cubes(self):
+        """
+        Voxels made protein per protein should be the cubes of the systems.
+        """
+        representation = PocketCubeRepresentation(length_cube_side=20)
+        pocket_voxels_folder = os.path.join(self.folder, "pocket_voxels")
+        voxelize(self.examples_folder, representation, pocket_voxels_folder, nb_workers=2)
+
+        manifest = load_manifest(self.examples_folder)
+        expected_cubes = representation.make_cubes([load_example(self.examples_folder, protein, ligand)
+                                                    for protein, ligand in zip(manifest["protein"],
+                                                                               manifest["ligand"])])
+        np.testing.assert_array_equal(Voxels(pocket_voxels_folder).get_cubes(manifest["protein"], manifest["ligand"]),
+                                      expected_cubes)
+
+    def test_virtual_examples(self):
+        """
+        Voxels of virtual examples should be the ones of the same examples materialized in files.
+        """
+        virtual_examples_folder = os.path.join(self.folder, "virtual_examples")
+        virtual_voxels_folder = os.path.join(self.folder, "virtual_voxels")
+        create_examples(self.extracted_folder, virtual_examples_folder, nb_neg=3, virtual=True)
+        voxelize(virtual_examples_folder, self.representation, virtual_voxels_folder, nb_workers=2)
+
+        voxels, virtual_voxels = Voxels(self.voxels_folder), Voxels(virtual_voxels_folder)
+        np.testing.assert_array_equal(virtual_voxels.get_proteins(), voxels.get_proteins())
+        np.testing.assert_array_equal(virtual_voxels.get_ligands(), voxels.get_ligands())
+        np.testing.assert_array_equal(virtual_voxels.get_cubes(voxels.get_proteins(), voxels.get_ligands()),
+                                      voxels.get_cubes(voxels.get_proteins(), voxels.get_ligands()))
+
+    def test_iterator(self):
+        """
+        Batches read from voxels should be the ones made from examples.
+        """
+        np.random.seed(1337)
+        examples_iterator = ExamplesIterator(self.representation, self.examples_folder, batch_size=5)
+        np.random.seed(1337)
+        voxels_iterator = ExamplesIterator(self.representation, self.examples_folder, batch_size=5,
+                                           voxels_folder=self.voxels_folder)
+
+        self.assertEqual(len(voxels_iterator), len(examples_iterator))
+        for index in range(len(examples_iterator)):
+            cubes, ys = voxels_iterator[index]
+            expected_cubes, expected_ys = examples_iterator[index]
+            np.testing.assert_allclose(cubes, expected_cubes, rtol=1e-6)
+            np.testing.assert_array_equal(ys, expected_ys)
+
+    def test_other_representation(self):
+        """
+        Voxels made with another representation shouldn't be used.
+        """
+        with self.assertRaises(ValueError):
+            ExamplesIterator(AbsoluteCubeRepresentation(length_cube_side=20), self.examples_folder,
+                             voxels_folder=self.voxels_folder)
+
+    def test_format_version(self):
+        """
+        Voxels made with another version of the way cubes are made shouldn't be used.
+        """
+        version = voxelize_module.CUBE_CACHE_FORMAT_VERSION
+        folder = get_voxels_folder(self.examples_folder, self.representation)
+        try:
+            voxelize_module.CUBE_CACHE_FORMAT_VERSION = version + 1
+            self.assertNotEqual(get_voxels_folder(self.examples_folder, self.representation), folder)
+            with self.assertRaises(ValueError):
+                Voxels(self.voxels_folder)
+        finally:
+            voxelize_module.CUBE_CACHE_FORMAT_VERSION = version
+
+    def test_voxels_folders(self):
+        """
+        Voxels made with different parameters should have different default folders.
+        """
+        representations = [AbsoluteCubeRepresentation(length_cube_side=20),
+                           AbsoluteCubeRepresentation(length_cube_side=20, cube_resolution=1.),
+                           AbsoluteCubeRepresentation(length_cube_side=16),
+                           AbsoluteCubeRepresentation(length_cube_side=20, cube_dtype="uint8"),
+                           AbsoluteCubeRepresentation(length_cube_side=20, density_sigma=0.5),
+                           self.representation]
+        folders = {get_voxels_folder(self.examples_folder, representation) for representation in representations}
+
+        self.assertEqual(len(folders), len(representations))
+        self.assertEqual(get_voxels_folder(self.examples_folder, RelativeCubeRepresentation(length_cube_side=20)),
+                         get_voxels_folder(self.examples_folder, self.representation))
+
+
+if __name__ == '__main__':
+    unittest.main()